@@ -0,0 +1,222 @@
+"""管理指令
+
+server 以 --admin-token 啟動後，玩家先 ADMIN LOGIN <token>，之後可以用 ADMIN <子指令>。
+子指令用 register() 登記（和 games 的註冊表一樣），各模組可以自己加。
+"""
+import hmac
+import time
+
+import eventlog
+import games
+import gateway
+import latency
+import locks
+import outbound
+import profiler
+import recorder
+import rng
+import roomtable
+import snapshot
+import store
+import wallet
+from outbound import send_line
+
+TOKEN = None
+MAX_FAILURES = 3          # 密碼錯幾次之後這條連線就不能再試
+
+_commands = {}            # name -> (fn(player, args) -> [lines], 說明)
+
+
+def configure(token=None):
+    global TOKEN
+    if token is not None:
+        TOKEN = token or None
+
+
+def register(name: str, fn, help_text: str):
+    _commands[name.upper()] = (fn, help_text)
+
+
+def handle(player, parts):
+    conn = player.conn
+    if TOKEN is None:
+        send_line(conn, "管理指令未啟用（server 需以 --admin-token 啟動）")
+        return
+
+    sub = parts[1].upper() if len(parts) > 1 else "HELP"
+    if sub == "LOGIN":
+        if player.admin_failures >= MAX_FAILURES:
+            send_line(conn, "登入失敗次數過多")
+            return
+        if len(parts) == 3 and hmac.compare_digest(parts[2].encode(), TOKEN.encode()):
+            player.admin = True
+            send_line(conn, "管理者登入成功")
+        else:
+            player.admin_failures += 1
+            print(f"[ADMIN] {player.name} 登入失敗（{player.admin_failures}）")
+            send_line(conn, "密碼錯誤")
+        return
+
+    if not player.admin:
+        send_line(conn, "請先 ADMIN LOGIN <token>")
+        return
+
+    entry = _commands.get(sub)
+    if entry is None:
+        lines = ["【ADMIN 指令】"] + [f"ADMIN {name:8} {text}" for name, (_, text) in sorted(_commands.items())]
+        send_line(conn, "\n".join(lines))
+        return
+    fn, _ = entry
+    send_line(conn, "\n".join(fn(player, parts[2:])))
+
+
+# ====== 內建的子指令 ======
+def _cmd_locks(player, args):
+    if args and args[0].upper() == "RESET":
+        locks.reset()
+        return ["lock 統計已歸零"]
+    if not locks.ENABLED:
+        return ["lock 統計未開啟（server 需以 --lock-stats 啟動）"]
+    top = int(args[0]) if args and args[0].isdigit() else 10
+    return locks.report(top)
+
+
+def _cmd_net(player, args):
+    totals, conns = outbound.queue_stats()
+    top = int(args[0]) if args and args[0].isdigit() else 10
+    lines = [f"連線數={len(conns)} 丟棄的非必要訊息={totals['dropped']} 慢速斷線={totals['slow_disconnects']}",
+             f"== 送出佇列最滿的連線（前 {top}）=="]
+    for st in sorted(conns, key=lambda s: s["pending"], reverse=True)[:top]:
+        lines.append(f"{str(st['name'] or st['addr']):20} pending={st['pending']:<8} peak={st['peak']:<8} "
+                     f"sent={st['sent']:<10} dropped={st['dropped']}")
+    return lines
+
+
+def _cmd_hops(player, args):
+    return gateway.hop_report() or ["（不是 gateway 模式，或還沒有資料）"]
+
+
+def _cmd_rooms(player, args):
+    if len(args) == 2:
+        code = args[0].upper()
+        if not args[1].isdigit() or not games.set_max_rooms(code, int(args[1])):
+            return ["用法：ADMIN ROOMS [<GAME> <上限>]"]
+        print(f"[ADMIN] {player.name} 把 {code} 房號上限改為 {args[1]}")
+        return [f"{code} 房號上限改為 {int(args[1])}（已存在的房間不受影響）"]
+
+    idle = f"空房 {roomtable.IDLE_SECONDS:g}s 後回收" if roomtable.IDLE_SECONDS > 0 else "空房不回收"
+    lines = [f"== 房間（{idle}）=="]
+    for code in games.codes():
+        game = games.get(code)
+        table = getattr(game, "rooms", None)
+        if isinstance(table, roomtable.RoomTable):
+            lines.append(f"{code:10} 上限={game.MAX_ROOMS:<6} 目前={len(table):<6} "
+                         f"建立={table.created:<8} 回收={table.reclaimed}")
+        else:
+            lines.append(f"{code:10} 上限={game.MAX_ROOMS:<6} （房間在遊戲 worker process）")
+    return lines
+
+
+def _cmd_wallet(player, args):
+    if args:
+        account = wallet.find(args[0])
+        if account is None:
+            return [f"找不到 {args[0]} 的帳戶（只看得到本 process 的連線）"]
+        top = int(args[1]) if len(args) > 1 and args[1].isdigit() else 20
+        lines = [f"== {account.name} 可用={account.balance} 保留中={account.held}（{account.holds} 筆）"
+                 f" 派彩={account.won} 輸掉={account.lost} {'' if account.consistent() else '★帳不平'} =="]
+        for e in wallet.history(account.id, top):
+            lines.append(f"#{e.seq:<8} {time.strftime('%H:%M:%S', time.localtime(e.ts))} {e.kind:8} "
+                         f"{e.amount:>+8} 可用={e.balance:<8} 保留={e.held:<6} {e.reason}")
+        return lines
+
+    totals, bad = wallet.audit()
+    lines = [f"帳戶={totals['accounts']}（已銷戶 {totals['closed']}） 可用合計={totals['balance']} "
+             f"保留中={totals['held']}（{totals['holds']} 筆）",
+             f"派彩合計={totals['won']} 輸掉合計={totals['lost']} 莊家淨收={totals['lost'] - totals['won']} "
+             f"ledger={len(wallet.ledger)} 筆",
+             "帳目一致" if not bad else "★帳不平：" + " ".join(a.name for a in bad[:20])]
+    return lines
+
+
+def _cmd_store(player, args):
+    if not store.PATH:
+        return ["玩家資料沒有存檔（server 需以 --db PATH 啟動）"]
+    if args and args[0].upper() == "FLUSH":
+        t0 = time.perf_counter()
+        ok = store.flush()
+        return [f"flush {'完成' if ok else '逾時'}（{(time.perf_counter() - t0) * 1e3:.1f}ms）"]
+    return store.report()
+
+
+def _cmd_snapshot(player, args):
+    if not snapshot.PATH:
+        return ["沒有開快照（server 需以 --snapshot PATH 啟動）"]
+    if gateway.active():
+        return [f"房間在遊戲 worker process，快照由各 worker 自己寫（{snapshot.PATH}.<GAME>-<N>）"]
+    if args and args[0].upper() == "NOW":
+        snapshot.take()
+    return snapshot.report()
+
+
+def _cmd_events(player, args):
+    if eventlog.PATH and gateway.active():
+        return [f"房間在遊戲 worker process，事件紀錄由各 worker 自己寫（{eventlog.PATH}.<GAME>-<N>.*）"]
+    return eventlog.report()
+
+
+def _cmd_record(player, args):
+    return recorder.report()
+
+
+def _cmd_stats(player, args):
+    if args and args[0].upper() == "RESET":
+        latency.reset()
+        return ["指令延遲統計已歸零"]
+    game = args[0].upper() if args else None
+    lines = latency.report(game)
+    if gateway.active():
+        lines.append("（遊戲那幾列包含 gateway 到 worker 的往返；worker 內的處理時間見 ADMIN HOPS）")
+    return lines
+
+
+def _cmd_profile(player, args):
+    if not args:
+        return profiler.report()
+    try:
+        seconds = float(args[0])
+    except ValueError:
+        return ["用法：ADMIN PROFILE [<秒數> [NAME]]"]
+    if seconds <= 0:
+        return ["秒數必須 > 0"]
+    name = args[1] if len(args) > 1 else None
+    if name is not None and not profiler.valid_name(name):
+        return [f"NAME 只能是檔名（不能有 / 或 ..），檔案寫在 --profile-dir（{profiler.DIR}）底下"]
+    if not profiler.start(seconds, name):
+        return profiler.report()
+    print(f"[ADMIN] {player.name} 開始取樣 {seconds:g}s")
+    lines = [f"開始取樣 {min(seconds, profiler.MAX_SECONDS):g}s（每 {profiler.INTERVAL * 1e3:g}ms 一次），"
+             f"完成後用 ADMIN PROFILE 看各模組的 CPU 佔比"]
+    if gateway.active():
+        lines.append("（只取樣 gateway 這個 process；遊戲邏輯跑在各遊戲 worker 裡）")
+    return lines
+
+
+def _cmd_rng(player, args):
+    if gateway.active():
+        return [f"房間在遊戲 worker process，亂數串流也在各 worker 裡（mode={rng.MODE} 預先準備={rng.AHEAD} 份/房）"]
+    return rng.report()
+
+
+register("EVENTS", _cmd_events, "           遊戲事件紀錄的寫入統計")
+register("LOCKS", _cmd_locks, "[N|RESET]  等待最久的 lock 與持有最久的位置（需 --lock-stats）")
+register("NET", _cmd_net, "[N]        送出佇列統計")
+register("HOPS", _cmd_hops, "           gateway 到各遊戲 worker 的延遲")
+register("PROFILE", _cmd_profile, "[<秒數> [NAME]] 取樣連線 thread 的 stack，寫成火焰圖用的 collapsed 檔；不帶參數看結果")
+register("RECORD", _cmd_record, "           流量錄製（--record）的統計")
+register("RNG", _cmd_rng, "           各房亂數串流與背景洗牌的統計")
+register("ROOMS", _cmd_rooms, "[<GAME> <N>] 各遊戲的房間數；帶參數時調整房號上限")
+register("SNAPSHOT", _cmd_snapshot, "[NOW]      房間狀態快照的統計；NOW 立刻拍一次")
+register("STATS", _cmd_stats, "[GAME|RESET] 各指令在 server 端的延遲（p50/p95/p99/max）；RESET 歸零")
+register("STORE", _cmd_store, "[FLUSH]    玩家資料存檔（SQLite）的寫入統計")
+register("WALLET", _cmd_wallet, "[NAME [N]] 籌碼查帳；帶名字時列出該玩家最近的 ledger")
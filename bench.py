@@ -0,0 +1,1474 @@
+"""壓力測試 / 效能量測腳本
+
+用法：python bench.py <scenario> [options]
+各 scenario 見 python bench.py -h
+"""
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ====== 共用工具 ======
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    s = sorted(samples)
+    k = min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))
+    return s[k]
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def start_server(port, *extra):
+    p = subprocess.Popen([sys.executable, os.path.join(HERE, "server.py"), "--port", str(port), *extra],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return p
+        except OSError:
+            time.sleep(0.05)
+    p.kill()
+    raise RuntimeError("server 沒有起來")
+
+
+def stop_server(p):
+    p.terminate()
+    try:
+        p.wait(5)
+    except subprocess.TimeoutExpired:
+        p.kill()
+
+
+async def _readline(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError
+    return line
+
+
+async def _hello(port, name):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 20)
+    await _readline(reader)
+    await _readline(reader)
+    writer.write(f"HELLO {name}\n".encode())
+    await _readline(reader)
+    await _readline(reader)
+    return reader, writer
+
+
+# ====== engines：thread vs asyncio ======
+async def _engine_run(port, pid, n_conns, n_active, n_cmds):
+    base = rss_kb(pid)
+    conns = []
+    for i in range(n_conns):
+        conns.append(await _hello(port, f"b{i}"))
+    await asyncio.sleep(0.5)
+    grown = rss_kb(pid) - base
+
+    lat = []
+
+    async def worker(reader, writer):
+        for _ in range(n_cmds):
+            t0 = time.perf_counter()
+            writer.write(b"WHERE\n")
+            await _readline(reader)
+            lat.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(worker(r, w) for r, w in conns[:n_active]))
+    for _, w in conns:
+        w.close()
+    return grown, lat
+
+
+def bench_engines(args):
+    for i, engine in enumerate(args.engine):
+        port = args.port + i
+        p = start_server(port, "--engine", engine)
+        try:
+            base = rss_kb(p.pid)
+            grown, lat = asyncio.run(_engine_run(port, p.pid, args.conns, args.active, args.cmds))
+        finally:
+            stop_server(p)
+        per_conn = max(grown, 1) / args.conns
+        print(f"[{engine:8}] idle RSS={base} KB  +{grown} KB for {args.conns} conns "
+              f"({per_conn:.1f} KB/conn, ~{int(1024 * 1024 / per_conn)} conns/GB)  "
+              f"p50={percentile(lat, 50) * 1e6:.0f}us p99={percentile(lat, 99) * 1e6:.0f}us "
+              f"max={max(lat) * 1e6:.0f}us ({len(lat)} cmds)")
+
+
+# ====== 不開 socket 的 in-process 量測用假連線 ======
+class FakeConn:
+    def __init__(self):
+        self.bytes = 0
+        self.msgs = 0
+
+    def enqueue(self, data, essential=True):
+        self.bytes += len(data)
+        self.msgs += 1
+
+    def sendall(self, data):
+        self.enqueue(data)
+
+
+class FakePlayer:
+    def __init__(self, name, balance=10 ** 9):
+        import wallet
+        self.conn = FakeConn()
+        self.name = name
+        self.account = wallet.open_account(self, balance)
+        self.current_game = None
+        self.current_room = None
+
+    @property
+    def balance(self):
+        return self.account.balance
+
+
+def _legacy_broadcast(conns, msg, essential=True):
+    # 改版前的作法：每個收件人各自 send_line（各自補 \n、各自 encode）
+    import outbound
+    for c in list(conns):
+        outbound.send_line(c, msg, essential)
+
+
+def _roulette_rounds(players, room_id, seconds):
+    import roulette
+    for p in players:
+        roulette.enter(p, room_id)
+    rounds = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for p in players:
+            roulette.handle_command(p, "BETR RED 1", room_id)
+        roulette.handle_command(players[0], "SPIN", room_id)
+        rounds += 1
+    for p in players:
+        roulette.remove_conn(p.conn, room_id)
+    return rounds
+
+
+def _blackjack_rounds(players, room_id, seconds):
+    import blackjack
+    for p in players:
+        blackjack.enter(p, room_id)
+    rounds = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for p in players:
+            blackjack.handle_command(p, "JOIN 1", room_id)
+        blackjack.handle_command(players[0], "START", room_id)
+        while blackjack.rooms.get(room_id).in_round:
+            for p in players:
+                blackjack.handle_command(p, "STAND", room_id)
+        rounds += 1
+    for p in players:
+        blackjack.remove_conn(p.conn, room_id)
+    return rounds
+
+
+def bench_broadcast(args):
+    import blackjack
+    import roulette
+
+    cases = [
+        ("roulette x20", roulette, _roulette_rounds, 20),
+        ("blackjack x5", blackjack, _blackjack_rounds, 5),
+    ]
+    for label, mod, run, n in cases:
+        for mode in ("per-recipient", "encode-once"):
+            original = mod.broadcast
+            if mode == "per-recipient":
+                mod.broadcast = _legacy_broadcast
+            try:
+                players = [FakePlayer(f"玩家{i}") for i in range(n)]
+                rounds = run(players, 1, args.seconds)
+            finally:
+                mod.broadcast = original
+            msgs = sum(p.conn.msgs for p in players)
+            print(f"[{label}] {mode:14} {rounds / args.seconds:9.0f} rounds/s  "
+                  f"{msgs / args.seconds:10.0f} msgs/s")
+
+
+# ====== framing：一個 segment 塞滿 pipelined 指令 ======
+def _legacy_frame(chunks):
+    # 改版前 client_thread 的作法：每塊各自 decode，再對 str buffer 反覆 split
+    buffer = ""
+    lines = []
+    for data in chunks:
+        buffer += data.decode(errors="ignore")
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            lines.append(line)
+    return lines
+
+
+def _framer_frame(chunks):
+    from framing import LineFramer
+    framer = LineFramer()
+    lines = []
+    for data in chunks:
+        framer.feed(data)
+        lines.extend(framer.lines())
+    return lines
+
+
+def bench_framing(args):
+    payload = "".join(f"BETR NUM {i % 37} 1\nHELLO 玩家{i}\n" for i in range(args.commands // 2)).encode()
+    for label, size in (("1 segment", len(payload)), ("1024B recv", 1024), ("7B recv", 7)):
+        chunks = [payload[i:i + size] for i in range(0, len(payload), size)]
+        results = {}
+        for name, fn in (("str split", _legacy_frame), ("LineFramer", _framer_frame)):
+            t0 = time.perf_counter()
+            lines = fn(chunks)
+            results[name] = lines
+            dt = time.perf_counter() - t0
+            print(f"[{label:10}] {name:10} {len(lines)} lines in {dt * 1e3:8.2f} ms "
+                  f"({len(lines) / dt:10.0f} lines/s)")
+        bad = sum(1 for a, b in zip(results["str split"], results["LineFramer"]) if a != b)
+        if bad:
+            print(f"[{label:10}] 舊作法有 {bad} 行中文被切壞")
+
+
+# ====== flood：送一大堆沒有 \n 的資料，server 記憶體要維持平的 ======
+def _probe(port):
+    s = socket.create_connection(("127.0.0.1", port), timeout=5)
+    f = s.makefile("rb")
+    f.readline()
+    f.readline()
+    s.sendall(b"HELLO probe\nWHERE\n")
+    lines = [f.readline() for _ in range(3)]
+    s.close()
+    return "LOBBY" in lines[-1].decode()
+
+
+def _dropped(port, max_line, violations):
+    s = socket.create_connection(("127.0.0.1", port), timeout=5)
+    s.sendall(b"HELLO spammer\n")
+    try:
+        for _ in range(violations + 1):
+            s.sendall(b"B" * (max_line + 10) + b"\n")
+        while s.recv(65536):
+            pass
+        return True
+    except ConnectionResetError:
+        return True
+    except socket.timeout:
+        return False
+    finally:
+        s.close()
+
+
+def bench_flood(args):
+    import framing
+
+    failed = False
+    chunk = b"A" * 65536
+    for i, engine in enumerate(args.engine):
+        port = args.port + i
+        p = start_server(port, "--engine", engine)
+        try:
+            s = socket.create_connection(("127.0.0.1", port))
+            s.sendall(b"HELLO flood\n")
+            time.sleep(0.2)
+            base = rss_kb(p.pid)
+            peak = base
+            t0 = time.perf_counter()
+            total = args.mb * 1024 * 1024
+            sent = 0
+            while sent < total:
+                s.sendall(chunk)
+                sent += len(chunk)
+                if sent % (4 * 1024 * 1024) == 0:
+                    peak = max(peak, rss_kb(p.pid))
+            dt = time.perf_counter() - t0
+            alive = _probe(port)
+            s.close()
+            dropped = _dropped(port, framing.MAX_LINE, framing.MAX_VIOLATIONS)
+        finally:
+            stop_server(p)
+
+        grown = peak - base
+        ok = grown < args.max_growth_kb and alive and dropped
+        failed |= not ok
+        print(f"[{engine:8}] {args.mb} MB 無換行資料 {args.mb / dt:7.1f} MB/s  RSS {base} -> 峰值 {peak} KB "
+              f"(+{grown} KB)  其他連線正常={alive}  重複超長被斷線={dropped}  {'PASS' if ok else 'FAIL'}")
+    if failed:
+        sys.exit(1)
+
+
+# ====== dispatch：遊戲內指令從 server 分派到遊戲模組的成本 ======
+def _legacy_resolver():
+    import big2
+    import blackjack
+    import roulette
+    import tictactoe
+
+    def resolve(code):
+        # 改版前 server.py 的 if/elif 串
+        if code == "BIG2":
+            return big2
+        elif code == "BLACKJACK":
+            return blackjack
+        elif code == "TTT":
+            return tictactoe
+        elif code == "ROULETTE":
+            return roulette
+        return None
+    return resolve
+
+
+def _ns_per_op(fn, arg, n):
+    t0 = time.perf_counter_ns()
+    for _ in range(n):
+        fn(arg)
+    return (time.perf_counter_ns() - t0) / n
+
+
+def bench_dispatch(args):
+    import games
+    import server
+
+    n = args.n
+    legacy = _legacy_resolver()
+    print("game code 解析（每次）：")
+    for code in games.codes():
+        print(f"  {code:10} if/elif={_ns_per_op(legacy, code, n):6.1f} ns  "
+              f"registry={_ns_per_op(games.get, code, n):6.1f} ns")
+
+    print("server.handle_command 遊戲內指令（未知指令，只回一行錯誤）：")
+    for i, code in enumerate(games.codes()):
+        player = server.Player(FakeConn())
+        player.name = f"d{i}"
+        server.handle_command(player, f"PLAY {code} 1")
+        cost = _ns_per_op(lambda raw: server.handle_command(player, raw), "NOOP", n)
+        server.leave_current_game(player)
+        print(f"  {code:10} {cost:8.0f} ns/command")
+
+
+# ====== coalesce：一整局大老二的 send 次數與實際送出的封包數 ======
+class _CountingSock:
+    """包住 server 端 socket，數 writer 呼叫了幾次 sendall"""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.sends = 0
+
+    def sendall(self, data):
+        self.sends += 1
+        self._sock.sendall(data)
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+def _data_segs_out(sock):
+    # struct tcp_info 的 tcpi_data_segs_out（Linux 4.6+），拿不到就回 None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 160)
+    except (OSError, AttributeError):
+        return None
+    return struct.unpack_from("I", info, 156)[0] if len(info) >= 160 else None
+
+
+def _tcp_pair(listener):
+    client = socket.create_connection(listener.getsockname())
+    server_side, _ = listener.accept()
+    threading.Thread(target=lambda: [None for _ in iter(lambda: client.recv(65536), b"")], daemon=True).start()
+    return server_side, client
+
+
+def _big2_bot_move(room, by_conn):
+    # 永遠只出單張：自由出牌出最小的一張，否則出剛好壓得過的那張，壓不過就 PASS
+    import big2
+    seat = room.seats[room.turn]
+    player = by_conn[seat.conn]
+    last = room.last_play
+    if last is None:
+        return player, f"MOVE {seat.hand[0]}"
+    for card in seat.hand:
+        if big2.card_key(card) > last.rank:
+            return player, f"MOVE {card}"
+    return player, "PASS"
+
+
+def _big2_game(mode, tag, seed, room_id=1):
+    import big2
+    import outbound
+    import rng
+    import server
+
+    outbound.configure(coalesce=mode != "legacy", nodelay=True, cork=mode == "cork")
+    listener = socket.create_server(("127.0.0.1", 0))
+    players, socks, clients = [], [], []
+    for i in range(big2.MAX_PLAYERS):
+        raw, client = _tcp_pair(listener)
+        sock = _CountingSock(raw)
+        player = server.Player(outbound.Connection(sock, ("bench", i)))
+        players.append(player)
+        socks.append(sock)
+        clients.append(client)
+    listener.close()
+
+    def run(player, line):
+        player.framer.feed(line.encode() + b"\n")
+        server._dispatch(player)
+        # 像真的 client 一樣等回覆送出去才下一個指令，不然 writer 會把好幾個指令的輸出湊在一起
+        for p in players:
+            with p.conn._cond:
+                while p.conn.pending and not p.conn.closed:
+                    p.conn._cond.wait()
+
+    rng.configure(seed=seed)
+    rng.reset()           # 三種模式在同一間房、從同一條亂數串流發到同一副牌，打同一局
+    t0 = time.perf_counter()
+    for i, player in enumerate(players):
+        run(player, f"HELLO c{tag}p{i}")
+        run(player, f"PLAY BIG2 {room_id}")
+    room = big2.rooms.get(room_id)
+    by_conn = {p.conn: p for p in players}
+    commands = 0
+    while room.started:
+        player, line = _big2_bot_move(room, by_conn)
+        run(player, line)
+        commands += 1
+    for player in players:
+        run(player, "LEAVE")
+    dt = time.perf_counter() - t0
+
+    segs = [_data_segs_out(s) for s in socks]
+    sent = sum(p.conn.sent for p in players)
+    for player, client in zip(players, clients):
+        player.conn.close()
+        client.close()
+    return commands, sum(s.sends for s in socks), None if None in segs else sum(segs), sent, dt
+
+
+def bench_coalesce(args):
+    rows = []
+    for tag, mode in enumerate(("legacy", "coalesce", "cork"), start=1):
+        commands, sends, segs, sent, dt = _big2_game(mode, tag, args.seed)
+        rows.append((mode, commands, sends, segs, sent, dt))
+    base_sends, base_segs = rows[0][2], rows[0][3]
+    print("一整局大老二（4 人、TCP_NODELAY、本機 loopback）：")
+    for mode, commands, sends, segs, sent, dt in rows:
+        seg_txt = "n/a" if segs is None else f"{segs:5}"
+        ratio = "" if segs is None or not base_segs else f" ({segs / base_segs:.0%})"
+        print(f"  {mode:8} {commands:4} 指令  send={sends:5} ({sends / base_sends:.0%})  "
+              f"封包={seg_txt}{ratio}  {sent} bytes  {dt * 1e3:.1f} ms")
+
+
+# ====== locks：同時進行的房間數 vs 吞吐量（每房一把 lock vs 全模組共用一把） ======
+_TTT_SCRIPT = [(0, "MOVE 0"), (1, "MOVE 3"), (0, "MOVE 1"), (1, "MOVE 4"), (0, "MOVE 2"),
+               (0, "REMATCH"), (1, "REMATCH")]
+
+
+def _ttt_room_loop(tag, room_id, deadline, lat, counts):
+    import server
+
+    pair = [server.Player(FakeConn()), server.Player(FakeConn())]
+
+    def run(player, line):
+        player.framer.feed(line.encode() + b"\n")
+        server._dispatch(player)
+
+    for i, player in enumerate(pair):
+        run(player, f"HELLO {tag}r{room_id}p{i}")
+        run(player, f"PLAY TTT {room_id}")
+    n = 0
+    while time.perf_counter() < deadline:
+        for who, line in _TTT_SCRIPT:
+            t0 = time.perf_counter()
+            run(pair[who], line)
+            lat.append(time.perf_counter() - t0)
+        n += len(_TTT_SCRIPT)
+    for player in pair:
+        server.leave_current_game(player)
+        server._release_name(player.name)
+    counts.append(n)
+
+
+def _locks_run(tag, n_rooms, seconds):
+    lat, counts = [], []
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=_ttt_room_loop, args=(tag, rid, deadline, lat, counts))
+               for rid in range(1, n_rooms + 1)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / seconds, lat
+
+
+def bench_locks(args):
+    import locks
+    import roomtable
+    import tictactoe
+
+    # 房間先建好、量測中不回收，才能把它們的 lock 換成共用的那一把
+    roomtable.configure(idle=0)
+    for rid in range(1, max(args.rooms) + 1):
+        with tictactoe.rooms.opened(rid):
+            pass
+    own = {rid: room.lock for rid, room in tictactoe.rooms.items()}
+    shared = locks.RoomLock("TTT", 0)
+    print(f"井字棋：每間房一條 thread 一直下棋（{args.seconds:g}s），全模組一把 lock vs 每房一把")
+    for n in args.rooms:
+        row = []
+        for mode in ("shared", "per-room"):
+            for rid, room in tictactoe.rooms.items():
+                room.lock = shared if mode == "shared" else own[rid]
+            rate, lat = _locks_run(f"{mode[0]}{n}", n, args.seconds)
+            row.append(f"{mode:8} {rate:8.0f} cmd/s p99={percentile(lat, 99) * 1e6:6.0f}us "
+                       f"max={max(lat) * 1e3:5.1f}ms")
+        print(f"  rooms={n:3}  " + "   ".join(row))
+    for rid, room in tictactoe.rooms.items():
+        room.lock = own[rid]
+
+    # 統計本身的成本：一次沒有競爭的 with lock
+    def with_cost(lock, n=200000):
+        best = None
+        for _ in range(5):
+            t0 = time.perf_counter_ns()
+            for _ in range(n):
+                with lock:
+                    pass
+            cost = (time.perf_counter_ns() - t0) / n
+            best = cost if best is None else min(best, cost)
+        return best
+
+    raw = with_cost(threading.RLock())
+    off = with_cost(locks.Lock("bench.off"))
+    locks.configure(enabled=True)
+    on = with_cost(locks.Lock("bench.on"))
+    locks.configure(enabled=False)
+    print(f"with lock 成本：threading.RLock {raw:.0f} ns  locks.Lock 統計關閉 {off:.0f} ns  統計開啟 {on:.0f} ns")
+
+
+# ====== cluster：多 worker（SO_REUSEPORT）在大量井字棋房間下的吞吐量 ======
+async def _read_until(reader, marker):
+    while True:
+        line = (await _readline(reader)).decode()
+        if marker in line:
+            return line
+
+
+async def _ttt_pair(port, tag, room_id, deadline):
+    ra, wa = await _hello(port, f"{tag}a")
+    rb, wb = await _hello(port, f"{tag}b")
+    wa.write(f"PLAY TTT {room_id}\n".encode())
+    await _read_until(ra, "提示")
+    wb.write(f"PLAY TTT {room_id}\n".encode())
+    await _read_until(rb, "提示")
+    await _read_until(ra, "輪到")
+
+    script = [(wa, 0), (wb, 3), (wa, 1), (wb, 4), (wa, 2)]
+    moves = 0
+    while time.perf_counter() < deadline:
+        for i, (w, pos) in enumerate(script):
+            w.write(f"MOVE {pos}\n".encode())
+            marker = "獲勝" if i == len(script) - 1 else "輪到"
+            await _read_until(ra, marker)
+            await _read_until(rb, marker)
+            moves += 1
+        wa.write(b"REMATCH\n")
+        await _read_until(ra, "等待對手")
+        wb.write(b"REMATCH\n")
+        await _read_until(ra, "輪到")
+        await _read_until(rb, "輪到")
+        moves += 2
+    wa.close()
+    wb.close()
+    return moves
+
+
+def _ttt_load(port, tag, room_ids, seconds):
+    async def run():
+        deadline = time.perf_counter() + seconds
+        return sum(await asyncio.gather(*(_ttt_pair(port, f"{tag}r{rid}", rid, deadline) for rid in room_ids)))
+    return asyncio.run(run())
+
+
+def bench_cluster(args):
+    import multiprocessing
+
+    rooms = list(range(1, args.rooms + 1))
+    procs = args.load_procs
+    shards = [rooms[i::procs] for i in range(procs)]
+    for i, n in enumerate(args.workers):
+        port = args.port + i
+        p = start_server(port, "--workers", str(n))
+        time.sleep(0.5)
+        try:
+            with multiprocessing.Pool(procs) as pool:
+                cmds = sum(pool.starmap(_ttt_load, [(port, f"w{n}p{j}", shard, args.seconds)
+                                                    for j, shard in enumerate(shards) if shard]))
+        finally:
+            stop_server(p)
+        print(f"[workers={n}] {args.rooms} 間井字棋房間  {cmds / args.seconds:9.0f} commands/s")
+
+
+# ====== rooms：房間狀態每間佔多少記憶體、常用存取的成本（舊 dict vs __slots__ 類別） ======
+def _legacy_rooms(room_id, players):
+    """改版前各模組 _new_room_state 的 dict，依同樣的人數填好"""
+    import locks
+
+    conns = [p.conn for p in players]
+    big2_room = {"room_id": room_id, "lock": locks.RoomLock("BIG2", room_id), "players": conns[:4],
+                 "player_objs": {p.conn: p for p in players[:4]}, "names": {p.conn: p.name for p in players[:4]},
+                 "hands": {c: [f"{r}S" for r in "3456789TJQKA2"] for c in conns[:4]}, "turn": 0,
+                 "started": True, "last_play": {"conn": conns[0], "type": "single", "cards": ["3C"], "rank": 0},
+                 "pass_count": 0, "first_round": False, "pot": 400, "paid": set(conns[:4])}
+    ttt_room = {"room_id": room_id, "lock": locks.RoomLock("TTT", room_id), "board": [" "] * 9,
+                "players": conns[:2], "names": {p.conn: p.name for p in players[:2]}, "turn": 0,
+                "active": True, "waiting_rematch": set()}
+    roulette_room = {"room_id": room_id, "lock": locks.RoomLock("ROULETTE", room_id), "players": list(players),
+                     "bets": {p: [{"type": "RED", "value": None, "amount": 1},
+                                  {"type": "NUM", "value": 7, "amount": 1}] for p in players}}
+    blackjack_room = {"room_id": room_id, "lock": locks.RoomLock("BLACKJACK", room_id),
+                      "room_players": list(players), "seated": players[:5], "bets": {p: 10 for p in players[:5]},
+                      "hands": {p: ["AS", "9D"] for p in players[:5]}, "done": set(players[:2]),
+                      "dealer": ["KC", "5H"], "deck": [], "in_round": True, "turn_idx": 2}
+    return {"BIG2": big2_room, "TTT": ttt_room, "ROULETTE": roulette_room, "BLACKJACK": blackjack_room}
+
+
+def _slotted_rooms(room_id, players):
+    """同樣的狀態用現在的 Room / Seat 類別表示"""
+    import big2
+    import blackjack
+    import roulette
+    import tictactoe
+    import wallet
+
+    b2 = big2.Room(room_id)
+    for p in players[:4]:
+        seat = big2.Seat(p)
+        seat.hand = [f"{r}S" for r in "3456789TJQKA2"]
+        seat.hold = wallet.Hold(p.account, 100, "bench")
+        b2.seats.append(seat)
+    b2.started, b2.first_round, b2.pot = True, False, 400
+    b2.last_play = big2.LastPlay(b2.seats[0], "single", ["3C"], 0)
+
+    ttt = tictactoe.Room(room_id)
+    ttt.conns = [p.conn for p in players[:2]]
+    ttt.names = [p.name for p in players[:2]]
+    ttt.active = True
+
+    rl = roulette.Room(room_id)
+    for p in players:
+        seat = roulette.Seat(p)
+        seat.bets = [roulette.Bet("RED", None, wallet.Hold(p.account, 1, "bench")),
+                     roulette.Bet("NUM", 7, wallet.Hold(p.account, 1, "bench"))]
+        rl.seats[p.conn] = seat
+
+    bj = blackjack.Room(room_id)
+    bj.room_players = {p.conn: p for p in players}
+    for i, p in enumerate(players[:5]):
+        seat = blackjack.Seat(p, wallet.Hold(p.account, 10, "bench"))
+        seat.hand = ["AS", "9D"]
+        seat.done = i < 2
+        bj.sit(seat)
+    bj.dealer, bj.in_round, bj.turn_idx = ["KC", "5H"], True, 2
+    return {"BIG2": b2, "TTT": ttt, "ROULETTE": rl, "BLACKJACK": bj}
+
+
+def _room_ops(kind, rooms, players):
+    """每個遊戲挑一個指令裡一定會做的存取"""
+    b2, ttt, rl, bj = rooms["BIG2"], rooms["TTT"], rooms["ROULETTE"], rooms["BLACKJACK"]
+    me = players[2]
+    if kind == "dict":
+        return {
+            "BIG2 輪到誰的手牌": lambda _: b2["hands"][b2["players"][b2["turn"]]],
+            "TTT 我是 X 還是 O": lambda _: ttt["players"].index(me.conn) if me.conn in ttt["players"] else None,
+            "ROULETTE 我的注": lambda _: rl["bets"].get(me, []),
+            "BLACKJACK 行動檢查": lambda _: (me in bj["seated"] and bj["seated"][bj["turn_idx"]] is me
+                                         and me not in bj["done"] and bj["hands"][me]),
+        }
+    return {
+        "BIG2 輪到誰的手牌": lambda _: b2.seats[b2.turn].hand,
+        "TTT 我是 X 還是 O": lambda _: ttt.conns.index(me.conn) if me.conn in ttt.conns else None,
+        "ROULETTE 我的注": lambda _: rl.seat_of(me),
+        "BLACKJACK 行動檢查": lambda _: ((seat := bj.seat_of(me.conn)) is not None and seat is bj.seated[bj.turn_idx]
+                                     and not seat.done and seat.hand),
+    }
+
+
+def bench_rooms(args):
+    import tracemalloc
+
+    players = [FakePlayer(f"玩家{i}") for i in range(args.players)]
+    _slotted_rooms(1, players)     # 先建一次：lock 統計的 entry 與 import 不算在房間頭上
+    _legacy_rooms(1, players)
+    for rid in range(1, args.rooms + 1):
+        _slotted_rooms(rid, players)
+
+    def bytes_per_room(build, code):
+        keep = []
+        tracemalloc.start()
+        base = tracemalloc.take_snapshot()
+        for rid in range(1, args.rooms + 1):
+            keep.append(build(rid, players)[code])    # 其他遊戲的房間建了就丟，淨增加的只有這一種
+        snap = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        return sum(st.size_diff for st in snap.compare_to(base, "filename")) / args.rooms
+
+    print(f"每間房的記憶體（{args.rooms} 間、每間坐滿，輪盤 {args.players} 人；tracemalloc）：")
+    for code in ("BIG2", "TTT", "ROULETTE", "BLACKJACK"):
+        old, new = bytes_per_room(_legacy_rooms, code), bytes_per_room(_slotted_rooms, code)
+        print(f"  {code:10} dict={old:6.0f} B  slots={new:6.0f} B  ({(new - old) * 100.0 / old:+.0f}%)")
+
+    print("常用存取（每次）：")
+    dict_ops = _room_ops("dict", _legacy_rooms(1, players), players)
+    slot_ops = _room_ops("slots", _slotted_rooms(1, players), players)
+    for name in dict_ops:
+        print(f"  {name:18} dict={_ns_per_op(dict_ops[name], None, args.n):6.1f} ns  "
+              f"slots={_ns_per_op(slot_ops[name], None, args.n):6.1f} ns")
+
+    # 21 點的觀戰者 / 輪盤的玩家：每個指令都要檢查成員，斷線要找出並移除
+    print("房間人數變多時（最後進房的那位）：")
+    for n in (10, 100, 1000):
+        crowd = [FakePlayer(f"c{i}") for i in range(n)]
+        last = crowd[-1]
+        as_list = list(crowd)
+        by_conn = {p.conn: p for p in crowd}
+
+        def leave_list(p):
+            kept = [q for q in as_list if q.conn is not p.conn]    # 改版前的 remove_conn
+            as_list[:] = kept + [p]
+
+        def leave_dict(p):
+            by_conn.pop(p.conn, None)
+            by_conn[p.conn] = p
+
+        reps = max(1000, args.n // n)
+        print(f"  {n:5} 人  成員檢查 list={_ns_per_op(lambda p: p in as_list, last, reps):8.1f} ns  "
+              f"dict={_ns_per_op(lambda p: p.conn in by_conn, last, reps):6.1f} ns   "
+              f"斷線 list={_ns_per_op(leave_list, last, reps):9.1f} ns  dict={_ns_per_op(leave_dict, last, reps):6.1f} ns")
+
+
+# ====== pickroom：大量房間時 PLAY 不帶房號（pick_room）的成本 ======
+def bench_pickroom(args):
+    import games
+    import roomtable
+    import tictactoe
+
+    roomtable.configure(idle=0)
+    games.set_max_rooms("TTT", args.rooms)
+    n_players = args.rooms * tictactoe.MAX_PLAYERS
+    legacy = {rid: tictactoe.Room(rid) for rid in range(1, args.rooms + 1)}
+
+    def legacy_pick(accept=None):
+        # 改版前：從第一間掃到有空位的那間
+        for rid, room in legacy.items():
+            if accept and not accept(rid):
+                continue
+            if len(room.conns) < tictactoe.MAX_PLAYERS:
+                return rid
+        return 1
+
+    def owned(rid):
+        return rid % 4 == 1       # 像 --workers 4 的其中一個 worker
+
+    print(f"井字棋 {args.rooms} 間房，{n_players} 人依序 PLAY TTT（不帶房號）坐滿：")
+    checkpoints = {int(n_players * f) for f in (0, 0.1, 0.5, 0.9, 0.99)}
+    players = [FakePlayer(f"s{i}") for i in range(n_players)]
+    storm = 0.0
+    for i, p in enumerate(players):
+        if i in checkpoints:
+            reps = max(20, args.n // max(1, i // 100))
+            print(f"  已坐 {i * 100.0 / n_players:5.1f}%  pick_room：掃描={_ns_per_op(legacy_pick, None, reps) / 1e3:8.1f} us"
+                  f"  索引={_ns_per_op(tictactoe.pick_room, None, args.n) / 1e3:6.1f} us"
+                  f"  （只挑 1/4 的房號：掃描={_ns_per_op(legacy_pick, owned, reps) / 1e3:8.1f} us"
+                  f"  索引={_ns_per_op(tictactoe.pick_room, owned, args.n) / 1e3:6.1f} us）")
+        t0 = time.perf_counter()
+        rid = tictactoe.pick_room()
+        tictactoe.enter(p, rid)
+        storm += time.perf_counter() - t0
+        p.current_room = rid
+        legacy[rid].conns = tictactoe.rooms.get(rid).conns    # 掃描版看同一份座位
+    print(f"  用索引坐滿全部 {args.rooms} 間：{n_players / storm:8.0f} joins/s（含 enter）")
+    for p in players:
+        tictactoe.remove_conn(p.conn, p.current_room)
+
+
+# ====== lobby：大廳 ROOMS 列表（索引切一頁 vs 每次鎖住每間房現算） ======
+def bench_lobby(args):
+    import random
+
+    import lobby
+    import locks
+    import tictactoe
+
+    rng = random.Random(1)
+    rooms = {}
+    index = lobby.GameIndex()
+    for rid in range(1, args.rooms + 1):
+        room = rooms[rid] = tictactoe.Room(rid)
+        room.conns = [None] * rng.choice((1, 2, 2, 2))
+        room.active = len(room.conns) == 2 and rng.random() < 0.9
+        index.update(rid, (len(room.conns), tictactoe.MAX_PLAYERS, room.active))
+    lock = locks.Lock("bench.lobby")
+
+    def on_demand(key, page):
+        # 沒有索引的作法：每次 ROOMS 都把每間房鎖起來看一遍
+        need_open, need_idle = lobby._FILTERS[key]
+        hits = []
+        for rid in sorted(rooms):
+            room = rooms[rid]
+            with room.lock:
+                n, active = len(room.conns), room.active
+            if (not need_open or n < tictactoe.MAX_PLAYERS) and (not need_idle or not active):
+                hits.append((rid, n, tictactoe.MAX_PLAYERS, active))
+        start = (page - 1) * lobby.PAGE_SIZE
+        return len(hits), hits[start:start + lobby.PAGE_SIZE]
+
+    def indexed(key, page):
+        with lock:
+            return index.page(key, page)
+
+    print(f"井字棋 {args.rooms} 間房，ROOMS TTT 一頁 {lobby.PAGE_SIZE} 間：")
+    for key in lobby._FILTERS:
+        for page in (1, 50):
+            assert on_demand(key, page) == indexed(key, page)
+            print(f"  {key:10} 第 {page:2} 頁  每次現算={_ns_per_op(lambda _: on_demand(key, page), None, 20) / 1e3:8.0f} us"
+                  f"  索引={_ns_per_op(lambda _: indexed(key, page), None, args.n) / 1e3:6.1f} us")
+
+    states = [(rng.choice((0, 1, 2)), tictactoe.MAX_PLAYERS, rng.random() < 0.5) for _ in range(1024)]
+    t0 = time.perf_counter_ns()
+    for i in range(args.n):
+        index.update(rng.randint(1, args.rooms), states[i & 1023])
+    print(f"  房間狀態變化時更新索引：{(time.perf_counter_ns() - t0) / args.n:.0f} ns/次")
+
+
+# ====== wallet：同時下注時的錢包吞吐量（每帳戶一把 lock vs 全域一把）與查帳 ======
+def _wallet_bets(wallet, accounts, n, seconds, counts):
+    # 一筆注 = reserve + settle（一半輸、一半贏兩倍）
+    deadline = time.perf_counter() + seconds
+    done = 0
+    while time.perf_counter() < deadline:
+        for i in range(n):
+            account = accounts[i % len(accounts)]
+            hold = wallet.reserve(account, 1, "bench")
+            wallet.settle(hold, 2 if i & 1 else 0)
+        done += n
+    counts.append(done)
+
+
+def _wallet_run(wallet, groups, seconds):
+    counts = []
+    threads = [threading.Thread(target=_wallet_bets, args=(wallet, accounts, 200, seconds, counts))
+               for accounts in groups]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / seconds
+
+
+def bench_wallet(args):
+    import locks
+    import roulette
+    import wallet
+
+    wallet.configure(ledger_size=args.ledger)
+    shared = locks.Lock("bench.wallet")
+    print(f"每筆注 reserve + settle，每條 thread 輪流用自己的 {args.accounts} 個帳戶（{args.seconds:g}s）：")
+    for n in args.threads:
+        row = []
+        for mode in ("global", "per-account"):
+            groups = [[FakePlayer(f"w{mode[0]}{n}-{t}-{i}").account for i in range(args.accounts)] for t in range(n)]
+            if mode == "global":
+                for group in groups:
+                    for account in group:
+                        account.lock = shared     # 改版前：整個模組（或整個遊戲）共用一把
+            rate = _wallet_run(wallet, groups, args.seconds)
+            row.append(f"{mode:11} {rate:9.0f} 注/s")
+        print(f"  threads={n:2}  " + "   ".join(row))
+
+    # 實際走遊戲指令：每間輪盤房一條 thread 一直 BETR + SPIN，最後查帳
+    def roulette_loop(room_id, deadline, counts):
+        players = [FakePlayer(f"r{room_id}-{i}", balance=10 ** 6) for i in range(4)]
+        for p in players:
+            roulette.enter(p, room_id)
+        bets = 0
+        while time.perf_counter() < deadline:
+            for p in players:
+                roulette.handle_command(p, "BETR RED 1", room_id)
+                roulette.handle_command(p, "BETR NUM 7 1", room_id)
+            roulette.handle_command(players[0], "SPIN", room_id)
+            bets += 2 * len(players)
+        for p in players:
+            roulette.remove_conn(p.conn, room_id)
+        counts.append(bets)
+
+    for n in args.threads:
+        counts = []
+        deadline = time.perf_counter() + args.seconds
+        threads = [threading.Thread(target=roulette_loop, args=(rid, deadline, counts)) for rid in range(1, n + 1)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print(f"  輪盤 {n:2} 間房同時下注：{sum(counts) / args.seconds:9.0f} 注/s")
+
+    t0 = time.perf_counter()
+    totals, bad = wallet.audit()
+    print(f"查帳 {totals['accounts']} 個帳戶：{(time.perf_counter() - t0) * 1e3:.1f} ms  保留中={totals['held']}  "
+          f"{'帳目一致' if not bad else f'{len(bad)} 個帳戶帳不平'}")
+    assert not bad and totals["held"] == 0
+
+    # 記帳本身的成本：直接改 balance vs 透過 wallet
+    p = FakePlayer("cost")
+    plain = {"balance": 10 ** 9}
+
+    def direct(_):
+        plain["balance"] -= 1
+        plain["balance"] += 2
+
+    def via_wallet(_):
+        wallet.settle(wallet.reserve(p.account, 1, "bench"), 2)
+
+    print(f"一筆注的成本：直接改 balance {_ns_per_op(direct, None, args.n):.0f} ns  "
+          f"wallet（含 ledger）{_ns_per_op(via_wallet, None, args.n):.0f} ns")
+
+
+# ====== store：玩家餘額寫進 SQLite（group commit）的持續寫入量與當機一致性 ======
+_STORE_CHILD = """
+import sys
+import store
+store.configure(path=sys.argv[1], interval=float(sys.argv[3]))
+names = [f"c{i}" for i in range(int(sys.argv[2]))]
+i = 0
+while True:
+    i += 1
+    for name in names:
+        store.put(name, i)
+    if i % 50 == 0:
+        store.flush()
+        print(i, flush=True)
+"""
+
+
+def _store_crash(path, n_names, interval, after):
+    """子 process 一直把每個名字改成同一個遞增的值，每 50 輪 flush 一次並回報；跑 after 秒後 SIGKILL"""
+    import random
+    import signal
+    import sqlite3
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    p = subprocess.Popen([sys.executable, "-c", _STORE_CHILD, path, str(n_names), str(interval)],
+                         cwd=HERE, stdout=subprocess.PIPE, text=True)
+    acked = 0
+    deadline = time.perf_counter() + after * random.uniform(0.5, 1.5)
+    os.set_blocking(p.stdout.fileno(), False)
+    while time.perf_counter() < deadline:
+        for line in iter(p.stdout.readline, ""):
+            acked = int(line)
+        time.sleep(0.001)
+    p.send_signal(signal.SIGKILL)
+    p.wait()
+    for line in p.stdout.read().split():
+        acked = int(line)      # kill 之前已經印出來的也算確認過
+
+    db = sqlite3.connect(path)
+    ok = db.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    values = [v for (v,) in db.execute("SELECT balance FROM players")]
+    db.close()
+    # 一批是一個 transaction：所有名字最多差一輪（寫到一半的那輪）；確認過的一定在
+    consistent = ok and len(values) in (0, n_names) and (not values or max(values) - min(values) <= 1)
+    durable = acked == 0 or (values and min(values) >= acked)
+    return consistent, durable, acked, (min(values), max(values)) if values else None
+
+
+def bench_store(args):
+    import sqlite3
+    import tempfile
+
+    import store
+    import wallet
+
+    tmp = tempfile.mkdtemp(prefix="casino-bench-")
+    path = os.path.join(tmp, "bench.db")
+
+    # 對照：每次變動自己 commit 一次（每筆都等 fsync）
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=FULL")
+    db.execute(store._SCHEMA)
+    n = 0
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        with db:
+            db.execute(store._UPSERT, (f"p{n % 1000}", n, 0, 0.0, 0.0, 0))
+        n += 1
+    db.close()
+    print(f"每筆各自 commit（synchronous=FULL）：{n / args.seconds:8.0f} 筆/s")
+
+    # group commit：多條 thread 一直下注（reserve + settle），wallet 的每次變動都交給 store
+    store.configure(path=path, interval=args.interval)
+    lat = []
+
+    def bettor(t, deadline, counts):
+        players = [FakePlayer(f"t{t}-{i}", balance=10 ** 9) for i in range(args.accounts)]
+        done = 0
+        while time.perf_counter() < deadline:
+            for p in players:
+                t0 = time.perf_counter_ns()
+                wallet.settle(wallet.reserve(p.account, 1, "bench"), 2 if done & 1 else 0)
+                if done & 63 == 0:
+                    lat.append(time.perf_counter_ns() - t0)
+                done += 1
+        counts.append(done)
+
+    counts = []
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=bettor, args=(t, deadline, counts)) for t in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    t0 = time.perf_counter()
+    store.flush()
+    st = store.stats
+    print(f"group commit（{args.threads} threads × {args.accounts} 帳戶，間隔 {args.interval * 1e3:g}ms）：")
+    print(f"  下注 {sum(counts) / args.seconds:8.0f} 注/s（每注 2 次 put）  下注 p99={percentile(lat, 99) / 1e3:.0f}us"
+          f"  max={max(lat) / 1e3:.0f}us（不等磁碟）")
+    print(f"  commit {st['commits'] / args.seconds:6.0f} 次/s  寫入 {st['rows'] / args.seconds:8.0f} 筆/s  "
+          f"平均每批 {st['rows'] / max(1, st['commits']):.0f} 筆  commit 平均 {st['commit_ns'] / max(1, st['commits']) / 1e6:.2f}ms"
+          f"  最後 flush {(time.perf_counter() - t0) * 1e3:.1f}ms")
+
+    # 當機一致性：SIGKILL 寫到一半的 process，看資料庫
+    print(f"當機測試（{args.crashes} 次 SIGKILL，每次 {args.names} 個名字）：")
+    bad = 0
+    for i in range(args.crashes):
+        consistent, durable, acked, span = _store_crash(os.path.join(tmp, f"crash{i}.db"), args.names,
+                                                        args.interval, args.crash_after)
+        bad += not (consistent and durable)
+        if not (consistent and durable) or i < 3:
+            print(f"  #{i}: 確認過的輪={acked} 資料庫裡={span} "
+                  f"{'一致' if consistent else '★不一致'} {'沒掉資料' if durable else '★確認過的資料不見了'}")
+    print(f"  {args.crashes - bad}/{args.crashes} 次通過")
+    import shutil
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ====== snapshot：大量房間時拍一次快照的成本，以及對遊戲延遲的影響 ======
+def bench_snapshot(args):
+    import tempfile
+
+    import big2
+    import games
+    import roulette
+    import snapshot
+    import tictactoe
+
+    for code in ("BIG2", "ROULETTE", "TTT"):
+        games.set_max_rooms(code, args.rooms)
+    # 輪盤每間 2 人各押兩注、大老二每 20 間一間坐滿開局、井字棋每間 2 人下到一半
+    for rid in range(1, args.rooms + 1):
+        for i in range(2):
+            p = FakePlayer(f"r{rid}-{i}", balance=10 ** 6)
+            roulette.enter(p, rid)
+            roulette.handle_command(p, "BETR RED 10", rid)
+            roulette.handle_command(p, "BETR NUM 7 5", rid)
+        ttt = [FakePlayer(f"t{rid}-{i}") for i in range(2)]
+        for p in ttt:
+            tictactoe.enter(p, rid)
+        if rid % 20 == 0:
+            for i in range(4):
+                big2.enter(FakePlayer(f"b{rid}-{i}"), rid)
+
+    tmp = tempfile.mkdtemp(prefix="casino-bench-")
+    snapshot.configure(path=os.path.join(tmp, "snap"))
+    snapshot.take()     # 先拍一次：import 與第一次開檔不算
+    takes = [snapshot.take() for _ in range(args.takes)]
+    med = sorted(takes, key=lambda st: st["capture_ns"] + st["write_ns"])[len(takes) // 2]
+    print(f"快照（{med['rooms']} 間有人的房、押著 {med['stakes']} 籌碼；{args.takes} 次取中位數）：")
+    worst = sorted(st["lock_max_ns"] for st in takes)
+    print(f"  複製 {med['capture_ns'] / 1e6:.1f}ms  序列化+寫檔 {med['write_ns'] / 1e6:.1f}ms  檔案 {med['bytes'] / 1024:.0f} KB")
+    print(f"  每次快照裡單間房 lock 持有最久：中位數 {worst[len(worst) // 2] / 1e3:.0f}us  最差 {worst[-1] / 1e3:.0f}us"
+          f"（最差通常是剛好碰上 GC）")
+
+    # 快照對遊戲的影響：一條 thread 在輪盤 1 號房一直下注，量每個指令的延遲
+    players = [FakePlayer(f"lat{i}", balance=10 ** 9) for i in range(2)]
+    for p in players:
+        roulette.enter(p, 1)
+
+    def play(deadline):
+        lat = []
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter_ns()
+            roulette.handle_command(players[0], "BETR RED 1", 1)
+            lat.append(time.perf_counter_ns() - t0)
+            if len(lat) % 200 == 0:
+                roulette.handle_command(players[0], "SPIN", 1)
+        return lat
+
+    def snapping(deadline):
+        while time.perf_counter() < deadline:
+            snapshot.take()
+
+    for label, busy in (("沒有快照", False), ("一直在拍快照", True)):
+        deadline = time.perf_counter() + args.seconds
+        t = threading.Thread(target=snapping, args=(deadline,)) if busy else None
+        if t:
+            t.start()
+        lat = play(deadline)
+        if t:
+            t.join()
+        print(f"  {label:8} 下注 p50={percentile(lat, 50) / 1e3:6.1f}us p99={percentile(lat, 99) / 1e3:7.1f}us "
+              f"max={max(lat) / 1e3:8.0f}us（{len(lat)} 次）")
+    import shutil
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+# ====== eventlog：遊戲事件紀錄的每筆成本、持續寫入量與讀回驗證 ======
+def bench_eventlog(args):
+    import shutil
+    import tempfile
+
+    import blackjack
+    import eventlog
+    import roulette
+    import tictactoe
+
+    tmp = tempfile.mkdtemp(prefix="casino-bench-")
+    path = os.path.join(tmp, "events")
+    ttt = tictactoe.Room(1)
+    ttt.conns, ttt.names = [None, None], ["alice", "bob"]
+    bj = blackjack.Room(1)
+    bj.deck = blackjack._make_deck()
+
+    def emit_ttt(_):
+        eventlog.emit("TTT", 1, "MOVE", "alice", "4", ttt)
+
+    def emit_bj(_):
+        eventlog.emit("BLACKJACK", 1, "HIT", "alice", "QS", bj)
+
+    off_ttt, off_bj = _ns_per_op(emit_ttt, None, args.n), _ns_per_op(emit_bj, None, args.n)
+    eventlog.configure(path=path, rotate_mb=args.rotate)
+    emit_ttt(None)      # 開檔、起 writer thread 不算
+    eventlog.flush()
+    print("每筆事件的成本：遊戲 thread 上的 emit（複製結果狀態）／writer thread（hash + 打包 + 寫檔）：")
+    for label, fn, off in (("井字棋", emit_ttt, off_ttt), ("21 點（整副牌）", emit_bj, off_bj)):
+        with eventlog._write_lock:      # 先擋住 writer，兩邊分開量
+            on = _ns_per_op(fn, None, args.n)
+        t0 = time.perf_counter_ns()
+        eventlog.flush()
+        drain = (time.perf_counter_ns() - t0) / args.n
+        print(f"  {label:14} 沒開={off:4.0f} ns  emit={on:5.0f} ns  writer={drain:5.0f} ns")
+
+    # 持續寫入：多條 thread 一直 emit，writer 在背景寫檔與換檔
+    def producer(t, deadline, counts):
+        room = tictactoe.Room(t)
+        room.conns, room.names = ttt.conns, ttt.names
+        done = 0
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                eventlog.emit("TTT", t, "MOVE", f"p{t}", "4", room)
+            done += 100
+        counts.append(done)
+
+    counts = []
+    backlog = 0
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=producer, args=(t, deadline, counts)) for t in range(1, args.threads + 1)]
+    for t in threads:
+        t.start()
+    while any(t.is_alive() for t in threads):
+        backlog = max(backlog, len(eventlog._queue))
+        time.sleep(0.01)
+    t0 = time.perf_counter()
+    eventlog.flush()
+    drained = time.perf_counter() - t0
+    st = eventlog.stats
+    print(f"{args.threads} threads 同時 emit {args.seconds:g}s：{sum(counts) / args.seconds:9.0f} 筆/s  "
+          f"writer 寫入 {st['bytes'] / args.seconds / 1e6:.1f} MB/s  平均每筆 {st['bytes'] / st['events']:.0f}B")
+    print(f"  佇列最多積了 {backlog} 筆  最後 flush {drained * 1e3:.0f}ms  "
+          f"換檔 {st['segments']} 個（每個 {args.rotate:g}MB）")
+
+    # 讀回：筆數與序號都要連續
+    t0 = time.perf_counter()
+    n = 0
+    for e in eventlog.stream(path):
+        n += 1
+        assert e.seq == n, (e.seq, n)
+    took = time.perf_counter() - t0
+    missing = st["events"] - n
+    print(f"讀回 {n} 筆（{len(eventlog.files(path))} 個檔）：{n / took:9.0f} 筆/s  "
+          f"{'序號連續、沒有漏' if not missing else f'★少了 {missing} 筆'}")
+
+    # 對遊戲延遲的影響：一條 thread 在輪盤房一直下注
+    def bet_latency(seconds):
+        p = FakePlayer("lat", balance=10 ** 9)
+        roulette.enter(p, 1)
+        lat = []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter_ns()
+            roulette.handle_command(p, "BETR RED 1", 1)
+            lat.append(time.perf_counter_ns() - t0)
+            if len(lat) % 20 == 0:
+                roulette.handle_command(p, "SPIN", 1)
+        roulette.remove_conn(p.conn, 1)
+        return lat
+
+    on = bet_latency(args.seconds)
+    eventlog.PATH = None
+    off = bet_latency(args.seconds)
+    for label, lat in (("沒開", off), ("開著", on)):
+        print(f"  輪盤下注 {label}：p50={percentile(lat, 50) / 1e3:5.1f}us p99={percentile(lat, 99) / 1e3:6.1f}us")
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_rng(args):
+    import random
+
+    import big2
+    import blackjack
+    import rng
+    import roulette
+
+    games_ = (("大老二", "BIG2", big2.make_deck), ("21 點", "BLACKJACK", blackjack._make_deck),
+              ("輪盤", "ROULETTE", roulette._spin))
+    system = random.SystemRandom()
+    modes = (("random 模組（舊，全部共用）", None, 0, lambda key, make: make(random)),
+             ("SystemRandom（每次 urandom）", None, 0, lambda key, make: make(system)),
+             ("room", "room", 0, rng.draw),
+             (f"room + 預先準備 {args.ahead}", "room", args.ahead, rng.draw),
+             ("secure（緩衝 urandom）", "secure", 0, rng.draw),
+             (f"secure + 預先準備 {args.ahead}", "secure", args.ahead, rng.draw))
+
+    print(f"{args.rooms} 間房輪流發牌 / 開獎，每種 {args.seconds:g}s（發牌/s；一條 thread 一直發）；"
+          f"之後每秒 {args.pace} 次大老二發牌，量 draw 本身（房間 lock 裡）的時間：")
+    print(f"  {'':30} {'大老二':>9} {'21 點':>9} {'輪盤':>9}   {'p50':>6} {'p99':>7}  當場洗")
+    for label, mode, ahead, draw in modes:
+        if mode:
+            rng.configure(mode=mode, seed=1, ahead=ahead)
+        rng.reset()
+        rates = []
+        for _, code, make in games_:
+            keys = [f"{code}#{i}" for i in range(1, args.rooms + 1)]
+            for key in keys:
+                draw(key, make)     # 建立串流不算
+            n = 0
+            deadline = time.perf_counter() + args.seconds
+            while time.perf_counter() < deadline:
+                for key in keys:
+                    draw(key, make)
+                n += len(keys)
+            rates.append(n / args.seconds)
+
+        # 真的牌局之間有空檔：背景 thread 趁這時候洗好下一副
+        keys = [f"BIG2#{i}" for i in range(1, args.rooms + 1)]
+        inline0, draws0 = rng.stats["inline"], rng.stats["draws"]
+        lat = []
+        for i in range(int(args.pace * args.seconds)):
+            t0 = time.perf_counter_ns()
+            draw(keys[i % len(keys)], big2.make_deck)
+            lat.append(time.perf_counter_ns() - t0)
+            time.sleep(1.0 / args.pace)
+        inline = f"{(rng.stats['inline'] - inline0) / max(1, rng.stats['draws'] - draws0):6.1%}" if mode else "     -"
+        print(f"  {label:30} {rates[0]:9.0f} {rates[1]:9.0f} {rates[2]:9.0f}   "
+              f"{percentile(lat, 50) / 1e3:4.1f}us {percentile(lat, 99) / 1e3:5.1f}us  {inline}")
+
+    # 預先準備只是提早產生：同一個種子，發出來的牌和當場洗的一樣
+    decks = {}
+    for ahead in (0, args.ahead):
+        rng.configure(mode="room", seed=1, ahead=ahead)
+        rng.reset()
+        got = []
+        for _ in range(200):
+            got.append(rng.draw("BIG2#1", big2.make_deck))
+            time.sleep(0.0005)
+        decks[ahead] = got
+    print("同一個種子：預先準備與當場洗發出的 200 副牌" + ("完全相同" if decks[0] == decks[args.ahead] else "★不同"))
+    rng.reset()
+
+
+def bench_stats(args):
+    import random
+
+    import games
+    import latency
+    import server
+
+    n = args.n
+    latency.reset()
+    hists = latency.rows.get("TTT") or latency.register("TTT")
+    cost = min(_ns_per_op(lambda ns: latency.record(hists, "MOVE", ns), 12345, n) for _ in range(args.rounds))
+    clock = min(_ns_per_op(lambda _: time.perf_counter_ns(), None, n) for _ in range(args.rounds))
+    print(f"latency.record 一筆：{cost:.0f} ns（另外每個指令讀兩次時鐘，各 {clock:.0f} ns）")
+
+    print(f"server.handle_command 每個指令（沒記 / 有記 / 多出來的；開關交替跑 {args.rounds} 輪取最快）：")
+    lobby = server.Player(FakeConn())
+    lobby.name = "s-lobby"
+    cases = [("大廳 WHERE", lobby, "WHERE")]
+    for i, code in enumerate(games.codes()):
+        player = server.Player(FakeConn())
+        player.name = f"s{i}"
+        server.handle_command(player, f"PLAY {code} 1")
+        cases.append((f"{code} HELP", player, "HELP"))
+    for label, player, raw in cases:
+        off = on = float("inf")
+        for _ in range(args.rounds):
+            latency.configure(enabled=False)
+            off = min(off, _ns_per_op(lambda r: server.handle_command(player, r), raw, n // args.rounds))
+            latency.configure(enabled=True)
+            on = min(on, _ns_per_op(lambda r: server.handle_command(player, r), raw, n // args.rounds))
+        print(f"  {label:16} {off:8.0f} ns  {on:8.0f} ns  +{on - off:4.0f} ns")
+        if player is not lobby:
+            server.leave_current_game(player)
+
+    # 準確度：對數常態分布的延遲（中位數 50us），直方圖的百分位 vs 排序後的真值
+    rnd = random.Random(args.seed)
+    samples = [int(rnd.lognormvariate(10.8, 1.0)) for _ in range(200000)]
+    h = latency.Histogram()
+    for ns in samples:
+        h.add(ns)
+    exact = sorted(samples)
+    print(f"準確度（{len(samples)} 筆，每個 2 的次方切 {1 << latency.SUB_BITS} 格）：")
+    for p in (50, 95, 99, 99.9):
+        true = exact[min(len(exact) - 1, int(p / 100.0 * len(exact)))]
+        est = h.percentile(p)
+        print(f"  p{p:<5g} 真值={true / 1e3:8.1f}us 直方圖={est / 1e3:8.1f}us 誤差={(est - true) / true:+.1%}")
+    print(f"  每個直方圖 {latency.BUCKETS} 格；ADMIN STATS 一次（{len(latency.histograms())} 列）"
+          f"{_ns_per_op(lambda _: latency.report(), None, 200) / 1e3:.0f}us")
+    latency.reset()
+
+
+SCENARIOS = {
+    "engines": bench_engines,
+    "broadcast": bench_broadcast,
+    "framing": bench_framing,
+    "flood": bench_flood,
+    "dispatch": bench_dispatch,
+    "cluster": bench_cluster,
+    "coalesce": bench_coalesce,
+    "locks": bench_locks,
+    "rooms": bench_rooms,
+    "pickroom": bench_pickroom,
+    "lobby": bench_lobby,
+    "wallet": bench_wallet,
+    "store": bench_store,
+    "snapshot": bench_snapshot,
+    "eventlog": bench_eventlog,
+    "rng": bench_rng,
+    "stats": bench_stats,
+}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="scenario", required=True)
+
+    sp = sub.add_parser("engines", help="比較 thread / asyncio 引擎：每 GB 連線數與 p99 指令延遲")
+    sp.add_argument("--engine", nargs="+", default=["thread", "asyncio"])
+    sp.add_argument("--conns", type=int, default=1000)
+    sp.add_argument("--active", type=int, default=50, help="同時送指令的連線數")
+    sp.add_argument("--cmds", type=int, default=200, help="每條活躍連線送幾個指令")
+    sp.add_argument("--port", type=int, default=51001)
+
+    sp = sub.add_parser("broadcast", help="廣播 encode 一次 vs 每人 encode：20 人輪盤、5 人 21 點")
+    sp.add_argument("--seconds", type=float, default=3.0)
+
+    sp = sub.add_parser("framing", help="一次 pipeline 大量指令時的切行速度（舊 str split vs LineFramer）")
+    sp.add_argument("--commands", type=int, default=10000)
+
+    sp = sub.add_parser("flood", help="壓力測試：送大量無換行資料，確認 server 記憶體不會長大")
+    sp.add_argument("--engine", nargs="+", default=["thread", "asyncio"])
+    sp.add_argument("--mb", type=int, default=256)
+    sp.add_argument("--max-growth-kb", type=int, default=4096)
+    sp.add_argument("--port", type=int, default=51011)
+
+    sp = sub.add_parser("dispatch", help="遊戲內指令的分派成本（registry vs if/elif）")
+    sp.add_argument("-n", type=int, default=200000)
+
+    sp = sub.add_parser("cluster", help="多 worker process（--workers）在大量房間下的吞吐量")
+    sp.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    sp.add_argument("--rooms", type=int, default=48, help="同時進行的井字棋房間數（每間 2 人）")
+    sp.add_argument("--seconds", type=float, default=5.0)
+    sp.add_argument("--load-procs", type=int, default=os.cpu_count() or 1, help="產生負載的 client process 數")
+    sp.add_argument("--port", type=int, default=51021)
+
+    sp = sub.add_parser("coalesce", help="一整局大老二的 send 次數 / 封包數（逐行寫出 vs 每個指令合併一次）")
+    sp.add_argument("--seed", type=int, default=2)
+
+    sp = sub.add_parser("locks", help="同時進行的房間數 vs 吞吐量（每房一把 lock vs 全模組一把）")
+    sp.add_argument("--rooms", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    sp.add_argument("--seconds", type=float, default=1.0)
+
+    sp = sub.add_parser("rooms", help="每間房的記憶體與常用存取成本（舊 dict 房間 vs __slots__ 類別）")
+    sp.add_argument("--rooms", type=int, default=1000)
+    sp.add_argument("--players", type=int, default=8, help="每間房的人數（大老二 / 井字棋 / 21 點取前幾位）")
+    sp.add_argument("-n", type=int, default=500000)
+
+    sp = sub.add_parser("pickroom", help="大量房間時 pick_room 的成本（逐間掃描 vs 人數索引）")
+    sp.add_argument("--rooms", type=int, default=10000)
+    sp.add_argument("-n", type=int, default=2000)
+
+    sp = sub.add_parser("lobby", help="大廳 ROOMS 列表的成本（每次鎖住每間房現算 vs 增量維護的索引）")
+    sp.add_argument("--rooms", type=int, default=10000)
+    sp.add_argument("-n", type=int, default=20000)
+
+    sp = sub.add_parser("wallet", help="同時下注時錢包的吞吐量（每帳戶一把 lock vs 全域一把），結束時查帳")
+    sp.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    sp.add_argument("--accounts", type=int, default=4, help="每條 thread 輪流使用的帳戶數")
+    sp.add_argument("--seconds", type=float, default=1.0)
+    sp.add_argument("--ledger", type=int, default=100000, help="ledger 保留幾筆")
+    sp.add_argument("-n", type=int, default=200000)
+
+    sp = sub.add_parser("store", help="餘額寫進 SQLite：每筆 commit vs group commit 的寫入量，以及 SIGKILL 當機一致性")
+    sp.add_argument("--threads", type=int, default=4)
+    sp.add_argument("--accounts", type=int, default=250, help="每條 thread 的帳戶數")
+    sp.add_argument("--seconds", type=float, default=3.0)
+    sp.add_argument("--interval", type=float, default=0.005, help="group commit 湊一批的等待秒數")
+    sp.add_argument("--crashes", type=int, default=10)
+    sp.add_argument("--crash-after", type=float, default=0.5, help="子 process 大約跑幾秒後 SIGKILL")
+    sp.add_argument("--names", type=int, default=200)
+
+    sp = sub.add_parser("snapshot", help="大量房間時拍一次房間快照的成本（複製 / 鎖 / 寫檔），以及對下注延遲的影響")
+    sp.add_argument("--rooms", type=int, default=2000, help="輪盤、井字棋各開幾間（大老二每 20 間開一局）")
+    sp.add_argument("--takes", type=int, default=5)
+    sp.add_argument("--seconds", type=float, default=2.0)
+
+    sp = sub.add_parser("eventlog", help="遊戲事件紀錄：emit 一筆的成本、多 thread 持續寫入量、讀回驗證，以及對下注延遲的影響")
+    sp.add_argument("--threads", type=int, default=4)
+    sp.add_argument("--seconds", type=float, default=2.0)
+    sp.add_argument("--rotate", type=float, default=16, help="每個檔寫到幾 MB 換檔")
+    sp.add_argument("-n", type=int, default=20000, help="量單筆成本時先積在佇列裡的筆數（太多會量到 GC）")
+
+    sp = sub.add_parser("rng", help="洗牌 / 開獎的亂數：各模式每秒發幾副牌，預先洗牌對房間 lock 裡時間的影響")
+    sp.add_argument("--rooms", type=int, default=100)
+    sp.add_argument("--seconds", type=float, default=1.0)
+    sp.add_argument("--ahead", type=int, default=2, help="每間房預先準備幾份")
+    sp.add_argument("--pace", type=int, default=1000, help="量延遲時每秒發幾副牌")
+
+    sp = sub.add_parser("stats", help="指令延遲直方圖：每個指令多花多少、百分位的準確度")
+    sp.add_argument("-n", type=int, default=200000)
+    sp.add_argument("--rounds", type=int, default=5)
+    sp.add_argument("--seed", type=int, default=1)
+
+    args = ap.parse_args(argv)
+    SCENARIOS[args.scenario](args)
+
+
+if __name__ == "__main__":
+    main()
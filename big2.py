@@ -1,7 +1,15 @@
 import random
-import threading
-
-lock = threading.RLock()
+import sys
+
+import eventlog
+import games
+import latency
+import locks
+import metrics
+import rng
+import roomtable
+import wallet
+from outbound import broadcast, send_line
 
 RANK_ORDER = "3456789TJQKA2"
 SUIT_ORDER = "CDHS"  # 梅花C < 方塊D < 紅心H < 黑桃S
@@ -9,72 +17,115 @@ SUIT_ORDER = "CDHS"  # 梅花C < 方塊D < 紅心H < 黑桃S
 MAX_PLAYERS = 4
 MAX_ROOMS = 20
 
+_ROUNDS_STARTED = metrics.counter("casino_rounds_started_total", "開始的牌局", game="BIG2")
+_ROUNDS_FINISHED = metrics.counter("casino_rounds_finished_total", "打完的牌局（中止的不算）", game="BIG2")
+
 # ====== 籌碼設定 ======
 BUY_IN = 100  # 上牌桌付的錢（每局開打前每人先付，贏家通吃底池）
 
 
-def send_line(conn, msg: str):
-    if conn is None:
-        return
-    if msg is None:
-        msg = ""
-    if not msg.endswith("\n"):
-        msg += "\n"
-    try:
-        conn.sendall(msg.encode())
-    except:
-        pass
-
-
 def card_key(card: str):
     r, s = card[0], card[1]
     return (RANK_ORDER.index(r), SUIT_ORDER.index(s))
 
 
-def make_deck():
+def make_deck(rng=random):
     deck = [r + s for r in RANK_ORDER for s in SUIT_ORDER]
-    random.shuffle(deck)
+    rng.shuffle(deck)
     return deck
 
 
-def _new_room_state(room_id: int):
-    return {
-        "room_id": room_id,
-        "players": [],          # [conn]
-        "player_objs": {},      # conn -> Player（由 enter() 塞進來，才能動到 balance）
-        "names": {},            # conn -> name
-        "hands": {},            # conn -> [cards]
-        "turn": 0,
-        "started": False,
-        "last_play": None,      # {"conn":..., "type":..., "cards":[...], "rank":...}
-        "pass_count": 0,
+class Seat:
+    """房間裡的一個座位（座位順序就是出牌順序）"""
+
+    __slots__ = ("conn", "player", "name", "hand", "hold")
+
+    def __init__(self, player):
+        self.conn = player.conn
+        self.player = player      # enter() 拿得到 Player 物件，存起來之後才能透過 wallet 扣/加籌碼
+        self.name = player.name
+        self.hand = []
+        self.hold = None          # 本局的 BUY_IN（wallet.Hold），還沒付就是 None
+
+
+class LastPlay:
+    __slots__ = ("seat", "type", "cards", "rank")
+
+    def __init__(self, seat, ctype, cards, rank):
+        self.seat = seat
+        self.type = ctype
+        self.cards = cards
+        self.rank = rank
+
+
+class Room:
+    __slots__ = ("room_id", "lock", "seats", "turn", "started", "last_play", "pass_count",
+                 "first_round", "pot")
+
+    def __init__(self, room_id: int):
+        self.room_id = room_id
+        self.lock = locks.RoomLock("BIG2", room_id)
+        self.seats = []           # [Seat]
+        self.turn = 0
+        self.started = False
+        self.last_play = None     # LastPlay
+        self.pass_count = 0
 
         # ====== 大老二規則/狀態 ======
-        "first_round": True,    # 第一手必須包含 3C
-        "pot": 0,               # 底池
-        "paid": set(),          # 本局已付 BUY_IN 的 conn
-    }
+        self.first_round = True   # 第一手必須包含 3C
+        self.pot = 0              # 底池
+
+    def seat_of(self, conn):
+        for seat in self.seats:
+            if seat.conn is conn:
+                return seat
+        return None
 
+    def conns(self):
+        return [seat.conn for seat in self.seats]
 
-rooms = {i: _new_room_state(i) for i in range(1, MAX_ROOMS + 1)}
+    def is_empty(self):
+        return not self.seats
 
+    def occupancy(self):
+        return len(self.seats)
 
-def _room_broadcast(room, msg):
-    for c in list(room["players"]):
-        send_line(c, msg)
+    def status(self):
+        return len(self.seats), self.started
 
+    def snapshot(self):
+        """給 snapshot.py：在房間 lock 裡呼叫，只複製狀態（之後在別的 thread 序列化）"""
+        last = self.last_play
+        return {
+            "seats": [[s.name, "".join(s.hand), s.hold.amount if s.hold else 0] for s in self.seats],
+            "turn": self.turn, "started": self.started, "pot": self.pot,
+            "pass_count": self.pass_count, "first_round": self.first_round,
+            "last_play": None if last is None else [last.seat.name, last.type, "".join(last.cards)],
+            "stakes": [[s.name, s.hold.amount] for s in self.seats if s.hold is not None],
+        }
 
-def pick_room():
-    with lock:
-        for rid, room in rooms.items():
-            if len(room["players"]) < MAX_PLAYERS:
-                return rid
-    return 1
+
+rooms = roomtable.RoomTable("BIG2", Room, MAX_PLAYERS)    # 第一次有人進來才建立，空房會被回收
+
+
+def room_lock(room_id: int):
+    """給 server 用：在這把 lock 內送出一個指令的所有輸出"""
+    room = rooms.get(room_id)
+    return room.lock if room else None
+
+
+def _room_broadcast(room, msg, essential=True):
+    broadcast(room.conns(), msg, essential)
+
+
+def pick_room(accept=None):
+    # 查人數索引，不拿任何房間的 lock：只是挑一間建議的，真的進房時 enter() 會在房間 lock 內再檢查一次
+    # 還沒建立（或已回收）的房間當作空房
+    return rooms.first_free(MAX_ROOMS, accept) or 1
 
 
 # ★ server 需要 enter() 回傳 True/False
 def enter(player, room_id: int):
-    # 這裡拿得到 Player 物件，所以把它存進 room，之後才能扣/加 balance
     return add_player(player, room_id)
 
 
@@ -86,59 +137,46 @@ def add_player(player, room_id: int):
     conn = player.conn
     name = player.name
 
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
-            send_line(conn, "【BIG2】房間不存在")
-            return False
-
-        if conn in room["players"]:
+    if room_id < 1:
+        send_line(conn, "【BIG2】房間不存在")
+        return False
+    with rooms.opened(room_id) as room:
+        if room.seat_of(conn) is not None:
             send_line(conn, f"你已在 BIG2 房間 {room_id}")
             return True
 
-        if len(room["players"]) >= MAX_PLAYERS:
+        if len(room.seats) >= MAX_PLAYERS:
             send_line(conn, f"【BIG2】房間 {room_id} 已滿（最多 {MAX_PLAYERS} 人）")
             return False
 
-        room["players"].append(conn)
-        room["player_objs"][conn] = player
-        room["names"][conn] = name
-        room["hands"][conn] = []
+        room.seats.append(Seat(player))
 
-        _room_broadcast(room, f"【BIG2#{room_id}】{name} 進入房間 ({len(room['players'])}/{MAX_PLAYERS})")
+        _room_broadcast(room, f"【BIG2#{room_id}】{name} 進入房間 ({len(room.seats)}/{MAX_PLAYERS})", essential=False)
         send_line(conn, "在房間內輸入 HELP 可查看指令")
 
-        if len(room["players"]) == MAX_PLAYERS and not room["started"]:
+        if len(room.seats) == MAX_PLAYERS and not room.started:
             start_game(room_id)
 
         return True
 
 
 def remove_player(conn, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             return
-
-        # ====== 若正在遊戲中且該玩家本局已付進桌費：退回並扣回底池 ======
-        if conn in room.get("paid", set()):
-            p = room["player_objs"].get(conn)
-            if p is not None:
-                p.balance += BUY_IN
-            room["pot"] = max(0, room.get("pot", 0) - BUY_IN)
-            room["paid"].discard(conn)
-            n = room["names"].get(conn, "Unknown")
-            _room_broadcast(room, f"【BIG2#{room_id}】{n} 離開房間，本局進桌費已退回，底池剩餘：{room['pot']}")
-
-        if conn in room["players"]:
-            name = room["names"].get(conn, "Unknown")
-            room["players"].remove(conn)
-            room["names"].pop(conn, None)
-            room["hands"].pop(conn, None)
-            room["player_objs"].pop(conn, None)
-            _room_broadcast(room, f"【BIG2#{room_id}】{name} 離開房間")
-
-        if len(room["players"]) < MAX_PLAYERS:
+        seat = room.seat_of(conn)
+        if seat is not None:
+            # ====== 若正在遊戲中且該玩家本局已付進桌費：退回並扣回底池 ======
+            if seat.hold is not None:
+                wallet.refund(seat.hold, f"BIG2#{room_id} 離開")
+                room.pot = max(0, room.pot - BUY_IN)
+                seat.hold = None
+                _room_broadcast(room, f"【BIG2#{room_id}】{seat.name} 離開房間，本局進桌費已退回，底池剩餘：{room.pot}")
+
+            room.seats.remove(seat)
+            _room_broadcast(room, f"【BIG2#{room_id}】{seat.name} 離開房間")
+
+        if len(room.seats) < MAX_PLAYERS:
             reset(room_id)
 
 
@@ -146,55 +184,49 @@ def reset(room_id: int):
     room = rooms.get(room_id)
     if not room:
         return
-    # players/names/player_objs 保留（玩家仍在房間），只重置本局狀態
-    room["hands"] = {c: [] for c in room["players"]}
-    room["turn"] = 0
-    room["started"] = False
-    room["last_play"] = None
-    room["pass_count"] = 0
-    room["first_round"] = True
-    room["pot"] = 0
-    room["paid"] = set()
+    # 座位保留（玩家仍在房間），只重置本局狀態；牌局中途散掉的話，留下來的人的進桌費退回
+    for seat in room.seats:
+        seat.hand = []
+        if seat.hold is not None:
+            wallet.refund(seat.hold, f"BIG2#{room_id} 本局中止")
+            send_line(seat.conn, f"【BIG2#{room_id}】本局中止，進桌費 {BUY_IN} 已退回")
+            seat.hold = None
+    room.turn = 0
+    room.started = False
+    room.last_play = None
+    room.pass_count = 0
+    room.first_round = True
+    room.pot = 0
 
 
 def _choose_first_turn_by_3c(room):
-    for i, c in enumerate(room["players"]):
-        if "3C" in room["hands"].get(c, []):
+    for i, seat in enumerate(room.seats):
+        if "3C" in seat.hand:
             return i
     return 0
 
 
 def _collect_buy_in(room, room_id: int) -> bool:
-    room["pot"] = 0
-    room["paid"] = set()
-
-    # 先檢查付不付得起，付不起直接踢出避免卡死
-    for c in list(room["players"]):
-        p = room["player_objs"].get(c)
-        if p is None:
-            continue
-        if p.balance < BUY_IN:
-            send_line(c, f"【BIG2#{room_id}】籌碼不足，進桌費 {BUY_IN}，你目前 {p.balance}，已被請出房間")
-            name = room["names"].get(c, "Unknown")
-            room["players"].remove(c)
-            room["names"].pop(c, None)
-            room["hands"].pop(c, None)
-            room["player_objs"].pop(c, None)
-            _room_broadcast(room, f"【BIG2#{room_id}】{name} 籌碼不足，無法入局")
-
-    if len(room["players"]) < MAX_PLAYERS:
+    room.pot = 0
+
+    # 每人先保留進桌費（檢查和扣款是同一步），付不起直接踢出避免卡死
+    for seat in list(room.seats):
+        seat.hold = wallet.reserve(seat.player.account, BUY_IN, f"BIG2#{room_id} 進桌費", "BIG2")
+        if seat.hold is None:
+            send_line(seat.conn, f"【BIG2#{room_id}】籌碼不足，進桌費 {BUY_IN}，你目前 {seat.player.balance}，已被請出房間")
+            room.seats.remove(seat)
+            _room_broadcast(room, f"【BIG2#{room_id}】{seat.name} 籌碼不足，無法入局")
+
+    if len(room.seats) < MAX_PLAYERS:
+        for seat in room.seats:
+            wallet.refund(seat.hold, f"BIG2#{room_id} 未開局")
+            seat.hold = None
         _room_broadcast(room, f"【BIG2#{room_id}】人數不足（需 {MAX_PLAYERS} 人），暫不開局")
         return False
 
-    for c in room["players"]:
-        p = room["player_objs"].get(c)
-        if p is None:
-            continue
-        p.balance -= BUY_IN
-        room["pot"] += BUY_IN
-        room["paid"].add(c)
+    room.pot = BUY_IN * len(room.seats)
 
-    _room_broadcast(room, f"【BIG2#{room_id}】本局進桌費每人 {BUY_IN}，底池：{room['pot']}（贏家通吃）")
+    _room_broadcast(room, f"【BIG2#{room_id}】本局進桌費每人 {BUY_IN}，底池：{room.pot}（贏家通吃）")
     return True
 
 
@@ -206,43 +238,39 @@ def start_game(room_id: int):
     if not _collect_buy_in(room, room_id):
         return
 
-    deck = make_deck()
-    for i, c in enumerate(room["players"]):
-        room["hands"][c] = sorted(deck[i*13:(i+1)*13], key=card_key)
+    _ROUNDS_STARTED.inc()
+    deck = rng.draw(f"BIG2#{room_id}", make_deck)
+    for i, seat in enumerate(room.seats):
+        seat.hand = sorted(deck[i*13:(i+1)*13], key=card_key)
 
-    room["turn"] = _choose_first_turn_by_3c(room)
-    room["started"] = True
-    room["last_play"] = None
-    room["pass_count"] = 0
-    room["first_round"] = True
+    room.turn = _choose_first_turn_by_3c(room)
+    room.started = True
+    room.last_play = None
+    room.pass_count = 0
+    room.first_round = True
 
     _room_broadcast(room, f"【BIG2#{room_id}】遊戲開始！")
-    for c in room["players"]:
-        send_line(c, "你的手牌：" + " ".join(room["hands"][c]))
-        p = room["player_objs"].get(c)
-        if p is not None:
-            send_line(c, f"你的籌碼：{p.balance}（底池：{room['pot']}）")
+    for seat in room.seats:
+        send_line(seat.conn, "你的手牌：" + " ".join(seat.hand))
+        send_line(seat.conn, f"你的籌碼：{seat.player.balance}（底池：{room.pot}）")
 
-    first_conn = room["players"][room["turn"]]
-    first_name = room["names"].get(first_conn, "?")
-    _room_broadcast(room, f"【BIG2#{room_id}】第一手由持有 3C 的玩家 {first_name} 先出（第一手必須包含 3C）")
+    first = room.seats[room.turn]
+    _room_broadcast(room, f"【BIG2#{room_id}】第一手由持有 3C 的玩家 {first.name} 先出（第一手必須包含 3C）")
 
     broadcast_turn(room_id)
 
 
 def broadcast_turn(room_id: int):
     room = rooms.get(room_id)
-    if not room or not room["players"]:
+    if not room or not room.seats:
         return
 
-    cur = room["players"][room["turn"]]
-    name = room["names"].get(cur, "?")
-    _room_broadcast(room, f"【BIG2#{room_id}】輪到 {name}：MOVE <cards...> 或 PASS / HAND（輸入 HELP 看指令）")
+    cur = room.seats[room.turn]
+    _room_broadcast(room, f"【BIG2#{room_id}】輪到 {cur.name}：MOVE <cards...> 或 PASS / HAND（輸入 HELP 看指令）")
 
-    last = room["last_play"]
+    last = room.last_play
     if last:
-        lname = room["names"].get(last["conn"], "?")
-        _room_broadcast(room, f"【BIG2#{room_id}】上一手：{lname} 出 {last['type']} -> {' '.join(last['cards'])}")
+        _room_broadcast(room, f"【BIG2#{room_id}】上一手：{last.seat.name} 出 {last.type} -> {' '.join(last.cards)}")
     else:
         _room_broadcast(room, f"【BIG2#{room_id}】目前無上一手（自由出牌）")
 
@@ -307,13 +335,12 @@ def handle_command(player, raw, room_id: int):
     if not parts:
         return
 
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             send_line(conn, "【BIG2】房間不存在")
             return
-
-        if conn not in room["players"]:
+        seat = room.seat_of(conn)
+        if seat is None:
             send_line(conn, f"你不在 BIG2 房間 {room_id}")
             return
 
@@ -336,7 +363,7 @@ def handle_command(player, raw, room_id: int):
 
         # ===== 任何時候都可以查 =====
         if op in ("HAND", "SHOW"):
-            send_line(conn, "你的手牌：" + " ".join(room["hands"].get(conn, [])))
+            send_line(conn, "你的手牌：" + " ".join(seat.hand))
             return
 
         if op == "CHIPS":
@@ -344,32 +371,32 @@ def handle_command(player, raw, room_id: int):
             return
 
         if op == "POT":
-            send_line(conn, f"本局底池：{room.get('pot', 0)}（進桌費 {BUY_IN}/人）")
+            send_line(conn, f"本局底池：{room.pot}（進桌費 {BUY_IN}/人）")
             return
 
-        if not room["started"]:
+        if not room.started:
             send_line(conn, f"BIG2#{room_id} 尚未開始（需 {MAX_PLAYERS} 人）")
             return
 
-        cur = room["players"][room["turn"]]
-        if conn != cur:
+        if seat is not room.seats[room.turn]:
             send_line(conn, "不是你的回合")
             return
 
         if op == "PASS":
-            if room["last_play"] is None:
+            if room.last_play is None:
                 send_line(conn, "目前無上一手，不能 PASS，請出牌")
                 return
 
-            room["pass_count"] += 1
+            room.pass_count += 1
             _room_broadcast(room, f"【BIG2#{room_id}】{name} PASS")
 
-            if room["pass_count"] >= 3:
+            if room.pass_count >= 3:
                 _room_broadcast(room, f"【BIG2#{room_id}】三人 PASS，重新自由出牌")
-                room["last_play"] = None
-                room["pass_count"] = 0
+                room.last_play = None
+                room.pass_count = 0
 
-            room["turn"] = (room["turn"] + 1) % len(room["players"])
+            room.turn = (room.turn + 1) % len(room.seats)
+            eventlog.emit("BIG2", room_id, "PASS", name, "", room)
             broadcast_turn(room_id)
             return
 
@@ -382,14 +409,14 @@ def handle_command(player, raw, room_id: int):
                 send_line(conn, "牌格式錯誤，例如：3C TD AS")
                 return
 
-            hand = room["hands"][conn]
+            hand = seat.hand
             for c in cards:
                 if c not in hand:
                     send_line(conn, f"你手上沒有 {c}")
                     return
 
             # ★ 第一手必須包含 3C
-            if room.get("first_round", False) and "3C" not in cards:
+            if room.first_round and "3C" not in cards:
                 send_line(conn, "第一手必須包含梅花三（3C）")
                 return
 
@@ -398,9 +425,9 @@ def handle_command(player, raw, room_id: int):
                 send_line(conn, "不支援的牌型（僅：單/對/三/順/葫蘆/鐵支）")
                 return
 
-            last = room["last_play"]
-            last_type = last["type"] if last else None
-            last_key = last["rank"] if last else None
+            last = room.last_play
+            last_type = last.type if last else None
+            last_key = last.rank if last else None
 
             if not better_play(ctype, ckey, last_type, last_key):
                 send_line(conn, "這手不能壓過上一手（不同牌型或大小不足）")
@@ -409,9 +436,9 @@ def handle_command(player, raw, room_id: int):
             for c in cards:
                 hand.remove(c)
 
-            room["last_play"] = {"conn": conn, "type": ctype, "cards": cards, "rank": ckey}
-            room["pass_count"] = 0
-            room["first_round"] = False
+            room.last_play = LastPlay(seat, ctype, cards, ckey)
+            room.pass_count = 0
+            room.first_round = False
 
             _room_broadcast(room, f"【BIG2#{room_id}】{name} 出 {ctype}：{' '.join(cards)}")
 
@@ -420,27 +447,31 @@ def handle_command(player, raw, room_id: int):
 
             if len(hand) == 0:
                 # ===== 贏家通吃底池 =====
-                pot = room.get("pot", 0)
+                pot = room.pot
                 _room_broadcast(room, f"【BIG2#{room_id}】{name} 勝利！遊戲結束（獲得底池 {pot}）")
 
-                winner = room["player_objs"].get(conn)
-                if winner is not None:
-                    winner.balance += pot
+                # 輸家的進桌費就是底池；贏家自己那份連同底池一起入帳
+                for s in room.seats:
+                    if s.hold is not None:
+                        wallet.settle(s.hold, pot if s is seat else 0, f"BIG2#{room_id} 結算")
+                        s.hold = None
+                room.pot = 0
+                _ROUNDS_FINISHED.inc()
+                eventlog.emit("BIG2", room_id, "MOVE", name, " ".join(cards), room)
 
-                room["pot"] = 0
-                room["paid"] = set()
-
-                for c in room["players"]:
-                    p = room["player_objs"].get(c)
-                    pname = room["names"].get(c, "?")
-                    if p is not None:
-                        send_line(c, f"【結算】{pname} 籌碼：{p.balance}")
+                for s in room.seats:
+                    send_line(s.conn, f"【結算】{s.name} 籌碼：{s.player.balance}")
 
                 reset(room_id)
                 return
 
-            room["turn"] = (room["turn"] + 1) % len(room["players"])
+            room.turn = (room.turn + 1) % len(room.seats)
+            eventlog.emit("BIG2", room_id, "MOVE", name, " ".join(cards), room)
             broadcast_turn(room_id)
             return
 
         send_line(conn, "未知指令：輸入 HELP 查看")
+
+
+games.register("BIG2", sys.modules[__name__])
+latency.register("BIG2", ("HELP", "?", "HAND", "SHOW", "CHIPS", "POT", "PASS", "MOVE"))
@@ -1,7 +1,15 @@
 import random
-import threading
-
-lock = threading.RLock()
+import sys
+
+import eventlog
+import games
+import latency
+import locks
+import metrics
+import rng
+import roomtable
+import wallet
+from outbound import broadcast, send_line
 
 RANKS = "A23456789TJQK"
 SUITS = "CDHS"
@@ -10,18 +18,8 @@ MIN_PLAYERS = 2
 MAX_PLAYERS = 5
 MAX_ROOMS = 50
 
-
-def send_line(conn, msg: str):
-    if conn is None:
-        return
-    if msg is None:
-        msg = ""
-    if not msg.endswith("\n"):
-        msg += "\n"
-    try:
-        conn.sendall(msg.encode())
-    except:
-        pass
+_ROUNDS_STARTED = metrics.counter("casino_rounds_started_total", "開始的牌局", game="BLACKJACK")
+_ROUNDS_FINISHED = metrics.counter("casino_rounds_finished_total", "打完的牌局（中止的不算）", game="BLACKJACK")
 
 
 def send_to_player(player, msg: str):
@@ -31,17 +29,13 @@ def send_to_player(player, msg: str):
         pass
 
 
-def broadcast_players(players, msg: str):
-    for p in list(players):
-        try:
-            send_line(p.conn, msg)
-        except:
-            pass
+def broadcast_players(players, msg: str, essential=True):
+    broadcast([p.conn for p in players], msg, essential)
 
 
-def _make_deck():
+def _make_deck(rng=random):
     deck = [r + s for r in RANKS for s in SUITS] * 2
-    random.shuffle(deck)
+    rng.shuffle(deck)
     return deck
 
 
@@ -63,45 +57,92 @@ def _hand_value(hand):
     return total
 
 
-def _new_room_state(room_id: int):
-    return {
-        "room_id": room_id,
-        "room_players": [],   # 在房間的人（可觀戰）
-        "seated": [],         # 參與本局
-        "bets": {},
-        "hands": {},
-        "done": set(),
-        "dealer": [],
-        "deck": [],
-        "in_round": False,
-        "turn_idx": 0,
-    }
+class Seat:
+    """參與本局的一個玩家"""
+
+    __slots__ = ("player", "hold", "hand", "done")
+
+    def __init__(self, player, hold):
+        self.player = player
+        self.hold = hold          # wallet.Hold：結算時 settle，離開 / 中止時 refund；下注額就是 hold.amount
+        self.hand = []
+        self.done = False         # 停牌 / 爆牌 / 21 點，本局不用再行動
+
+
+class Room:
+    __slots__ = ("room_id", "lock", "room_players", "seated", "dealer", "deck", "in_round", "turn_idx")
+
+    def __init__(self, room_id: int):
+        self.room_id = room_id
+        self.lock = locks.RoomLock("BLACKJACK", room_id)
+        self.room_players = {}    # conn -> Player，在房間的人（可觀戰），依進房順序
+        self.seated = []          # [Seat]，參與本局；順序就是輪流的順序（turn_idx）
+        self.dealer = []
+        self.deck = []
+        self.in_round = False
+        self.turn_idx = 0
+
+    def seat_of(self, conn):
+        # 最多 MAX_PLAYERS 個：直接掃，不另外維護 conn -> Seat 的 dict（那張表比省下的時間佔更多記憶體）
+        for seat in self.seated:
+            if seat.player.conn is conn:
+                return seat
+        return None
+
+    def sit(self, seat):
+        self.seated.append(seat)
+
+    def unseat(self, seat):
+        self.seated.remove(seat)
+
+    def is_empty(self):
+        return not self.room_players and not self.seated
+
+    def occupancy(self):
+        # 牌局進行中不能 JOIN，當作坐滿
+        return MAX_PLAYERS if self.in_round else len(self.seated)
+
+    def status(self):
+        return len(self.seated), self.in_round
+
+    def snapshot(self):
+        """給 snapshot.py：在房間 lock 裡呼叫，只複製狀態"""
+        return {
+            "players": [p.name for p in self.room_players.values()],
+            "seated": [[s.player.name, s.hold.amount, "".join(s.hand), s.done] for s in self.seated],
+            "dealer": "".join(self.dealer), "deck": "".join(self.deck),
+            "in_round": self.in_round, "turn_idx": self.turn_idx,
+            "stakes": [[s.player.name, s.hold.amount] for s in self.seated],
+        }
+
 
+rooms = roomtable.RoomTable("BLACKJACK", Room, MAX_PLAYERS)    # 第一次有人進來才建立，空房會被回收
 
-rooms = {i: _new_room_state(i) for i in range(1, MAX_ROOMS + 1)}
+
+def room_lock(room_id: int):
+    """給 server 用：在這把 lock 內送出一個指令的所有輸出"""
+    room = rooms.get(room_id)
+    return room.lock if room else None
 
 
 def _broadcast(room, msg):
-    broadcast_players(room["room_players"], msg)
+    broadcast_players(room.room_players.values(), msg)
 
 
-def pick_room():
-    with lock:
-        for rid, room in rooms.items():
-            if len(room["seated"]) < MAX_PLAYERS and not room["in_round"]:
-                return rid
-    return 1
+def pick_room(accept=None):
+    # 查人數索引，不拿任何房間的 lock：只是挑一間建議的，各房間的狀態以 enter() / JOIN 時為準
+    # 還沒建立（或已回收）的房間當作空房
+    return rooms.first_free(MAX_ROOMS, accept) or 1
 
 
 # ★server 需要 enter() 回傳 True/False
 def enter(player, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
-            send_to_player(player, "【BLACKJACK】房間不存在")
-            return False
-        if player not in room["room_players"]:
-            room["room_players"].append(player)
+    if room_id < 1:
+        send_to_player(player, "【BLACKJACK】房間不存在")
+        return False
+    with rooms.opened(room_id) as room:
+        if player.conn not in room.room_players:
+            room.room_players[player.conn] = player
 
     send_to_player(player,
                    f"你已進入【BLACKJACK#{room_id}】\n"
@@ -110,20 +151,16 @@ def enter(player, room_id: int):
 
 
 def remove_conn(conn, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             return
+        room.room_players.pop(conn, None)
 
-        rm_room = [p for p in room["room_players"] if p.conn is conn]
-        for p in rm_room:
-            room["room_players"].remove(p)
-
-        rm_seated = [p for p in room["seated"] if p.conn is conn]
-        for p in rm_seated:
-            _remove_from_round(room, p, reason="disconnect/leave")
+        seat = room.seat_of(conn)
+        if seat is not None:
+            _remove_from_round(room, seat, reason="disconnect/leave")
 
-        if room["in_round"] and len(room["seated"]) < MIN_PLAYERS:
+        if room.in_round and len(room.seated) < MIN_PLAYERS:
             _broadcast(room, f"【BLACKJACK#{room_id}】人數不足，本局中止，退回下注")
             _refund_all_and_reset(room)
 
@@ -134,12 +171,11 @@ def handle_command(player, raw, room_id: int):
         return
     cmd = parts[0].upper()
 
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             send_to_player(player, "【BLACKJACK】房間不存在")
             return
-        if player not in room["room_players"]:
+        if player.conn not in room.room_players:
             send_to_player(player, f"你不在 BLACKJACK#{room_id}（請 PLAY BLACKJACK {room_id}）")
             return
 
@@ -162,7 +198,7 @@ def handle_command(player, raw, room_id: int):
             if len(parts) != 2:
                 send_to_player(player, "用法：JOIN <amt>")
                 return
-            if room["in_round"]:
+            if room.in_round:
                 send_to_player(player, "本局已開始，請等待本局結束後再 JOIN")
                 return
             try:
@@ -174,11 +210,12 @@ def handle_command(player, raw, room_id: int):
             return
 
         if cmd == "START":
-            _start(room)
+            if _start(room):
+                eventlog.emit("BLACKJACK", room_id, "START", player.name, "", room)
             return
 
         if cmd in ("HIT", "STAND"):
-            if not room["in_round"]:
+            if not room.in_round:
                 send_to_player(player, "目前沒有進行中的牌局，先 JOIN 再 START")
                 return
             _action(room, player, cmd)
@@ -191,205 +228,207 @@ def _join(room, player, amt):
     if amt <= 0:
         send_to_player(player, "下注必須 > 0")
         return
-    if player.balance < amt:
-        send_to_player(player, "餘額不足")
-        return
-    if player in room["seated"]:
+    if room.seat_of(player.conn) is not None:
         send_to_player(player, "你已在本局座位中")
         return
-    if len(room["seated"]) >= MAX_PLAYERS:
+    if len(room.seated) >= MAX_PLAYERS:
         send_to_player(player, "本桌已滿")
         return
 
-    player.balance -= amt
-    room["seated"].append(player)
-    room["bets"][player] = amt
-    room["hands"][player] = []
-    room["done"].discard(player)
-
-    _broadcast(room, f"【BLACKJACK#{room['room_id']}】{player.name} JOIN 下注 {amt}（本局 {len(room['seated'])} 人）")
-
-
-def _start(room):
-    if room["in_round"]:
-        _broadcast(room, f"【BLACKJACK#{room['room_id']}】本局已開始")
-        return
-    if len(room["seated"]) < MIN_PLAYERS:
-        _broadcast(room, f"【BLACKJACK#{room['room_id']}】至少需要 {MIN_PLAYERS} 人 JOIN 才能 START")
+    hold = wallet.reserve(player.account, amt, f"BLACKJACK#{room.room_id} JOIN", "BLACKJACK")
+    if hold is None:
+        send_to_player(player, "餘額不足")
         return
+    room.sit(Seat(player, hold))
+    eventlog.emit("BLACKJACK", room.room_id, "JOIN", player.name, str(amt), room)
 
-    room["in_round"] = True
-    room["turn_idx"] = 0
-    room["deck"] = _make_deck()
-
-    room["dealer"] = [room["deck"].pop(), room["deck"].pop()]
-    room["done"] = set()
-
-    for p in room["seated"]:
-        room["hands"][p] = [room["deck"].pop(), room["deck"].pop()]
+    _broadcast(room, f"【BLACKJACK#{room.room_id}】{player.name} JOIN 下注 {amt}（本局 {len(room.seated)} 人）")
 
-    _broadcast(room, f"【BLACKJACK#{room['room_id']}】本局開始！")
-    _broadcast(room, f"莊家明牌：{room['dealer'][0]} ?")
 
-    for p in room["seated"]:
-        hv = _hand_value(room["hands"][p])
-        send_to_player(p, f"你的手牌：{' '.join(room['hands'][p])} (={hv})")
+def _start(room):
+    if room.in_round:
+        _broadcast(room, f"【BLACKJACK#{room.room_id}】本局已開始")
+        return False
+    if len(room.seated) < MIN_PLAYERS:
+        _broadcast(room, f"【BLACKJACK#{room.room_id}】至少需要 {MIN_PLAYERS} 人 JOIN 才能 START")
+        return False
+
+    room.in_round = True
+    room.turn_idx = 0
+    _ROUNDS_STARTED.inc()
+    room.deck = rng.draw(f"BLACKJACK#{room.room_id}", _make_deck)
+
+    room.dealer = [room.deck.pop(), room.deck.pop()]
+
+    for seat in room.seated:
+        seat.hand = [room.deck.pop(), room.deck.pop()]
+        seat.done = False
+
+    _broadcast(room, f"【BLACKJACK#{room.room_id}】本局開始！")
+    _broadcast(room, f"莊家明牌：{room.dealer[0]} ?")
+
+    for seat in room.seated:
+        hv = _hand_value(seat.hand)
+        send_to_player(seat.player, f"你的手牌：{' '.join(seat.hand)} (={hv})")
         if hv == 21:
-            room["done"].add(p)
+            seat.done = True
 
     _prompt_turn(room)
+    return True
 
 
 def _prompt_turn(room):
-    if not room["in_round"]:
+    if not room.in_round:
         return
 
-    if room["seated"] and all(p in room["done"] for p in room["seated"]):
+    if room.seated and all(seat.done for seat in room.seated):
         _dealer_play_and_settle(room)
         return
 
-    n = len(room["seated"])
+    n = len(room.seated)
     if n == 0:
         return
 
-    if room["turn_idx"] >= n:
-        room["turn_idx"] = 0
+    if room.turn_idx >= n:
+        room.turn_idx = 0
 
     for _ in range(n):
-        cur = room["seated"][room["turn_idx"]]
-        if cur not in room["done"]:
-            _broadcast(room, f"【BLACKJACK#{room['room_id']}】輪到 {cur.name}：HIT 或 STAND（輸入 HELP 可看指令）")
+        cur = room.seated[room.turn_idx]
+        if not cur.done:
+            _broadcast(room, f"【BLACKJACK#{room.room_id}】輪到 {cur.player.name}：HIT 或 STAND（輸入 HELP 可看指令）")
             return
-        room["turn_idx"] = (room["turn_idx"] + 1) % n
+        room.turn_idx = (room.turn_idx + 1) % n
 
 
 def _action(room, player, cmd):
-    if player not in room["seated"]:
+    seat = room.seat_of(player.conn)
+    if seat is None:
         send_to_player(player, "你沒有 JOIN 本局")
         return
 
-    if room["turn_idx"] >= len(room["seated"]):
-        room["turn_idx"] = 0
+    if room.turn_idx >= len(room.seated):
+        room.turn_idx = 0
 
-    cur = room["seated"][room["turn_idx"]]
-    if player != cur:
-        send_to_player(player, f"不是你的回合（目前輪到 {cur.name}）")
+    cur = room.seated[room.turn_idx]
+    if seat is not cur:
+        send_to_player(player, f"不是你的回合（目前輪到 {cur.player.name}）")
         return
-    if player in room["done"]:
+    if seat.done:
         send_to_player(player, "你已結束行動")
         return
 
     if cmd == "HIT":
-        if not room["deck"]:
-            room["deck"] = _make_deck()
-        room["hands"][player].append(room["deck"].pop())
-        hv = _hand_value(room["hands"][player])
+        if not room.deck:
+            room.deck = rng.draw(f"BLACKJACK#{room.room_id}", _make_deck)
+        card = room.deck.pop()
+        seat.hand.append(card)
+        hv = _hand_value(seat.hand)
 
-        _broadcast(room, f"【BLACKJACK#{room['room_id']}】{player.name} HIT 抽到 {room['hands'][player][-1]} (={hv})")
+        _broadcast(room, f"【BLACKJACK#{room.room_id}】{player.name} HIT 抽到 {card} (={hv})")
         if hv > 21:
-            _broadcast(room, f"【BLACKJACK#{room['room_id']}】{player.name} 爆牌！")
-            room["done"].add(player)
+            _broadcast(room, f"【BLACKJACK#{room.room_id}】{player.name} 爆牌！")
+            seat.done = True
 
-        room["turn_idx"] = (room["turn_idx"] + 1) % len(room["seated"])
+        room.turn_idx = (room.turn_idx + 1) % len(room.seated)
         _prompt_turn(room)
+        eventlog.emit("BLACKJACK", room.room_id, "HIT", player.name, card, room)
         return
 
     if cmd == "STAND":
-        hv = _hand_value(room["hands"][player])
-        _broadcast(room, f"【BLACKJACK#{room['room_id']}】{player.name} STAND (={hv})")
-        room["done"].add(player)
+        hv = _hand_value(seat.hand)
+        _broadcast(room, f"【BLACKJACK#{room.room_id}】{player.name} STAND (={hv})")
+        seat.done = True
 
-        room["turn_idx"] = (room["turn_idx"] + 1) % len(room["seated"])
+        room.turn_idx = (room.turn_idx + 1) % len(room.seated)
         _prompt_turn(room)
+        eventlog.emit("BLACKJACK", room.room_id, "STAND", player.name, str(hv), room)
         return
 
 
 def _dealer_play_and_settle(room):
-    while _hand_value(room["dealer"]) < 17:
-        if not room["deck"]:
-            room["deck"] = _make_deck()
-        room["dealer"].append(room["deck"].pop())
+    while _hand_value(room.dealer) < 17:
+        if not room.deck:
+            room.deck = rng.draw(f"BLACKJACK#{room.room_id}", _make_deck)
+        room.dealer.append(room.deck.pop())
 
-    dv = _hand_value(room["dealer"])
-    _broadcast(room, f"【BLACKJACK#{room['room_id']}】莊家攤牌：{' '.join(room['dealer'])} (={dv})")
+    dv = _hand_value(room.dealer)
+    _broadcast(room, f"【BLACKJACK#{room.room_id}】莊家攤牌：{' '.join(room.dealer)} (={dv})")
 
-    for p in list(room["seated"]):
-        bet = room["bets"].get(p, 0)
-        pv = _hand_value(room["hands"].get(p, []))
+    for seat in list(room.seated):
+        p = seat.player
+        bet = seat.hold.amount
+        pv = _hand_value(seat.hand)
+
+        reason = f"BLACKJACK#{room.room_id} 結算"
 
         if pv > 21:
+            wallet.settle(seat.hold, 0, reason)
             send_to_player(p, f"你爆牌，輸 {bet}（balance={p.balance})")
             continue
 
         if dv > 21 or pv > dv:
             gain = bet * 2
-            p.balance += gain
+            wallet.settle(seat.hold, gain, reason)
             send_to_player(p, f"你贏了！+{gain}（balance={p.balance})")
         elif pv == dv:
-            p.balance += bet
+            wallet.refund(seat.hold, reason)
             send_to_player(p, f"平手，退回 {bet}（balance={p.balance})")
         else:
+            wallet.settle(seat.hold, 0, reason)
             send_to_player(p, f"你輸了 {bet}（balance={p.balance})")
 
-    _broadcast(room, f"【BLACKJACK#{room['room_id']}】本局結束。可再次 JOIN 下一局。")
+    _ROUNDS_FINISHED.inc()
+    _broadcast(room, f"【BLACKJACK#{room.room_id}】本局結束。可再次 JOIN 下一局。")
     _reset_round_keep_room(room)
 
 
 def _status(room, player):
     lines = []
-    lines.append(f"【BLACKJACK#{room['room_id']}】in_round={room['in_round']}")
-    lines.append(f"房間人數={len(room['room_players'])}  本局座位={len(room['seated'])}")
+    lines.append(f"【BLACKJACK#{room.room_id}】in_round={room.in_round}")
+    lines.append(f"房間人數={len(room.room_players)}  本局座位={len(room.seated)}")
 
-    if room["seated"]:
+    if room.seated:
         lines.append("本局玩家：")
-        for p in room["seated"]:
-            bet = room["bets"].get(p, 0)
-            hv = _hand_value(room["hands"].get(p, [])) if room["hands"].get(p) else 0
-            done = "DONE" if p in room["done"] else "PLAY"
-            lines.append(f" - {p.name}: bet={bet} handValue={hv} {done}")
+        for seat in room.seated:
+            hv = _hand_value(seat.hand) if seat.hand else 0
+            done = "DONE" if seat.done else "PLAY"
+            lines.append(f" - {seat.player.name}: bet={seat.hold.amount} handValue={hv} {done}")
 
-    if room["in_round"] and room["dealer"]:
-        lines.append(f"莊家明牌：{room['dealer'][0]} ?")
-        cur = room["seated"][room["turn_idx"]] if room["seated"] else None
-        lines.append(f"輪到：{cur.name if cur else '(none)'}")
+    if room.in_round and room.dealer:
+        lines.append(f"莊家明牌：{room.dealer[0]} ?")
+        cur = room.seated[room.turn_idx] if room.seated else None
+        lines.append(f"輪到：{cur.player.name if cur else '(none)'}")
 
     send_to_player(player, "\n".join(lines))
 
 
-def _remove_from_round(room, player, reason="leave"):
-    bet = room["bets"].get(player, 0)
-    if bet > 0:
-        player.balance += bet
-
-    room["bets"].pop(player, None)
-    room["hands"].pop(player, None)
-    room["done"].discard(player)
+def _remove_from_round(room, seat, reason="leave"):
+    wallet.refund(seat.hold, f"BLACKJACK#{room.room_id} {reason}")
 
-    if player in room["seated"]:
-        room["seated"].remove(player)
+    if seat in room.seated:
+        room.unseat(seat)
 
-    if room["seated"]:
-        room["turn_idx"] %= len(room["seated"])
+    if room.seated:
+        room.turn_idx %= len(room.seated)
     else:
-        room["turn_idx"] = 0
+        room.turn_idx = 0
 
-    _broadcast(room, f"【BLACKJACK#{room['room_id']}】{player.name} 離開本局（{reason}）")
+    _broadcast(room, f"【BLACKJACK#{room.room_id}】{seat.player.name} 離開本局（{reason}）")
 
 
 def _refund_all_and_reset(room):
-    for p in list(room["seated"]):
-        bet = room["bets"].get(p, 0)
-        if bet > 0:
-            p.balance += bet
+    for seat in list(room.seated):
+        wallet.refund(seat.hold, f"BLACKJACK#{room.room_id} 本局中止")
     _reset_round_keep_room(room)
 
 
 def _reset_round_keep_room(room):
-    room["seated"] = []
-    room["bets"] = {}
-    room["hands"] = {}
-    room["done"] = set()
-    room["dealer"] = []
-    room["deck"] = []
-    room["in_round"] = False
-    room["turn_idx"] = 0
\ No newline at end of file
+    room.seated = []
+    room.dealer = []
+    room.deck = []
+    room.in_round = False
+    room.turn_idx = 0
+
+
+games.register("BLACKJACK", sys.modules[__name__])
+latency.register("BLACKJACK", ("HELP", "?", "STATUS", "JOIN", "START", "HIT", "STAND"))
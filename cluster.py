@@ -0,0 +1,301 @@
+"""多 process 模式：N 個 worker 用 SO_REUSEPORT 一起 listen 同一個 PORT
+
+- 每個 (game, room_id) 固定歸一個 worker 管（owner()），房間狀態只存在那個 process 裡
+- PLAY 到別的 worker 的房間時，把 client 的 socket fd 連同玩家狀態用 SCM_RIGHTS
+  轉交給那個 worker，client 端完全感覺不到
+- 名字唯一性改由主 process 的 coordinator（Unix socket）統一判斷
+- 其他模組可以用 coordinator_op() 在 coordinator 加指令（例如大廳的房間列表），
+  worker 用 query() 問、用 notify() 單向通知（背景 thread 送出，不等回覆）
+"""
+import collections
+import json
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import zlib
+
+import locks
+
+workers = 1      # worker 總數（1 = 沒有開多 process 模式）
+index = 0        # 自己是第幾個 worker
+_rundir = None
+_coord = None    # 連到 coordinator 的 client
+_ops = {}        # op -> fn(req) -> 回覆（None = 不回）；在 coordinator（主 process）執行
+_lost_hooks = []     # fn(worker index)：worker 掛掉時在 coordinator 呼叫
+
+
+class HandOff(Exception):
+    """PLAY 的房間不歸這個 worker 管：由 client_thread 把整條連線轉交出去"""
+
+    def __init__(self, code: str, room_id: int):
+        super().__init__(f"{code}#{room_id}")
+        self.code = code
+        self.room_id = room_id
+        self.pending = b""    # 還沒處理的指令（轉交後由對方接著處理）
+
+
+def active() -> bool:
+    return workers > 1
+
+
+def owner(code: str, room_id: int) -> int:
+    # 不能用 hash()：每個 process 的 hash seed 不同
+    return (zlib.crc32(code.encode()) + room_id - 1) % workers
+
+
+def owns(code: str, room_id: int) -> bool:
+    return not active() or owner(code, room_id) == index
+
+
+def owned_filter(code: str):
+    """給 pick_room() 用：只挑自己管的房間"""
+    if not active():
+        return None
+    return lambda room_id: owner(code, room_id) == index
+
+
+def _path(name: str) -> str:
+    return os.path.join(_rundir, name)
+
+
+# ====== coordinator（主 process）：全部 worker 共用的名字表 ======
+class Coordinator:
+    def __init__(self, path: str):
+        self.names = {}     # name -> 目前擁有它的 worker 連線
+        self.sessions = {}  # worker index -> 它目前的連線（重開後換成新的）
+        self.lock = locks.Lock("cluster.names")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen()
+
+    def serve(self):
+        while True:
+            c, _ = self.sock.accept()
+            threading.Thread(target=self._session, args=(c,), daemon=True).start()
+
+    def _session(self, c):
+        f = c.makefile("rwb")
+        worker = None
+        try:
+            for line in f:
+                req = json.loads(line)
+                if worker is None:
+                    worker = req.get("worker")
+                    with self.lock:
+                        self.sessions[worker] = c
+                resp = self._handle(c, req)
+                if resp is not None:
+                    f.write(json.dumps(resp).encode() + b"\n")
+                    f.flush()
+        except (OSError, ValueError):
+            pass
+        finally:
+            # worker 掛了：它名下的名字全部釋放
+            with self.lock:
+                for name in [n for n, o in self.names.items() if o is c]:
+                    del self.names[name]
+                current = self.sessions.get(worker) is c
+                if current:
+                    del self.sessions[worker]
+            c.close()
+            if current:       # 重開的 worker 已經連上來的話，它回報的東西不能清掉
+                for fn in _lost_hooks:
+                    fn(worker)
+
+    def _handle(self, c, req):
+        op = req.get("op")
+        if op in _ops:
+            return _ops[op](req)
+        name = req.get("name")
+        with self.lock:
+            if op == "claim":
+                if name in self.names:
+                    return {"ok": False}
+                old = req.get("old")
+                if old and self.names.get(old) is c:
+                    del self.names[old]
+                self.names[name] = c
+                return {"ok": True}
+            if op == "release":
+                if self.names.get(name) is c:
+                    del self.names[name]
+                return {"ok": True}
+            if op == "adopt":
+                # 轉交過來的玩家：名字改掛在新的 worker 底下
+                self.names[name] = c
+                return {"ok": True}
+        return {"ok": False, "error": f"unknown op {op}"}
+
+
+class _CoordClient:
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.f = self.sock.makefile("rwb")
+        self.lock = locks.Lock("cluster.coord_client")
+        self._notes = collections.deque()
+        self._wake = threading.Event()
+        threading.Thread(target=self._notify_loop, name="coord-notify", daemon=True).start()
+
+    def call(self, **req):
+        req["worker"] = index
+        with self.lock:
+            self.f.write(json.dumps(req).encode() + b"\n")
+            self.f.flush()
+            line = self.f.readline()
+        if not line:
+            raise ConnectionError("coordinator 已關閉")
+        return json.loads(line)
+
+    def notify(self, req: dict):
+        req["worker"] = index
+        self._notes.append(req)
+        self._wake.set()
+
+    def _notify_loop(self):
+        notes = self._notes
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if not notes:
+                continue
+            with self.lock:
+                try:
+                    while notes:
+                        self.f.write(json.dumps(notes.popleft()).encode() + b"\n")
+                    self.f.flush()
+                except OSError:
+                    return
+
+
+def claim_name(name: str, old=None) -> bool:
+    return _coord.call(op="claim", name=name, old=old)["ok"]
+
+
+def release_name(name: str):
+    _coord.call(op="release", name=name)
+
+
+def adopt_name(name: str):
+    _coord.call(op="adopt", name=name)
+
+
+def coordinator_op(op: str, fn, lost=None):
+    """登記 coordinator 的指令 op：fn(req) 的回傳值就是回覆（None = 單向通知，不回）；
+    lost(worker index) 在該 worker 掛掉時呼叫。要在 run() fork 之前登記（import 時）"""
+    _ops[op] = fn
+    if lost is not None:
+        _lost_hooks.append(lost)
+
+
+def query(op: str, **req):
+    return _coord.call(op=op, **req)
+
+
+def notify(op: str, **req):
+    """不等回覆；依呼叫順序送出"""
+    req["op"] = op
+    _coord.notify(req)
+
+
+# ====== 連線轉交 ======
+def send_handoff(sock: socket.socket, state: dict):
+    """把 client socket 交給擁有 (state["game"], state["room"]) 的 worker"""
+    target = owner(state["game"], state["room"])
+    with socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET) as u:
+        u.connect(_path(f"worker-{target}.sock"))
+        socket.send_fds(u, [json.dumps(state).encode()], [sock.fileno()])
+        # 等對方收下 fd 才能關自己這份
+        u.recv(1)
+    return target
+
+
+def _handoff_listener(path: str, adopt):
+    if os.path.exists(path):
+        os.unlink(path)
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    srv.bind(path)
+    srv.listen()
+    while True:
+        u, _ = srv.accept()
+        try:
+            msg, fds, _, _ = socket.recv_fds(u, 1 << 20, 1)
+            if not fds:
+                continue
+            sock = socket.socket(fileno=fds[0])
+            u.sendall(b"K")
+        except (OSError, ValueError) as e:
+            print("[ERROR] handoff:", e)
+            continue
+        finally:
+            u.close()
+        threading.Thread(target=adopt, args=(sock, json.loads(msg)), daemon=True).start()
+
+
+# ====== 啟動 ======
+def _worker_main(i: int, host, port, serve, adopt):
+    global index, _coord
+    index = i
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((host, port))
+    s.listen()
+
+    _coord = _CoordClient(_path("coord.sock"))
+    threading.Thread(target=_handoff_listener, args=(_path(f"worker-{i}.sock"), adopt),
+                     daemon=True).start()
+    print(f"[WORKER {i}] pid={os.getpid()} 啟動")
+    serve(s)
+
+
+def _spawn(i, host, port, serve, adopt, coord):
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        coord.sock.close()
+        try:
+            _worker_main(i, host, port, serve, adopt)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def run(n: int, host, port, serve, adopt):
+    """主 process：開 coordinator，fork n 個 worker；worker 掛掉就補一個同編號的"""
+    global workers, _rundir
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(os, "fork"):
+        raise SystemExit("此平台不支援 SO_REUSEPORT / fork，無法使用 --workers")
+
+    workers = n
+    _rundir = tempfile.mkdtemp(prefix="casino-")
+    coord = Coordinator(_path("coord.sock"))
+
+    pids = {}
+    for i in range(n):
+        pids[_spawn(i, host, port, serve, adopt, coord)] = i
+    threading.Thread(target=coord.serve, daemon=True).start()
+
+    def _stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        while True:
+            pid, status = os.wait()
+            i = pids.pop(pid, None)
+            if i is None:
+                continue
+            print(f"[CLUSTER] worker {i} 結束（status={status}），重新啟動")
+            pids[_spawn(i, host, port, serve, adopt, coord)] = i
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        shutil.rmtree(_rundir, ignore_errors=True)
@@ -0,0 +1,286 @@
+"""遊戲事件紀錄：每個改變牌局的指令（出牌、PASS、下注、要牌…）append 一筆到二進位檔，事後可以查帳、重播
+
+server 以 --event-log PATH 啟動才會開。
+- 遊戲模組在房間 lock 裡呼叫 emit()：用 Room.snapshot() 複製結果狀態，連同事件丟進 deque 就回來，
+  不拿 lock、不碰磁碟（deque.append 在 CPython 是原子的，多條 thread 一起丟也不會亂）
+- 背景 writer thread 每 FLUSH_INTERVAL 秒把 deque 清空，算狀態的 hash、打包成一塊 bytes 一次 write；
+  檔案寫到 ROTATE_BYTES 就換下一個（PATH.000001、PATH.000002…），舊的不會被改寫
+- 房間在哪個 process，紀錄就在哪個 process 寫：--workers 是 PATH.w<編號>.*，--gateway 是 PATH.<GAME>-<編號>.*
+
+檔案格式：開頭 MAGIC + SEGMENT（建立時間 ns、pid、第一筆序號），之後一筆接一筆：
+  RECORD（後面可變長度部分的長度、序號、時間 ns、遊戲、動作、房號、結果狀態的 hash 8 bytes）
+  + 玩家名字 + b"\\0" + 參數（UTF-8）
+序號在每個 process 裡連續遞增，漏了就代表紀錄不完整。
+當機時最多掉最後 FLUSH_INTERVAL 秒；寫到一半的最後一筆讀的時候會略過。
+
+讀：python eventlog.py PATH [--follow] [--game G] [--room N] [--player NAME]
+"""
+import argparse
+import collections
+import glob
+import hashlib
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+import cluster
+
+PATH = None
+FLUSH_INTERVAL = 0.05
+ROTATE_BYTES = 64 << 20
+
+MAGIC = b"CASINO-EVT 1\n"
+SEGMENT = struct.Struct("!qIQ")
+RECORD = struct.Struct("!HQqBBI8s")
+
+# 只能往後加：檔案裡存的是這兩個表的索引
+GAMES = ("BIG2", "BLACKJACK", "ROULETTE", "TTT")
+ACTIONS = ("MOVE", "PASS", "JOIN", "START", "HIT", "STAND", "BETR", "SPIN")
+_GAME_IDS = {code: i for i, code in enumerate(GAMES)}
+_ACTION_IDS = {action: i for i, action in enumerate(ACTIONS)}
+
+Event = collections.namedtuple("Event", "seq ts_ns game room_id action player args state")
+
+_queue = collections.deque()
+_pid = None
+_start_lock = threading.Lock()
+_write_lock = threading.Lock()    # writer thread 與 flush() 之間；emit 不拿
+_file = None
+_segment = 0
+_seq = 0
+stats = {"events": 0, "bytes": 0, "batches": 0, "max_batch": 0, "write_ns": 0, "segments": 0, "errors": 0}
+
+
+def state_hash(state) -> bytes:
+    return hashlib.blake2b(repr(state).encode(), digest_size=8).digest()
+
+
+# ====== 寫入 ======
+def emit(game: str, room_id: int, action: str, player: str, args: str, room):
+    """在房間 lock 裡、狀態改完之後呼叫；沒開紀錄時什麼都不做"""
+    if PATH is None:
+        return
+    if _pid != os.getpid():
+        _start()
+        if PATH is None:
+            return
+    # snapshot() 回傳的是複製出來的資料，hash 留給 writer thread 算
+    _queue.append((time.time_ns(), _GAME_IDS[game], room_id, _ACTION_IDS[action], player, args, room.snapshot()))
+
+
+def _base():
+    if cluster.active():
+        return f"{PATH}.w{cluster.index}"
+    return PATH
+
+
+def _segments(base):
+    return sorted(p for p in glob.glob(glob.escape(base) + ".[0-9]*") if p[len(base) + 1:].isdigit())
+
+
+def _open_next():
+    global _file, _segment
+    if _file is not None:
+        _file.flush()
+        os.fsync(_file.fileno())
+        _file.close()
+    _segment += 1
+    _file = open(f"{_base()}.{_segment:06d}", "xb")
+    _file.write(MAGIC + SEGMENT.pack(time.time_ns(), os.getpid(), _seq + 1))
+    stats["segments"] += 1
+
+
+def _drain():
+    # 在 _write_lock 裡呼叫
+    global _seq
+    n = len(_queue)
+    if not n:
+        return
+    t0 = time.perf_counter_ns()
+    buf = bytearray()
+    pack = RECORD.pack
+    popleft = _queue.popleft
+    for _ in range(n):
+        ts, game, room_id, action, player, args, state = popleft()
+        _seq += 1
+        body = f"{player}\0{args}".encode()
+        buf += pack(len(body), _seq, ts, game, action, room_id, state_hash(state))
+        buf += body
+    try:
+        _file.write(buf)
+        _file.flush()
+        if _file.tell() >= ROTATE_BYTES:
+            _open_next()
+    except OSError as e:
+        stats["errors"] += 1
+        print("[ERROR] eventlog:", e)
+    stats["events"] += n
+    stats["bytes"] += len(buf)
+    stats["batches"] += 1
+    stats["max_batch"] = max(stats["max_batch"], n)
+    stats["write_ns"] += time.perf_counter_ns() - t0
+
+
+def _writer_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        with _write_lock:
+            _drain()
+
+
+def _start():
+    # 第一次 emit 時才開：--workers 的子 process 與遊戲 worker 各自開自己的檔
+    global PATH, _pid, _segment, _file, _seq
+    with _start_lock:
+        if _pid == os.getpid():
+            return
+        _queue.clear()          # fork 前別的 process 留下的，不是這個 process 的事件
+        _file, _seq = None, 0
+        existing = _segments(_base())
+        _segment = int(existing[-1].rsplit(".", 1)[1]) if existing else 0
+        try:
+            with _write_lock:
+                _open_next()
+        except OSError as e:
+            # 不能讓遊戲指令因為紀錄檔開不了而失敗
+            print("[ERROR] eventlog: 無法開啟紀錄檔，停用事件紀錄：", e)
+            PATH = None
+            return
+        threading.Thread(target=_writer_loop, name="eventlog", daemon=True).start()
+        _pid = os.getpid()
+
+
+def flush():
+    """把目前為止的事件寫進磁碟並 fsync（關機時用）"""
+    if PATH is None or _pid != os.getpid():
+        return
+    with _write_lock:
+        _drain()
+        _file.flush()
+        os.fsync(_file.fileno())
+
+
+def report():
+    if PATH is None:
+        return ["沒有開事件紀錄（server 需以 --event-log PATH 啟動）"]
+    if _pid != os.getpid():
+        return [f"事件紀錄：{PATH}（這個 process 還沒有事件）"]
+    batches = stats["batches"] or 1
+    return [f"事件紀錄：{_base()}.{_segment:06d}（滿 {ROTATE_BYTES / (1 << 20):g}MB 換檔，已開 {stats['segments']} 個）",
+            f"事件={stats['events']} 序號={_seq} 位元組={stats['bytes']} 平均每筆={stats['bytes'] / max(1, stats['events']):.0f}B "
+            f"等待寫入={len(_queue)}",
+            f"批次={stats['batches']} 最大一批={stats['max_batch']} 每批寫入平均={stats['write_ns'] / batches / 1e3:.0f}us "
+            f"錯誤={stats['errors']}"]
+
+
+def configure(path=None, rotate_mb=None, interval=None):
+    global PATH, ROTATE_BYTES, FLUSH_INTERVAL
+    if rotate_mb is not None:
+        ROTATE_BYTES = max(1, int(rotate_mb * (1 << 20)))
+    if interval is not None:
+        FLUSH_INTERVAL = float(interval)
+    if path:
+        PATH = path
+
+
+# ====== 讀取 ======
+def files(path: str):
+    """path 這份紀錄的所有檔（依檔名排序）：PATH.NNNNNN、--workers 的 PATH.w<N>.NNNNNN、
+    --gateway 遊戲 worker 的 PATH.<GAME>-<N>.NNNNNN；檔名只是開頭一樣的其他檔不算"""
+    folder, name = os.path.split(path)
+    own = re.compile(re.escape(name) + r"(?:\.w\d+|\.[A-Z0-9]+-\d+)?\.\d{6,}")
+    try:
+        names = os.listdir(folder or ".")
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(folder, n) for n in names if own.fullmatch(n))
+
+
+def _open(path: str, follow: bool):
+    f = open(path, "rb")
+    head = f.read(len(MAGIC) + SEGMENT.size)
+    if head.startswith(MAGIC) and len(head) == len(MAGIC) + SEGMENT.size:
+        return f
+    f.close()
+    if follow and MAGIC.startswith(head[:len(MAGIC)]):
+        return None           # 剛開的檔，開頭還沒寫進去
+    raise ValueError(f"{path}: not an event log")
+
+
+def _records(f):
+    """讀到檔尾（或寫到一半的那一筆）為止；之後可以再呼叫一次，從停下來的地方接著讀"""
+    while True:
+        pos = f.tell()
+        head = f.read(RECORD.size)
+        if len(head) == RECORD.size:
+            length, seq, ts, game, action, room_id, digest = RECORD.unpack(head)
+            body = f.read(length)
+            if len(body) == length:
+                player, _, args = body.decode().partition("\0")
+                yield Event(seq, ts, GAMES[game], room_id, ACTIONS[action], player, args, digest.hex())
+                continue
+        f.seek(pos)
+        return
+
+
+def stream(path: str, follow=False, poll=0.2):
+    """依序讀出 path 的所有紀錄檔
+
+    follow 時每隔 poll 秒輪流看每個檔有沒有新的事件；同一個 process 已經換到下一個檔時，舊的讀完就關掉。
+    """
+    done = set()
+    opened = {}
+    while True:
+        paths = files(path)
+        for p in paths:
+            if p in done:
+                continue
+            f = opened.get(p) or _open(p, follow)
+            if f is None:
+                continue
+            opened[p] = f
+            base = p.rsplit(".", 1)[0]
+            # 先看有沒有下一個檔再讀：看到下一個檔時，這個檔已經不會再寫了
+            finished = not follow or any(q > p and q.rsplit(".", 1)[0] == base for q in paths)
+            yield from _records(f)
+            if finished:
+                f.close()
+                del opened[p]
+                done.add(p)
+        if not follow:
+            return
+        time.sleep(poll)
+
+
+def format_event(e: Event) -> str:
+    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e.ts_ns / 1e9)) + f".{e.ts_ns // 1000 % 1000000:06d}"
+    return f"#{e.seq:<8} {ts} {f'{e.game}#{e.room_id}':14} {e.player:12} {e.action:5} {e.args:20} state={e.state}"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="讀遊戲事件紀錄")
+    ap.add_argument("path", help="server 的 --event-log PATH")
+    ap.add_argument("--follow", "-f", action="store_true", help="讀完之後繼續等新的事件")
+    ap.add_argument("--game")
+    ap.add_argument("--room", type=int)
+    ap.add_argument("--player")
+    args = ap.parse_args(argv)
+
+    game = args.game.upper() if args.game else None
+    try:
+        for e in stream(args.path, args.follow):
+            if game and e.game != game or args.room and e.room_id != args.room \
+                    or args.player and e.player != args.player:
+                continue
+            print(format_event(e), flush=args.follow)
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""以 \\n 切指令的 bytes 層 framing
+
+收到的資料先累積在 bytearray，只從上次找到的位置往後找 \\n，
+完整的一行才 decode（所以被切在兩次 recv 之間的中文字不會壞掉）。
+
+每行有長度上限：超過的那一行整行丟掉（不 decode），一直丟到下一個 \\n 為止，
+所以就算對方一直送沒有 \\n 的資料，buffer 也不會超過 MAX_LINE + RECV_SIZE。
+"""
+
+RECV_SIZE = 4096
+MAX_LINE = 2048        # 一行指令最多幾 bytes（不含 \n）
+MAX_VIOLATIONS = 3     # 超過幾次過長指令就斷線
+
+totals = {"oversized": 0, "dropped_conns": 0}
+
+
+def configure(max_line=None, max_violations=None):
+    global MAX_LINE, MAX_VIOLATIONS
+    if max_line is not None:
+        MAX_LINE = max_line
+    if max_violations is not None:
+        MAX_VIOLATIONS = max_violations
+
+
+class LineFramer:
+    def __init__(self, recv_size=RECV_SIZE, max_line=None):
+        self._buf = bytearray()
+        self._scan = 0                      # 下次從這個 offset 開始找 \n
+        self._chunk = bytearray(recv_size)
+        self._view = memoryview(self._chunk)
+        self._discarding = False            # 正在丟棄一行過長的指令
+        self.max_line = max_line or MAX_LINE
+        self.violations = 0
+
+    def __len__(self):
+        return len(self._buf)
+
+    @property
+    def over_limit(self) -> bool:
+        return self.violations > MAX_VIOLATIONS
+
+    def recv_from(self, sock) -> int:
+        """從 socket 直接 recv_into 固定的 chunk，回傳收到幾 bytes（0 代表對方關閉）"""
+        n = sock.recv_into(self._chunk)
+        if not n:
+            return 0
+        start = 0
+        if self._discarding:
+            # 還在過長的那一行裡：找到 \n 之前的東西都不必留
+            i = self._chunk.find(b"\n", 0, n)
+            if i < 0:
+                return n
+            self._discarding = False
+            start = i + 1
+        self._buf += self._view[start:n]
+        return n
+
+    def feed(self, data: bytes):
+        if self._discarding:
+            i = data.find(b"\n")
+            if i < 0:
+                return
+            self._discarding = False
+            data = data[i + 1:]
+        self._buf += data
+
+    def _violate(self):
+        self.violations += 1
+        totals["oversized"] += 1
+
+    def lines(self):
+        """取出目前所有完整的行（已 decode，不含 \\n）"""
+        buf = self._buf
+        # 只看新進來的部分；_scan 之前確定沒有 \n
+        end = buf.rfind(b"\n", self._scan)
+        if end < 0:
+            if len(buf) > self.max_line:
+                # 半行就已經超長：整段丟掉，後面的資料也丟到下一個 \n 為止
+                self._violate()
+                self._discarding = True
+                buf.clear()
+            self._scan = len(buf)
+            return []
+
+        if end <= self.max_line:
+            # 整段都比上限短，不可能有過長的行
+            # \n 一定落在 UTF-8 字元邊界上，所以整段完整的行一起 decode 一次即可。
+            # 直接切 bytearray 再 decode：多複製一次，但比開 memoryview（要進出 with）便宜很多，
+            # recv 很碎（每次只有幾個 bytes）時這裡每次都會走到
+            out = buf[:end].decode("utf-8", "ignore").split("\n")
+        else:
+            out = []
+            start = 0
+            while start <= end:
+                i = buf.find(b"\n", start, end + 1)
+                if i - start > self.max_line:
+                    self._violate()
+                else:
+                    out.append(buf[start:i].decode("utf-8", "ignore"))
+                start = i + 1
+        del buf[:end + 1]
+
+        if len(buf) > self.max_line:
+            self._violate()
+            self._discarding = True
+            buf.clear()
+        self._scan = len(buf)
+        return out
+
+    def pending(self) -> bytes:
+        """尚未湊成一行的資料"""
+        return bytes(self._buf)
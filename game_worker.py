@@ -0,0 +1,221 @@
+"""遊戲 worker process：只跑一種遊戲，由 gateway 透過 Unix socket 轉送指令
+
+用法（通常由 gateway 自動啟動）：python game_worker.py --game BIG2 --socket /tmp/xxx.sock
+"""
+import argparse
+import itertools
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import big2
+import blackjack
+import tictactoe
+import roulette
+import eventlog
+import games
+import ipc
+import metrics
+import outbound
+import rng
+import roomtable
+import snapshot
+import wallet
+
+_out = []          # 這次處理過程中要送回 gateway 的 frame
+_dirty = set()     # 餘額有變動、要通知 gateway 的玩家
+_link = None       # 連到 gateway 的 socket
+_send_lock = threading.Lock()       # reaper thread 也會直接送 ROOMSTAT
+_serve_thread = None
+_code = None
+_index, _count = 0, 1    # 這個遊戲的第幾個 worker / 共幾個
+
+
+class ProxyConn:
+    """代表 gateway 那邊的一條 client 連線；遊戲模組 send_line 到這裡就變成 OUT frame"""
+
+    __slots__ = ("sid", "label")
+
+    def __init__(self, sid: int):
+        self.sid = sid
+        self.label = None
+
+    def enqueue(self, data: bytes, essential=True):
+        _out.append(ipc.pack(ipc.OUT if essential else ipc.OUT_OPTIONAL, self.sid, data))
+
+    def enqueue_many(self, items):
+        # 同一個指令送給這個 client 的多行合成一個 frame（必要 / 非必要分開，順序不變）
+        for essential, run in itertools.groupby(items, key=lambda item: item[1]):
+            self.enqueue(b"".join(data for data, _ in run), essential)
+
+    def sendall(self, data: bytes):
+        self.enqueue(data)
+
+
+class ProxyPlayer:
+    __slots__ = ("conn", "name", "account", "current_game", "current_room")
+
+    def __init__(self, sid: int, name: str, balance: int):
+        self.conn = ProxyConn(sid)
+        self.conn.label = name
+        self.name = name
+        self.account = wallet.open_account(self, balance, "gateway ENTER")
+        self.current_game = None
+        self.current_room = None
+
+    @property
+    def balance(self):
+        return self.account.balance
+
+
+def _room_changed(code, room_id, n, capacity, in_round):
+    frame = ipc.pack(ipc.ROOMSTAT, 0, ipc.ROOM_STATUS.pack(room_id, -1 if n is None else n, capacity, in_round))
+    if threading.get_ident() == _serve_thread:
+        _out.append(frame)          # 處理指令當中：和這個指令的其他 frame 一起送
+        return
+    if _link is None:
+        return
+    try:
+        with _send_lock:            # reaper 回收房間
+            _link.sendall(frame)
+    except OSError:
+        pass
+
+
+roomtable.watch(_room_changed)
+# 餘額被別人的動作改到（例如 BIG2 贏家拿走底池），ACK 之前用 BAL frame 通知 gateway
+wallet.watch(lambda account: _dirty.add(account.owner))
+
+
+def _ack(sid, ok, player, t0, value=0):
+    worker_ns = time.perf_counter_ns() - t0
+    for p in _dirty:
+        if p.conn.sid != sid:
+            _out.append(ipc.pack(ipc.BAL, p.conn.sid, ipc.BALANCE.pack(p.account.balance, p.account.held)))
+    _dirty.clear()
+    balance, held = (player.account.balance, player.account.held) if player else (0, 0)
+    _out.append(ipc.pack(ipc.ACK, sid, ipc.ACK_BODY.pack(ok, balance, held, worker_ns, value)))
+
+
+def _owned_filter(placed):
+    """這個 worker 負責的房號：gateway.worker_for 的預設分法，place() 改過的照 placed"""
+    if _count == 1 and not placed:
+        return None
+    return lambda room_id: placed.get(room_id, (room_id - 1) % _count == _index)
+
+
+def _handle(game, sessions, ftype, sid, payload):
+    """處理一個 frame，回傳 (ok, player, value) 給 ACK 用"""
+    player = sessions.get(sid)
+
+    if ftype == ipc.ENTER:
+        room_id, balance = ipc.ENTER_HEAD.unpack_from(payload)
+        name = payload[ipc.ENTER_HEAD.size:].decode()
+        if player is None:
+            player = ProxyPlayer(sid, name, balance)
+        ok = bool(game.enter(player, room_id))
+        if ok:
+            sessions[sid] = player
+        elif sessions.get(sid) is not player:
+            wallet.close_account(player.account, "enter failed")
+        return ok, player, 0
+
+    if ftype == ipc.CMD and player is not None:
+        (room_id,) = ipc.ROOM.unpack_from(payload)
+        game.handle_command(player, payload[ipc.ROOM.size:].decode(), room_id)
+        return True, player, 0
+
+    if ftype == ipc.LEAVE and player is not None:
+        (room_id,) = ipc.ROOM.unpack_from(payload)
+        game.remove_conn(player.conn, room_id)
+        sessions.pop(sid, None)
+        _dirty.discard(player)
+        wallet.close_account(player.account, "gateway LEAVE")
+        return True, player, 0
+
+    if ftype == ipc.PICK:
+        placed = dict(ipc.PLACED.unpack_from(payload, i) for i in range(0, len(payload), ipc.PLACED.size))
+        return True, None, game.pick_room(_owned_filter(placed)) or 0
+
+    if ftype == ipc.LIMIT:
+        (n,) = ipc.ROOM.unpack_from(payload)
+        return games.set_max_rooms(_code, n), None, 0
+
+    return False, player, 0
+
+
+def serve(link: socket.socket, game):
+    global _link, _serve_thread
+    _link, _serve_thread = link, threading.get_ident()
+    sessions = {}    # sid -> ProxyPlayer
+    for ftype, sid, payload in ipc.FrameReader(link):
+        t0 = time.perf_counter_ns()
+        # 輸出合併成每個 client 一個 OUT frame，而且要排在 ACK 前面
+        with outbound.batch():
+            ok, player, value = _handle(game, sessions, ftype, sid, payload)
+        _ack(sid, ok, player, t0, value)
+        with _send_lock:
+            link.sendall(b"".join(_out))
+        _out.clear()
+
+
+def main(argv=None):
+    global _code, _index, _count
+    ap = argparse.ArgumentParser(description="game worker")
+    ap.add_argument("--game", required=True)
+    ap.add_argument("--socket", required=True)
+    ap.add_argument("--worker-index", type=int, default=0)
+    ap.add_argument("--worker-count", type=int, default=1)
+    ap.add_argument("--max-rooms", type=int, default=None)
+    ap.add_argument("--room-idle", type=float, default=roomtable.IDLE_SECONDS)
+    ap.add_argument("--snapshot", default=None)
+    ap.add_argument("--snapshot-interval", type=float, default=snapshot.INTERVAL)
+    ap.add_argument("--event-log", default=None)
+    ap.add_argument("--event-log-rotate", type=float, default=eventlog.ROTATE_BYTES >> 20)
+    ap.add_argument("--rng", choices=rng.MODES, default=rng.MODE)
+    ap.add_argument("--rng-seed", type=int, default=None)
+    ap.add_argument("--rng-ahead", type=int, default=rng.AHEAD)
+    ap.add_argument("--metrics-port", type=int, default=None)
+    ap.add_argument("--metrics-host", default=metrics.HOST)
+    args = ap.parse_args(argv)
+    roomtable.configure(idle=args.room_idle)
+    snapshot.configure(path=args.snapshot, interval=args.snapshot_interval)
+    eventlog.configure(path=args.event_log, rotate_mb=args.event_log_rotate)
+    rng.configure(mode=args.rng, seed=args.rng_seed, ahead=args.rng_ahead)
+    metrics.configure(port=args.metrics_port, host=args.metrics_host)
+
+    game = games.get(args.game)
+    if game is None:
+        raise SystemExit(f"未知遊戲：{args.game}")
+    _code, _index, _count = args.game, args.worker_index, max(1, args.worker_count)
+    if args.max_rooms:
+        games.set_max_rooms(args.game, args.max_rooms)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(args.socket)
+    srv.listen(1)
+    print(f"[WORKER {args.game}] pid={os.getpid()} 啟動")
+    metrics.start()
+
+    # 只服務一條 gateway 連線：gateway 斷了 worker 就結束，要重開由 gateway 負責
+    link, _ = srv.accept()
+    srv.close()
+    # gateway 關閉時送 SIGTERM：走到 finally 把事件紀錄寫完
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    os.unlink(args.socket)
+    try:
+        serve(link, game)
+    except OSError as e:
+        print(f"[WORKER {args.game}] gateway 斷線：", e)
+    finally:
+        link.close()
+        eventlog.flush()
+
+
+if __name__ == "__main__":
+    main()
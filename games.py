@@ -0,0 +1,33 @@
+"""遊戲註冊表：game code（BIG2 / BLACKJACK / TTT / ROULETTE）-> 遊戲物件
+
+遊戲物件要提供：enter(player, room_id) / remove_conn(conn, room_id) /
+handle_command(player, raw, room_id) / pick_room(accept=None) / MAX_ROOMS。
+各遊戲模組 import 時自己呼叫 register()，server 新增遊戲不用再改 if/elif。
+MAX_ROOMS 是房號上限（server 在 PLAY 時檢查），可以用 set_max_rooms() 在執行中調整。
+"""
+
+_registry = {}
+
+
+def register(code: str, game):
+    _registry[code.upper()] = game
+    return game
+
+
+def get(code):
+    if not code:
+        return None
+    return _registry.get(code)
+
+
+def codes():
+    return list(_registry)
+
+
+def set_max_rooms(code, n: int) -> bool:
+    """調整房號上限；已經存在的房間（包括超過新上限的）照常運作，只是不能再進新的"""
+    game = get(code)
+    if game is None or n < 1:
+        return False
+    game.MAX_ROOMS = n
+    return True
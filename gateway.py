@@ -0,0 +1,374 @@
+"""gateway 模式：大廳留在前端 process，各遊戲跑在自己的 worker process
+
+server.py --gateway 時，games 註冊表裡的四個遊戲會換成 GameProxy：
+server.handle_command 照常處理 HELLO / WHERE / STATUS / PLAY，
+但 enter / handle_command / remove_conn / pick_room 都變成透過 Unix socket
+（ipc.py 的 frame）送到 game_worker.py。
+CPU 吃重的遊戲（例如很多房的 BIG2）就不會拖慢大廳，worker 也可以各自重開或加開。
+玩家在遊戲裡時籌碼以 worker 的 wallet 為準，gateway 的帳戶跟著 ACK / BAL 用 wallet.sync 更新。
+"""
+import collections
+import itertools
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import eventlog
+import games
+import ipc
+import lobby
+import locks
+import metrics
+import rng
+import roomtable
+import snapshot
+import wallet
+from outbound import send_line
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "game_worker.py")
+CALL_TIMEOUT = 10.0
+CONNECT_TIMEOUT = 10.0
+
+_rundir = None
+_links = []
+
+# gateway 端的 session：每個在遊戲房間裡的玩家一個 sid
+_sid_seq = itertools.count(1)
+_metrics_offset = itertools.count(1)       # 遊戲 worker 的 /metrics 依序在 PORT+1、PORT+2…
+_sessions = {}        # sid -> Player
+_sid_by_conn = {}     # conn -> sid
+_sessions_lock = locks.Lock("gateway.sessions")
+
+# 放置表：place() 手動指定過的 (game, room_id) -> 該遊戲的第幾個 worker；其他房間是 (room_id - 1) % n
+placement = {}
+_placement_lock = locks.Lock("gateway.placement")
+
+
+def worker_for(code: str, room_id: int, n: int) -> int:
+    idx = placement.get((code, room_id))
+    if idx is None or idx >= n:
+        idx = (room_id - 1) % n
+    return idx
+
+
+def place(code: str, room_id: int, idx: int):
+    """手動指定某房間由哪個 worker 負責（要在房間有人之前設定）"""
+    with _placement_lock:
+        placement[(code, room_id)] = idx
+
+
+# ====== 每一跳的延遲統計 ======
+class HopStats:
+    def __init__(self):
+        self.count = 0
+        self.rtt = collections.deque(maxlen=4096)      # gateway -> worker -> gateway（ns）
+        self.worker = collections.deque(maxlen=4096)   # worker 內處理時間（ns）
+
+    def add(self, rtt_ns: int, worker_ns: int):
+        self.count += 1
+        self.rtt.append(rtt_ns)
+        self.worker.append(worker_ns)
+
+    @staticmethod
+    def _pct(samples, p):
+        s = sorted(samples)
+        return s[min(len(s) - 1, int(p / 100.0 * len(s)))] if s else 0
+
+    def summary(self) -> str:
+        rtt_p50, rtt_p99 = self._pct(self.rtt, 50), self._pct(self.rtt, 99)
+        wk_p50, wk_p99 = self._pct(self.worker, 50), self._pct(self.worker, 99)
+        return (f"n={self.count} rtt p50={rtt_p50 / 1e3:.0f}us p99={rtt_p99 / 1e3:.0f}us  "
+                f"worker p50={wk_p50 / 1e3:.0f}us p99={wk_p99 / 1e3:.0f}us  "
+                f"ipc p50={(rtt_p50 - wk_p50) / 1e3:.0f}us")
+
+
+hops = collections.defaultdict(HopStats)     # (game, op) -> HopStats
+_OP_NAMES = {ipc.ENTER: "ENTER", ipc.CMD: "CMD", ipc.LEAVE: "LEAVE", ipc.PICK: "PICK", ipc.LIMIT: "LIMIT"}
+
+
+def hop_report():
+    return [f"{game:9} {op:5} {st.summary()}" for (game, op), st in sorted(hops.items())]
+
+
+# ====== 一個 worker process 與它的連線 ======
+class WorkerLink:
+    def __init__(self, code: str, idx: int, n_workers: int, max_rooms: int):
+        self.code = code
+        self.idx = idx
+        self.n_workers = n_workers
+        self.max_rooms = max_rooms     # 重開時也帶目前的上限
+        self.path = os.path.join(_rundir, f"{code.lower()}-{idx}.sock")
+        self.lock = locks.Lock(f"gateway.link.{code}-{idx}")   # 寫 frame 用
+        self.waiters = {}              # sid -> [Event, ack]
+        self.sids = set()              # 目前在這個 worker 房間裡的 session
+        self.proc = None
+        self.sock = None
+        self.metrics_port = metrics.PORT + next(_metrics_offset) if metrics.PORT else None   # 重開也用同一個
+        self._start()
+
+    def _start(self):
+        args = [sys.executable, WORKER_SCRIPT, "--game", self.code, "--socket", self.path,
+                "--worker-index", str(self.idx), "--worker-count", str(self.n_workers),
+                "--max-rooms", str(self.max_rooms), "--room-idle", str(roomtable.IDLE_SECONDS)]
+        if snapshot.PATH:
+            args += ["--snapshot", f"{snapshot.PATH}.{self.code}-{self.idx}",
+                     "--snapshot-interval", str(snapshot.INTERVAL)]
+        if eventlog.PATH:
+            args += ["--event-log", f"{eventlog.PATH}.{self.code}-{self.idx}",
+                     "--event-log-rotate", str(eventlog.ROTATE_BYTES / (1 << 20))]
+        args += ["--rng", rng.MODE, "--rng-ahead", str(rng.AHEAD)]
+        if rng.MODE == "room":
+            # 主種子跟著傳：同一個 --rng-seed，房間在哪個 worker 都發一樣的牌
+            args += ["--rng-seed", str(rng.SEED)]
+        if self.metrics_port:
+            args += ["--metrics-port", str(self.metrics_port), "--metrics-host", metrics.HOST]
+        self.proc = subprocess.Popen(args)
+        deadline = time.time() + CONNECT_TIMEOUT
+        while True:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                s.connect(self.path)
+                break
+            except OSError:
+                s.close()
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+        self.sock = s
+        threading.Thread(target=self._reader, name=f"link-{self.code}-{self.idx}", daemon=True).start()
+
+    def call(self, ftype: int, sid: int, payload: bytes):
+        """送一個 frame 並等 ACK，回傳 (ok, balance, held, value)；worker 掛掉時丟 ConnectionError"""
+        waiter = [threading.Event(), None]
+        self.waiters[sid] = waiter
+        t0 = time.perf_counter_ns()
+        try:
+            with self.lock:
+                self.sock.sendall(ipc.pack(ftype, sid, payload))
+        except OSError:
+            self.waiters.pop(sid, None)
+            raise ConnectionError(f"{self.code} worker {self.idx} 無法連線")
+        if not waiter[0].wait(CALL_TIMEOUT) or waiter[1] is None:
+            self.waiters.pop(sid, None)
+            raise ConnectionError(f"{self.code} worker {self.idx} 沒有回應")
+        ok, balance, held, worker_ns, value = waiter[1]
+        hops[(self.code, _OP_NAMES[ftype])].add(time.perf_counter_ns() - t0, worker_ns)
+        return ok, balance, held, value
+
+    def _reader(self):
+        try:
+            for ftype, sid, payload in ipc.FrameReader(self.sock):
+                if ftype in (ipc.OUT, ipc.OUT_OPTIONAL):
+                    player = _sessions.get(sid)
+                    if player is not None:
+                        player.conn.enqueue(payload, ftype == ipc.OUT)
+                elif ftype == ipc.BAL:
+                    player = _sessions.get(sid)
+                    if player is not None:
+                        balance, held = ipc.BALANCE.unpack(payload)
+                        wallet.sync(player.account, balance, f"{self.code} worker", held)
+                elif ftype == ipc.ROOMSTAT:
+                    room_id, n, capacity, in_round = ipc.ROOM_STATUS.unpack(payload)
+                    lobby.update(self.code, room_id, None if n < 0 else n, capacity, in_round)
+                elif ftype == ipc.ACK:
+                    waiter = self.waiters.pop(sid, None)
+                    if waiter is not None:
+                        waiter[1] = ipc.ACK_BODY.unpack(payload)
+                        waiter[0].set()
+        except OSError:
+            pass
+        self._died()
+
+    def _died(self):
+        if _rundir is None:
+            return    # gateway 正在關閉
+        print(f"[GATEWAY] {self.code} worker {self.idx} 斷線，重新啟動")
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for waiter in list(self.waiters.values()):
+            waiter[0].set()
+        self.waiters.clear()
+
+        # 房間狀態隨 worker 消失：這些玩家送回大廳，還沒結算的下注退回
+        for sid in list(self.sids):
+            player = _sessions.get(sid)
+            if player is not None:
+                player.current_game = None
+                player.current_room = None
+                refunded = wallet.refund_held(player.account, f"{self.code} worker 重新啟動")
+                send_line(player.conn, f"【{self.code}】遊戲服務重新啟動，已回到大廳"
+                                       f"{f'，未結算的下注 {refunded} 已退回' if refunded else ''}")
+            _drop_session(sid)
+        self.sids.clear()
+        lobby.forget(self.code, lambda room_id: worker_for(self.code, room_id, self.n_workers) == self.idx)
+
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self._start()
+
+    def stop(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        if self.proc.poll() is None:
+            self.proc.terminate()
+
+
+def _session(player) -> int:
+    with _sessions_lock:
+        sid = _sid_by_conn.get(player.conn)
+        if sid is None:
+            sid = _sid_by_conn[player.conn] = next(_sid_seq)
+        _sessions[sid] = player
+        return sid
+
+
+def _drop_session(sid: int):
+    with _sessions_lock:
+        player = _sessions.pop(sid, None)
+        if player is not None:
+            _sid_by_conn.pop(player.conn, None)
+
+
+# ====== 註冊到 games 的代理物件 ======
+class GameProxy:
+    def __init__(self, code: str, max_rooms: int, n_workers: int):
+        self.code = code
+        self._max_rooms = max_rooms
+        self.links = [WorkerLink(code, i, n_workers, max_rooms) for i in range(n_workers)]
+        self._rr = itertools.count()
+
+    @property
+    def MAX_ROOMS(self):
+        return self._max_rooms
+
+    @MAX_ROOMS.setter
+    def MAX_ROOMS(self, n: int):
+        # games.set_max_rooms()（ADMIN ROOMS）：worker 的 pick_room 用自己的上限，跟著改
+        self._max_rooms = n
+        for link in self.links:
+            link.max_rooms = n
+            try:
+                link.call(ipc.LIMIT, next(_sid_seq), ipc.ROOM.pack(n))
+            except ConnectionError:
+                pass      # 重開的 worker 從命令列拿到新的上限
+
+    def _link(self, room_id: int) -> WorkerLink:
+        return self.links[worker_for(self.code, room_id, len(self.links))]
+
+    def _unavailable(self, player):
+        player.current_game = None
+        player.current_room = None
+        send_line(player.conn, f"【{self.code}】遊戲服務暫時無法使用，請稍後再試")
+
+    def enter(self, player, room_id: int):
+        sid = _session(player)
+        link = self._link(room_id)
+        payload = ipc.ENTER_HEAD.pack(room_id, player.balance) + player.name.encode()
+        try:
+            ok, balance, held, _ = link.call(ipc.ENTER, sid, payload)
+        except ConnectionError:
+            _drop_session(sid)
+            self._unavailable(player)
+            return False
+        wallet.sync(player.account, balance, f"{self.code} ENTER", held)
+        if ok:
+            link.sids.add(sid)
+        else:
+            _drop_session(sid)
+        return ok
+
+    def handle_command(self, player, raw, room_id: int):
+        sid = _session(player)
+        link = self._link(room_id)
+        try:
+            _, balance, held, _ = link.call(ipc.CMD, sid, ipc.ROOM.pack(room_id) + raw.encode())
+        except ConnectionError:
+            self._unavailable(player)
+            return
+        wallet.sync(player.account, balance, f"{self.code} CMD", held)
+
+    def remove_conn(self, conn, room_id: int):
+        sid = _sid_by_conn.get(conn)
+        if sid is None:
+            return
+        link = self._link(room_id)
+        player = _sessions.get(sid)
+        try:
+            _, balance, held, _ = link.call(ipc.LEAVE, sid, ipc.ROOM.pack(room_id))
+            if player is not None:
+                wallet.sync(player.account, balance, f"{self.code} LEAVE", held)
+        except ConnectionError:
+            pass
+        link.sids.discard(sid)
+        _drop_session(sid)
+
+    def pick_room(self, accept=None):
+        # 輪流問各個 worker，讓它查自己的人數索引挑；只送 place() 改過的房間，不用列出每個房號
+        # （--gateway 不能和 --workers 一起用，server 不會傳 accept 進來）
+        n = len(self.links)
+        idx = next(self._rr) % n
+        payload = b"".join(ipc.PLACED.pack(r, i == idx) for (code, r), i in list(placement.items())
+                           if code == self.code and i < n)
+        try:
+            _, _, _, room_id = self.links[idx].call(ipc.PICK, next(_sid_seq), payload)
+        except ConnectionError:
+            return None
+        if room_id and accept is not None and not accept(room_id):
+            return None
+        return room_id or None
+
+
+# ====== 啟動 ======
+def parse_spec(spec: str) -> dict:
+    """"BIG2=2,TTT=1" -> {"BIG2": 2, "TTT": 1}；數字不合法時丟 ValueError"""
+    out = {}
+    for item in filter(None, (spec or "").split(",")):
+        code, _, n = item.partition("=")
+        try:
+            out[code.strip().upper()] = int(n or 1)
+        except ValueError:
+            raise ValueError(f"{item.strip()}：數量要是整數") from None
+    return out
+
+
+def _report_loop(interval):
+    while True:
+        time.sleep(interval)
+        for line in hop_report():
+            print("[HOP]", line)
+
+
+def install(spec: dict, report_interval=60):
+    """開 worker process，把 games 裡的遊戲換成 GameProxy"""
+    global _rundir
+    _rundir = tempfile.mkdtemp(prefix="casino-gw-")
+    for code in games.codes():
+        real = games.get(code)
+        proxy = GameProxy(code, real.MAX_ROOMS, max(1, spec.get(code, 1)))
+        _links.extend(proxy.links)
+        games.register(code, proxy)
+    if report_interval:
+        threading.Thread(target=_report_loop, args=(report_interval,), daemon=True).start()
+
+
+def active() -> bool:
+    return bool(_links)
+
+
+def shutdown():
+    global _rundir
+    rundir, _rundir = _rundir, None
+    for link in _links:
+        link.stop()
+    if rundir:
+        shutil.rmtree(rundir, ignore_errors=True)
@@ -0,0 +1,56 @@
+"""gateway <-> game worker 之間的內部 framing（走 Unix socket）
+
+每個 frame：1 byte 類型 + 4 bytes session id + 4 bytes 長度 + payload。
+"""
+import struct
+
+HEADER = struct.Struct("!BII")
+
+# gateway -> worker
+ENTER = 1      # payload: room(u32) balance(i64) name(utf-8)
+CMD = 2        # payload: room(u32) raw(utf-8)
+LEAVE = 3      # payload: room(u32)
+PICK = 4       # payload: (房號 u32, 是否歸這個 worker bool) * n，只有 gateway.place() 改過的房間；其他依 --worker-index
+LIMIT = 10     # payload: 房號上限 u32（ADMIN ROOMS 調整時）
+# worker -> gateway
+OUT = 5        # payload: 要送給 client 的 bytes（已 encode、含 \n）
+BAL = 6        # payload: balance(i64) held(i64)，玩家餘額被別人的動作改到時主動通知
+ACK = 7        # payload: ok(bool) balance(i64) held(i64) worker_ns(u64) value(i32)
+OUT_OPTIONAL = 8   # 同 OUT，但是非必要廣播（慢速 client 可丟棄）
+ROOMSTAT = 9   # payload: room(u32) 人數(i32，-1 = 已回收) 上限(u32) 進行中(bool)，給大廳的 ROOMS 列表
+
+ROOM = struct.Struct("!I")
+ENTER_HEAD = struct.Struct("!Iq")
+BALANCE = struct.Struct("!qq")      # 可用餘額、還沒結算的下注（held）
+ACK_BODY = struct.Struct("!?qqQi")
+ROOM_STATUS = struct.Struct("!IiI?")
+PLACED = struct.Struct("!I?")
+
+
+def pack(ftype: int, sid: int, payload: bytes = b"") -> bytes:
+    return HEADER.pack(ftype, sid, len(payload)) + payload
+
+
+class FrameReader:
+    def __init__(self, sock):
+        self.sock = sock
+        self._buf = bytearray()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """回傳 (ftype, sid, payload)；對方關閉時 StopIteration"""
+        buf = self._buf
+        while True:
+            if len(buf) >= HEADER.size:
+                ftype, sid, n = HEADER.unpack_from(buf)
+                end = HEADER.size + n
+                if len(buf) >= end:
+                    payload = bytes(buf[HEADER.size:end])
+                    del buf[:end]
+                    return ftype, sid, payload
+            data = self.sock.recv(65536)
+            if not data:
+                raise StopIteration
+            buf += data
@@ -0,0 +1,151 @@
+"""每個指令在 server 端花多久：(遊戲, 指令) -> log-linear 直方圖
+
+server.handle_command 從拿到一行到處理完（包括轉給遊戲模組的 handle_command）量一次，
+記在指令實際交給的遊戲底下：HELLO / PLAY 這些是 LOBBY，房間裡的 MOVE / HIT 是該遊戲
+（--gateway 時包括 gateway -> worker 的往返，worker 內的時間見 ADMIN HOPS）。
+ADMIN STATS 看 p50 / p95 / p99 / max，ADMIN STATS RESET 歸零。
+
+直方圖：比 2**(SUB_BITS + 1) ns 小的值一格一個，之後每個 2 的次方切成 2**SUB_BITS 格，
+百分位的誤差不超過 1/2**SUB_BITS。每個指令多出來的成本（兩次讀時鐘加 record()）用 python bench.py stats 量，
+不想要這份成本就以 --no-latency-stats 啟動。
+不拿 lock：好幾條 thread 同時記同一格時偶爾會少算一筆，統計用途可以接受。
+指令名稱來自玩家輸入：只有 register() 登記過的名字會各自一列，其他的都記在 "?"，列數不會無限長大。
+每一列的 Histogram 在 register() 時就建好：server 先拿到各遊戲的 {指令: Histogram}，
+記一筆只查一次 str key 的 dict；RESET 是把每一格歸零，不換物件。
+"""
+import threading
+import time
+
+ENABLED = True
+SUB_BITS = 4
+MAX_BITS = 40                               # 2**40 ns ≈ 18 分鐘，更久的算在最後一格
+BUCKETS = (MAX_BITS - SUB_BITS + 1) << SUB_BITS
+_LINEAR_BITS = SUB_BITS + 1
+_MAX_NS = (1 << MAX_BITS) - 1
+_MAX_SHIFT = MAX_BITS - _LINEAR_BITS
+
+rows = {}             # game -> {cmd -> Histogram}，一定有 "?"
+_rows_lock = threading.Lock()     # 只有 register() 建新列時拿
+_since = time.time()
+
+
+class Histogram:
+    __slots__ = ("counts", "max", "sum")
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.max = 0
+        self.sum = 0              # 實際的總和（ns），給平均與 metrics 的 _sum
+
+    def add(self, ns: int):
+        self.sum += ns
+        shift = ns.bit_length() - _LINEAR_BITS
+        if shift <= 0:
+            self.counts[ns] += 1
+        else:
+            if shift > _MAX_SHIFT:
+                ns, shift = _MAX_NS, _MAX_SHIFT
+            self.counts[(shift << SUB_BITS) + (ns >> shift)] += 1
+        if ns > self.max:
+            self.max = ns
+
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def mean(self) -> float:
+        return self.sum / max(1, self.count())
+
+    def percentile(self, p) -> int:
+        """p 百分位落在的那一格的上界（ns，不超過 max）"""
+        need = p / 100.0 * self.count()
+        seen = 0
+        for idx, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= need:
+                return min(self.max, bucket_bounds(idx)[1])
+        return self.max
+
+    def cumulative(self, bounds):
+        """bounds（ns，由小到大）每個值以下的筆數：上界不超過它的格子加總（給 metrics 輸出 le）"""
+        out = []
+        seen = 0
+        idx = 0
+        for b in bounds:
+            while idx < BUCKETS and bucket_bounds(idx)[1] <= b + 1:
+                seen += self.counts[idx]
+                idx += 1
+            out.append(seen)
+        return out
+
+
+def bucket_bounds(idx: int):
+    """第 idx 格涵蓋的 [lo, hi) ns"""
+    if idx < (1 << _LINEAR_BITS):
+        return idx, idx + 1
+    shift = (idx >> SUB_BITS) - 1
+    m = idx - (shift << SUB_BITS)
+    return m << shift, (m + 1) << shift
+
+
+def register(game: str, commands=()) -> dict:
+    """登記 game 的指令名稱（各遊戲模組 import 時呼叫，大廳是 LOBBY）；回傳這個遊戲的 {指令: Histogram}"""
+    with _rows_lock:
+        hists = dict(rows.get(game) or {"?": Histogram()})
+        for cmd in commands:
+            if cmd not in hists:
+                hists[cmd] = Histogram()
+        rows[game] = hists    # 整個換掉：讀的人不拿 lock，看到的不是舊的就是新的
+    return hists
+
+
+def record(hists: dict, cmd: str, ns: int):
+    """hists 是 register() 回傳的 {指令: Histogram}；沒登記過的指令記在 "?" 那一列"""
+    # Histogram.add 的內容直接展開：每個指令都會走到這裡，省一次函式呼叫
+    h = hists.get(cmd) or hists["?"]
+    h.sum += ns
+    shift = ns.bit_length() - _LINEAR_BITS
+    if shift <= 0:
+        h.counts[ns] += 1
+    else:
+        if shift > _MAX_SHIFT:
+            ns, shift = _MAX_NS, _MAX_SHIFT
+        h.counts[(shift << SUB_BITS) + (ns >> shift)] += 1
+    if ns > h.max:
+        h.max = ns
+
+
+def histograms():
+    """目前所有的 ((game, cmd), Histogram)"""
+    return [((game, cmd), h) for game, hists in list(rows.items()) for cmd, h in hists.items()]
+
+
+def reset():
+    global _since
+    for _, h in histograms():
+        h.counts = [0] * BUCKETS
+        h.max = h.sum = 0
+    _since = time.time()
+
+
+def _us(ns) -> str:
+    return f"{ns / 1e3:.1f}" if ns < 10_000_000 else f"{ns / 1e3:.0f}"
+
+
+def report(game=None):
+    lines = [f"指令延遲（us），自 {time.strftime('%H:%M:%S', time.localtime(_since))} 起"
+             + ("" if ENABLED else "（已關閉，server 以 --no-latency-stats 啟動）")]
+    for g, c, h, n in sorted(((g, c, h, h.count()) for (g, c), h in histograms() if game is None or g == game),
+                             key=lambda r: (r[0] != "LOBBY", r[0], -r[3])):
+        if not n:
+            continue
+        lines.append(f"{g:9} {c:8} n={n:<8} avg={_us(h.mean()):>7} p50={_us(h.percentile(50)):>7} "
+                     f"p95={_us(h.percentile(95)):>7} p99={_us(h.percentile(99)):>7} max={_us(h.max):>8}")
+    if len(lines) == 1:
+        lines.append("還沒有資料")
+    return lines
+
+
+def configure(enabled=None):
+    global ENABLED
+    if enabled is not None:
+        ENABLED = bool(enabled)
@@ -0,0 +1,188 @@
+"""大廳的房間列表（ROOMS 指令）
+
+各遊戲的 RoomTable 在房間 lock 放開時通知這裡（roomtable.watch），gateway 模式則由 game worker
+用 ROOMSTAT frame 轉過來。列表只讀這裡的索引，不用碰任何房間的 lock，房間再多也只是切一頁出來。
+--workers 模式下每個 worker 只看得到自己管的房間：變動另外用 cluster.notify 送一份給 coordinator
+（主 process 不跑遊戲，它的索引就是全部 worker 合起來的），ROOMS 改問 coordinator。
+worker 掛掉時 coordinator 把歸它管的房間拿掉。
+"""
+import bisect
+
+import cluster
+import games
+import locks
+import metrics
+import roomtable
+from outbound import send_line
+
+PAGE_SIZE = 20
+
+# 篩選條件 -> (有空位, 沒在進行中)
+_FILTERS = {"all": (False, False), "open": (True, False), "idle": (False, True), "open_idle": (True, True)}
+
+
+class GameIndex:
+    """一個遊戲的房間狀態；每種篩選各維護一份排序好的房號，翻頁就是切片"""
+
+    def __init__(self):
+        self.rooms = {}           # room_id -> (人數, 上限, 進行中)
+        self.sorted = {key: [] for key in _FILTERS}
+
+    @staticmethod
+    def _matches(state, key):
+        n, capacity, in_round = state
+        need_open, need_idle = _FILTERS[key]
+        return (not need_open or n < capacity) and (not need_idle or not in_round)
+
+    def update(self, room_id: int, state):
+        old = self.rooms.get(room_id)
+        if state is None:
+            self.rooms.pop(room_id, None)
+        else:
+            self.rooms[room_id] = state
+        for key, ids in self.sorted.items():
+            was = old is not None and self._matches(old, key)
+            now = state is not None and self._matches(state, key)
+            if was and not now:
+                del ids[bisect.bisect_left(ids, room_id)]
+            elif now and not was:
+                bisect.insort(ids, room_id)
+
+    def page(self, key: str, page: int):
+        """回傳 (符合的房間數, [(room_id, 人數, 上限, 進行中)])"""
+        ids = self.sorted[key]
+        start = (page - 1) * PAGE_SIZE
+        return len(ids), [(rid, *self.rooms[rid]) for rid in ids[start:start + PAGE_SIZE]]
+
+
+_indexes = {}             # game code -> GameIndex
+_lock = locks.Lock("lobby.rooms")
+
+
+def update(code: str, room_id: int, n, capacity: int, in_round: bool):
+    """房間狀態改變；n 是 None 表示房間已回收"""
+    _apply(code, room_id, n, capacity, in_round)
+    if cluster.active():
+        cluster.notify("room", code=code, room=room_id, n=n, capacity=capacity, in_round=bool(in_round))
+
+
+def _apply(code: str, room_id: int, n, capacity: int, in_round: bool):
+    state = None if n is None else (n, capacity, bool(in_round))
+    with _lock:
+        index = _indexes.get(code)
+        if index is None:
+            index = _indexes[code] = GameIndex()
+        index.update(room_id, state)
+
+
+def forget(code: str, lost):
+    """lost(room_id) 為真的房間都不見了（gateway 的遊戲 worker 重開）"""
+    with _lock:
+        index = _indexes.get(code)
+        if index is not None:
+            for rid in [rid for rid in index.rooms if lost(rid)]:
+                index.update(rid, None)
+
+
+def counts():
+    """[(code, 房間數, 進行中的房間數)]：只讀索引的大小（metrics 抓的時候用）"""
+    with _lock:
+        return [(code, len(index.rooms), len(index.rooms) - len(index.sorted["idle"]))
+                for code, index in _indexes.items()]
+
+
+roomtable.watch(update)
+metrics.collect("casino_rooms", "gauge", "存在的房間",
+                lambda: [({"game": code}, total) for code, total, _ in counts()])
+metrics.collect("casino_rooms_in_round", "gauge", "牌局進行中的房間",
+                lambda: [({"game": code}, busy) for code, _, busy in counts()])
+
+
+# ====== ROOMS 指令 ======
+def _totals():
+    """[(code, 房間數, 有空位, 進行中)]"""
+    out = []
+    with _lock:
+        for code in games.codes():
+            index = _indexes.get(code)
+            total = len(index.rooms) if index else 0
+            n_open = len(index.sorted["open"]) if index else 0
+            busy = total - len(index.sorted["idle"]) if index else 0
+            out.append((code, total, n_open, busy))
+    return out
+
+
+def _page(code: str, key: str, page: int):
+    with _lock:
+        index = _indexes.get(code)
+        return index.page(key, page) if index else (0, [])
+
+
+# coordinator 端（主 process）：worker 送來的變動與 ROOMS 查詢
+def _on_room(req):
+    _apply(req["code"], req["room"], req["n"], req["capacity"], req["in_round"])
+
+
+def _on_rooms(req):
+    if req.get("code") is None:
+        return {"totals": _totals()}
+    total, rows = _page(req["code"], req["key"], req["page"])
+    return {"total": total, "rows": rows}
+
+
+def _worker_lost(worker):
+    for code in games.codes():
+        forget(code, lambda room_id: cluster.owner(code, room_id) == worker)
+
+
+cluster.coordinator_op("room", _on_room, lost=_worker_lost)
+cluster.coordinator_op("rooms", _on_rooms)
+
+
+def _summary():
+    lines = ["【房間一覽】"]
+    totals = cluster.query("rooms")["totals"] if cluster.active() else _totals()
+    for code, total, n_open, busy in totals:
+        lines.append(f"{code:10} {total:5} 間  有空位 {n_open:<5} 進行中 {busy}")
+    lines.append("用法：ROOMS <GAME> [OPEN] [IDLE] [頁數]（OPEN：有空位；IDLE：沒有進行中的牌局）")
+    return lines
+
+
+def handle(player, parts):
+    conn = player.conn
+    args = [p.upper() for p in parts[1:]]
+    if not args:
+        send_line(conn, "\n".join(_summary()))
+        return
+
+    code = args[0]
+    if games.get(code) is None:
+        send_line(conn, "未知遊戲")
+        return
+    page = 1
+    flags = set()
+    for arg in args[1:]:
+        if arg.isdigit() and int(arg) >= 1:
+            page = int(arg)
+        elif arg in ("OPEN", "IDLE"):
+            flags.add(arg)
+        else:
+            send_line(conn, "用法：ROOMS <GAME> [OPEN] [IDLE] [頁數]")
+            return
+    key = "_".join(f.lower() for f in ("OPEN", "IDLE") if f in flags) or "all"
+
+    if cluster.active():
+        resp = cluster.query("rooms", code=code, key=key, page=page)
+        total, rows = resp["total"], resp["rows"]
+    else:
+        total, rows = _page(code, key, page)
+    pages = max(1, -(-total // PAGE_SIZE))
+    title = "".join(f" {f}" for f in ("OPEN", "IDLE") if f in flags)
+    lines = [f"【{code} 房間{title}】共 {total} 間  第 {page}/{pages} 頁"]
+    for rid, n, capacity, in_round in rows:
+        lines.append(f"#{rid:<6} {n}/{capacity}  {'進行中' if in_round else '等待中'}")
+    if not rows:
+        lines.append(f"（沒有符合的房間，可用 PLAY {code} 直接進入新房間）")
+    if page < pages:
+        lines.append(f"下一頁：ROOMS {code}{title} {page + 1}")
+    send_line(conn, "\n".join(lines))
@@ -0,0 +1,249 @@
+"""lock 與 lock 統計
+
+房間 lock：每個房間有自己的一把 RoomLock（Room.lock），不同房間的指令不會互相等待。
+
+取得順序（避免 deadlock）：
+- 要同時鎖好幾個房間時一律用 hold()，依 (遊戲, 房號) 由小到大取得
+- 持有房間 lock 時，只能再拿「不會回頭拿房間 lock」的 lock（例如送出佇列的 Condition、房間表的 lock）；
+  server 的 clients_lock / names_lock 不能在房間 lock 裡面拿
+
+統計（--lock-stats）：每把 Lock 記錄等待時間、持有時間（log2 直方圖）與持有最久的程式位置。
+沒開的時候 Lock 就是一把普通的 RLock，不做任何記錄。
+開關只在啟動時切換（configure），不能在有人持有 lock 的時候切。
+"""
+import _thread
+import contextlib
+import os
+import sys
+import threading
+import time
+
+ENABLED = False
+BUCKETS = 24           # 直方圖第 i 格：< 2**i 微秒（最後一格放更久的）
+
+_stats = {}            # name -> LockStats（房間重建時沿用同名的統計）
+_stats_lock = threading.Lock()    # 只保護 _stats 這個 dict
+_SKIP_FILES = {__file__, contextlib.__file__}
+_SKIP_CODES = set()    # 幫別人拿 lock 的 helper（記錄位置時跳過，記它的呼叫者）
+
+
+def _bucket(ns: int) -> int:
+    return min(BUCKETS - 1, (ns >> 10).bit_length())
+
+
+def _hist_pct(hist, p) -> int:
+    """從直方圖估 p 百分位（回傳該格的上界，ns）"""
+    total = sum(hist)
+    if not total:
+        return 0
+    need = p / 100.0 * total
+    seen = 0
+    for i, n in enumerate(hist):
+        seen += n
+        if seen >= need:
+            return (1 << i) << 10
+    return (1 << (BUCKETS - 1)) << 10
+
+
+def passthrough(fn):
+    """decorator：這個函式是替呼叫者拿 lock 的，統計的持有位置要記到呼叫者身上"""
+    _SKIP_CODES.add(fn.__code__)
+    return fn
+
+
+def _caller_site():
+    f = sys._getframe(2)
+    while f is not None and (f.f_code.co_filename in _SKIP_FILES or f.f_code in _SKIP_CODES):
+        f = f.f_back
+    return (f.f_code, f.f_lineno) if f is not None else None
+
+
+def _fmt_site(site) -> str:
+    if site is None:
+        return "?"
+    code, line = site
+    return f"{os.path.basename(code.co_filename)}:{line} {code.co_name}"
+
+
+class LockStats:
+    """一把 lock 的統計；只在持有該 lock 時更新，所以不需要另外的 lock"""
+
+    __slots__ = ("name", "acquired", "contended", "wait_ns", "wait_max", "wait_hist",
+                 "hold_ns", "hold_max", "hold_max_site", "hold_hist", "sites")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.acquired = 0
+        self.contended = 0
+        self.wait_ns = 0
+        self.wait_max = 0
+        self.wait_hist = [0] * BUCKETS
+        self.hold_ns = 0
+        self.hold_max = 0
+        self.hold_max_site = None
+        self.hold_hist = [0] * BUCKETS
+        self.sites = {}         # (code, line) -> [次數, 總持有 ns, 最長 ns]
+
+
+def stats_for(name: str) -> LockStats:
+    with _stats_lock:
+        st = _stats.get(name)
+        if st is None:
+            st = _stats[name] = LockStats(name)
+        return st
+
+
+def forget(name: str):
+    """名字不會再用的 lock（例如已銷戶的錢包），統計不用再留著"""
+    with _stats_lock:
+        _stats.pop(name, None)
+
+
+_RLock = _thread.RLock
+
+
+class Lock(_RLock):
+    """有名字的 lock（可重入）
+
+    直接繼承 C 實作的 RLock：沒開統計時 acquire / release / with 用的就是原本的 C 方法，
+    和 threading.RLock() 一樣快；configure(enabled=True) 才把這幾個方法換成會記錄的版本。
+    """
+
+    __slots__ = ("name", "_stats", "_depth", "_since", "_site")
+
+    def __new__(cls, *args, **kwargs):
+        return super().__new__(cls)
+
+    def __init__(self, name: str):
+        self.name = name
+        self._stats = stats_for(name)
+        self._depth = 0     # 以下三個只有持有者會動
+        self._since = 0
+        self._site = None
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name}>"
+
+    def _tracked_acquire(self, blocking=True, timeout=-1):
+        wait = 0
+        if not _RLock.acquire(self, False):
+            if not blocking:
+                return False
+            t0 = time.perf_counter_ns()
+            if not _RLock.acquire(self, True, timeout):
+                return False
+            wait = time.perf_counter_ns() - t0
+
+        self._depth += 1
+        if self._depth == 1:      # 重入不重複計
+            st = self._stats
+            st.acquired += 1
+            if wait:
+                st.contended += 1
+                st.wait_ns += wait
+                st.wait_hist[_bucket(wait)] += 1
+                if wait > st.wait_max:
+                    st.wait_max = wait
+            self._site = _caller_site()
+            self._since = time.perf_counter_ns()
+        return True
+
+    def _tracked_release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            held = time.perf_counter_ns() - self._since
+            st = self._stats
+            st.hold_ns += held
+            st.hold_hist[_bucket(held)] += 1
+            if held > st.hold_max:
+                st.hold_max = held
+                st.hold_max_site = self._site
+            rec = st.sites.get(self._site)
+            if rec is None:
+                st.sites[self._site] = [1, held, held]
+            else:
+                rec[0] += 1
+                rec[1] += held
+                if held > rec[2]:
+                    rec[2] = held
+        _RLock.release(self)
+
+    def _tracked_enter(self):
+        self._tracked_acquire()
+        return self
+
+    def _tracked_exit(self, *exc):
+        self._tracked_release()
+
+
+_PLAIN = {name: getattr(_RLock, name) for name in ("acquire", "release", "__enter__", "__exit__")}
+_TRACKED = {"acquire": Lock._tracked_acquire, "release": Lock._tracked_release,
+            "__enter__": Lock._tracked_enter, "__exit__": Lock._tracked_exit}
+
+
+class RoomLock(Lock):
+    __slots__ = ("key",)
+
+    def __init__(self, game: str, room_id: int):
+        super().__init__(f"{game}#{room_id}")
+        self.key = (game, room_id)      # hold() 用來排序
+
+
+@contextlib.contextmanager
+def hold(*room_locks):
+    """依固定順序鎖住多個房間（重複的只鎖一次）"""
+    ordered = sorted(set(room_locks), key=lambda lock: lock.key)
+    taken = []
+    try:
+        for lock in ordered:
+            lock.acquire()
+            taken.append(lock)
+        yield
+    finally:
+        for lock in reversed(taken):
+            lock.release()
+
+
+# ====== 開關與報表 ======
+def configure(enabled=None):
+    global ENABLED
+    if enabled is None:
+        return
+    ENABLED = bool(enabled)
+    for name, method in (_TRACKED if ENABLED else _PLAIN).items():
+        setattr(Lock, name, method)
+
+
+def reset():
+    with _stats_lock:
+        for st in _stats.values():
+            st.reset()
+
+
+def report(top=10):
+    """回傳報表的每一行：等最久的 lock、持有最久的程式位置"""
+    with _stats_lock:
+        all_stats = [st for st in _stats.values() if st.acquired]
+    if not all_stats:
+        return ["（目前沒有任何 lock 統計）"]
+
+    lines = [f"== 等待最久的 lock（前 {top}）==",
+             f"{'lock':16} {'取得':>8} {'競爭%':>6} {'總等待ms':>9} {'等待p99us':>9} {'等待max':>9}"
+             f" {'持有p99us':>9} {'持有max':>9}"]
+    for st in sorted(all_stats, key=lambda s: (s.wait_ns, s.hold_ns), reverse=True)[:top]:
+        lines.append(f"{st.name:16} {st.acquired:8} {st.contended * 100.0 / st.acquired:5.1f}% "
+                     f"{st.wait_ns / 1e6:9.2f} {_hist_pct(st.wait_hist, 99) / 1e3:9.0f} "
+                     f"{st.wait_max / 1e3:7.0f}us {_hist_pct(st.hold_hist, 99) / 1e3:9.0f} "
+                     f"{st.hold_max / 1e3:7.0f}us")
+
+    holders = []
+    for st in all_stats:
+        for site, (n, total, longest) in list(st.sites.items()):
+            holders.append((longest, total, n, st.name, site))
+    lines.append(f"== 持有最久的位置（前 {top}）==")
+    for longest, total, n, name, site in sorted(holders, key=lambda h: h[0], reverse=True)[:top]:
+        lines.append(f"{name:16} max={longest / 1e3:7.0f}us avg={total / n / 1e3:6.1f}us n={n:<7} {_fmt_site(site)}")
+    return lines
@@ -0,0 +1,195 @@
+"""Prometheus 格式的監控指標：--metrics-port 開一個只給監控系統抓的 HTTP listener（GET /metrics）
+
+指標分兩種：
+- Counter：server 與遊戲模組在事情發生時 inc()。每條 thread 加在自己的那一格（shard），
+  一格只有一條 thread 會寫，不用 lock 也不會少算；抓的時候才把各格加起來。
+  thread 結束時它的格子併進 Counter 的 _retired：一個連線一條 thread 也不會讓格子越積越多
+- collect() 登記的函式：抓的時候才讀，只能讀 len() 這種 O(1) 的值，不能去掃房間
+
+  casino_clients                                    連線數
+  casino_players{game}                              在各遊戲房間裡的玩家
+  casino_rooms{game} / casino_rooms_in_round{game}  存在的 / 進行中的房間（大廳索引的大小）
+  casino_rounds_started_total{game} / casino_rounds_finished_total{game}
+  casino_chips_wagered_total{game}                  下注（wallet.reserve）
+  casino_chips_paid_total{game}                     還給玩家的（派彩含本金 + 退回）；wagered - paid 就是莊家收入
+  casino_bytes_received_total / casino_bytes_sent_total
+  casino_command_duration_seconds{game,command}     latency.py 的直方圖；_count 就是指令數，rate() 就是指令速率
+
+房間和錢包在哪個 process，指標就在哪個 process：--workers 第 i 個 worker 聽 PORT+i；
+--gateway 時 gateway 聽 PORT，遊戲 worker 依序聽 PORT+1、PORT+2…
+"""
+import http.server
+import threading
+from threading import get_ident
+
+import latency
+
+HOST = "127.0.0.1"
+PORT = None                   # None = 不開
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 直方圖輸出的 le（秒）；latency 的格子比這細很多，每個 le 算的是上界不超過它的格子
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_families = {}                # name -> [type, help, {labels: Counter}]
+_collectors = []              # (name, type, help, fn() -> [(labels dict, value)])
+_families_lock = threading.Lock()    # 只有建立新的 Counter 時拿
+_retire_lock = threading.Lock()      # thread 結束併格子 / 抓值時拿；inc() 不拿
+_local = threading.local()
+_server = None
+
+
+class _ThreadShards:
+    """一條 thread 開過格子的 Counter；thread 結束時 threading.local 丟掉它，__del__ 把那些格子併掉"""
+
+    __slots__ = ("tid", "counters")
+
+    def __init__(self):
+        self.tid = get_ident()
+        self.counters = []
+
+    def __del__(self):
+        with _retire_lock:
+            for c in self.counters:
+                c._retired += c._shards.pop(self.tid, 0)
+
+
+class Counter:
+    """thread 分格的計數器（gauge 也用它：inc 負數就是減）"""
+
+    __slots__ = ("_shards", "_retired")
+
+    def __init__(self):
+        self._shards = {}     # thread id -> 這條 thread 加的總和（只有還活著的 thread）
+        self._retired = 0     # 已結束的 thread 加的總和
+
+    def inc(self, n=1):
+        shards = self._shards
+        tid = get_ident()
+        v = shards.get(tid)
+        if v is None:
+            # 這條 thread 第一次加這個 Counter：登記起來，thread 結束時才併得掉
+            owned = getattr(_local, "shards", None)
+            if owned is None:
+                owned = _local.shards = _ThreadShards()
+            owned.counters.append(self)
+            v = 0
+        shards[tid] = v + n
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    def value(self):
+        with _retire_lock:
+            return self._retired + sum(list(self._shards.values()))
+
+
+def _metric(kind: str, name: str, help: str, labels: dict) -> Counter:
+    key = tuple(sorted(labels.items()))
+    family = _families.get(name)
+    if family is not None:
+        c = family[2].get(key)
+        if c is not None:
+            return c
+    with _families_lock:
+        family = _families.setdefault(name, [kind, help, {}])
+        return family[2].setdefault(key, Counter())
+
+
+def counter(name: str, help: str, **labels) -> Counter:
+    """同一個名字與 labels 拿到的是同一個 Counter；熱的路徑在 import 時先拿好存起來"""
+    return _metric("counter", name, help, labels)
+
+
+def gauge(name: str, help: str, **labels) -> Counter:
+    return _metric("gauge", name, help, labels)
+
+
+def collect(name: str, kind: str, help: str, fn):
+    """抓的時候呼叫 fn()，回傳 [(labels dict, 值)]"""
+    _collectors.append((name, kind, help, fn))
+
+
+# ====== 輸出 ======
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _latency_lines():
+    name = "casino_command_duration_seconds"
+    lines = [f"# HELP {name} server.handle_command 每個指令的處理時間",
+             f"# TYPE {name} histogram"]
+    bounds = [int(le * 1e9) for le in LATENCY_BUCKETS]
+    for (game, cmd), h in latency.histograms():
+        counts = h.cumulative(bounds)
+        total = h.count()
+        if not total:
+            continue
+        base = [("game", game), ("command", cmd)]
+        for le, n in zip(LATENCY_BUCKETS, counts):
+            lines.append(f"{name}_bucket{_labels(base + [('le', f'{le:g}')])} {n}")
+        lines.append(f"{name}_bucket{_labels(base + [('le', '+Inf')])} {total}")
+        lines.append(f"{name}_sum{_labels(base)} {h.sum / 1e9:.9f}")
+        lines.append(f"{name}_count{_labels(base)} {total}")
+    return lines
+
+
+def render() -> str:
+    lines = []
+    for name, (kind, help, series) in sorted(list(_families.items())):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, c in sorted(list(series.items())):
+            lines.append(f"{name}{_labels(key)} {c.value()}")
+    for name, kind, help, fn in _collectors:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in fn():
+            lines.append(f"{name}{_labels(sorted(labels.items()))} {value}")
+    lines.extend(_latency_lines())
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(offset: int = 0):
+    """在背景 thread 開 listener（PORT + offset）；開不起來只印錯誤，不影響遊戲"""
+    global _server
+    if PORT is None or _server is not None:
+        return
+    try:
+        _server = http.server.ThreadingHTTPServer((HOST, PORT + offset), _Handler)
+    except OSError as e:
+        print(f"[ERROR] metrics: 無法在 {HOST}:{PORT + offset} 開啟：", e)
+        return
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    print(f"[METRICS] http://{HOST}:{PORT + offset}/metrics")
+
+
+def configure(port=None, host=None):
+    global PORT, HOST
+    if host:
+        HOST = host
+    if port:
+        PORT = int(port)
@@ -0,0 +1,384 @@
+"""每個連線的送出佇列
+
+遊戲模組只負責把訊息放進佇列（send_line），真正寫 socket 的是每個連線自己的 writer。
+所以就算某個 client 收得很慢（TCP 視窗滿了），也不會在持有遊戲 lock 的時候卡住整個模組。
+
+一個指令常常會送出好幾行（例如 BIG2 開局：廣播 + 每人手牌 + 籌碼 + 輪到誰），
+server 會把每個指令包在 batch() 裡：期間送給同一個連線的訊息先收集起來，
+結束時合併成一筆放進佇列，writer 再一次寫出（一次 syscall、通常一個封包）。
+"""
+import asyncio
+import collections
+import contextlib
+import contextvars
+import socket
+import threading
+
+import locks
+import metrics
+
+# ====== 慢速 client 處理策略（可用 configure() 調整） ======
+SOFT_LIMIT = 64 * 1024    # 尚未送出的 bytes 超過此值：非必要廣播直接丟掉
+HARD_LIMIT = 512 * 1024   # 超過此值：判定對方卡死，直接斷線
+CLOSE_TIMEOUT = 2.0       # 關閉連線時，最多等幾秒把剩下的訊息送完
+
+# ====== 寫出合併 ======
+COALESCE = True           # batch() 合併同一指令的輸出；writer 一次寫出佇列裡累積的多筆
+WRITE_CHUNK = 64 * 1024   # writer 一次最多合併幾 bytes
+TCP_NODELAY = False       # 關掉 Nagle（thread 引擎；asyncio 本來就預設開 TCP_NODELAY）
+TCP_CORK = False          # writer 還有後續資料時先 cork，佇列清空才 uncork（Linux）
+
+_live = set()             # 目前所有連線（給 metrics 用）
+_live_lock = locks.Lock("outbound.live")
+_totals = {"dropped": 0, "slow_disconnects": 0}
+_BYTES_OUT = metrics.counter("casino_bytes_sent_total", "送給玩家的 bytes")
+
+
+_batch = contextvars.ContextVar("outbound_batch", default=None)   # conn -> [(data, essential)]
+
+
+def configure(soft_limit=None, hard_limit=None, close_timeout=None,
+              coalesce=None, nodelay=None, cork=None):
+    global SOFT_LIMIT, HARD_LIMIT, CLOSE_TIMEOUT, COALESCE, TCP_NODELAY, TCP_CORK
+    if soft_limit is not None:
+        SOFT_LIMIT = soft_limit
+    if hard_limit is not None:
+        HARD_LIMIT = hard_limit
+    if close_timeout is not None:
+        CLOSE_TIMEOUT = close_timeout
+    if coalesce is not None:
+        COALESCE = coalesce
+    if nodelay is not None:
+        TCP_NODELAY = nodelay
+    if cork is not None:
+        TCP_CORK = cork and hasattr(socket, "TCP_CORK")
+
+
+def tune(sock: socket.socket):
+    if TCP_NODELAY:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+
+def _encode(msg: str) -> bytes:
+    if msg is None:
+        msg = ""
+    if not msg.endswith("\n"):
+        msg += "\n"
+    return msg.encode()
+
+
+def _put(conn, data: bytes, essential: bool):
+    pending = _batch.get()
+    if pending is None:
+        conn.enqueue(data, essential)
+        return
+    items = pending.get(conn)
+    if items is None:
+        pending[conn] = [(data, essential)]
+    else:
+        items.append((data, essential))
+
+
+def send_line(conn, msg: str, essential=True):
+    if conn is None:
+        return
+    try:
+        _put(conn, _encode(msg), essential)
+    except:
+        pass
+
+
+def broadcast(conns, msg: str, essential=True):
+    """同一則訊息只 encode 一次，所有收件人共用同一個（不可變的）bytes"""
+    payload = _encode(msg)
+    for c in list(conns):
+        if c is None:
+            continue
+        try:
+            _put(c, payload, essential)
+        except:
+            pass
+
+
+# ====== 一個指令的輸出合併 ======
+@contextlib.contextmanager
+def batch():
+    """範圍內送給同一個連線的訊息先收著，離開時每個連線只 enqueue 一次（可巢狀，只有最外層會送）"""
+    if not COALESCE or _batch.get() is not None:
+        yield
+        return
+    pending = {}
+    token = _batch.set(pending)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+        _flush(pending)
+
+
+def flush():
+    """把目前 batch 收到的訊息先送出
+
+    要在遊戲 lock 還沒放掉前呼叫：不然另一個 thread 可能搶先送出它的 batch，
+    同一房間的廣播就會順序顛倒。
+    """
+    pending = _batch.get()
+    if pending:
+        _flush(pending)
+
+
+def _flush(pending: dict):
+    for conn, items in pending.items():
+        try:
+            if len(items) == 1:
+                conn.enqueue(*items[0])
+            elif hasattr(conn, "enqueue_many"):
+                conn.enqueue_many(items)
+            else:
+                for data, essential in items:
+                    conn.enqueue(data, essential)
+        except:
+            pass
+    pending.clear()
+
+
+def queue_stats():
+    """回傳 (totals, 每個連線的佇列狀態)"""
+    with _live_lock:
+        conns = list(_live)
+    return dict(_totals), [c.stats() for c in conns]
+
+
+class _Outbound:
+    def __init__(self, addr):
+        self.addr = addr
+        self.label = None         # server 在 HELLO 後填入玩家名稱
+        self._q = collections.deque()
+        self._closing = False
+        self.closed = False
+        self.pending = 0          # 已進佇列、尚未寫出的 bytes
+        self.peak = 0
+        self.sent = 0
+        self.dropped = 0
+        with _live_lock:
+            _live.add(self)
+
+    def sendall(self, data: bytes):
+        self.enqueue(data)
+
+    def _admit(self, data: bytes, essential: bool) -> bool:
+        if self.closed or self._closing:
+            return False
+        n = len(data)
+        if self.pending + n > HARD_LIMIT:
+            _totals["slow_disconnects"] += 1
+            print(f"[SLOW] {self.label or self.addr} 送出佇列 {self.pending} bytes，斷線")
+            self._abort()
+            return False
+        if not essential and self.pending >= SOFT_LIMIT:
+            self.dropped += 1
+            _totals["dropped"] += 1
+            return False
+        self._q.append(data)
+        self.pending += n
+        if self.pending > self.peak:
+            self.peak = self.pending
+        return True
+
+    def _merge(self, items) -> bytes:
+        # 佇列已經積太多時，非必要的那幾行照樣丟掉，其餘合併成一筆
+        parts = []
+        for data, essential in items:
+            if not essential and self.pending >= SOFT_LIMIT:
+                self.dropped += 1
+                _totals["dropped"] += 1
+                continue
+            parts.append(data)
+        return b"".join(parts)
+
+    def _take(self) -> bytes:
+        """從佇列拿出下一次要寫的資料：COALESCE 時把累積的多筆接在一起"""
+        data = self._q.popleft()
+        if not COALESCE or not self._q:
+            return data
+        parts = [data]
+        n = len(data)
+        while self._q and n < WRITE_CHUNK:
+            data = self._q.popleft()
+            parts.append(data)
+            n += len(data)
+        return b"".join(parts)
+
+    def _forget(self):
+        with _live_lock:
+            _live.discard(self)
+
+    def stats(self):
+        return {
+            "addr": self.addr,
+            "name": self.label,
+            "depth": len(self._q),
+            "pending": self.pending,
+            "peak": self.peak,
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
+
+
+# ====== thread 引擎：每個連線一條 writer thread ======
+class Connection(_Outbound):
+    def __init__(self, sock: socket.socket, addr=None):
+        super().__init__(addr)
+        self.sock = sock
+        tune(sock)
+        self._cond = threading.Condition()
+        self._writer = threading.Thread(target=self._drain, name=f"writer-{addr}", daemon=True)
+        self._writer.start()
+
+    def enqueue(self, data: bytes, essential=True):
+        with self._cond:
+            if self._admit(data, essential):
+                self._cond.notify()
+
+    def enqueue_many(self, items):
+        with self._cond:
+            data = self._merge(items)
+            if data and self._admit(data, True):
+                self._cond.notify()
+
+    def recv(self, n: int) -> bytes:
+        return self.sock.recv(n)
+
+    def recv_into(self, buf, n=0) -> int:
+        return self.sock.recv_into(buf, n)
+
+    def throttle(self):
+        """自己的回覆還堆在佇列裡就先別讀下一批指令（只卡這個連線自己的 thread）"""
+        with self._cond:
+            while self.pending > SOFT_LIMIT and not self.closed:
+                self._cond.wait()
+
+    def _drain(self):
+        corked = False
+        while True:
+            with self._cond:
+                while not self._q and not self._closing and not self.closed:
+                    self._cond.wait()
+                if not self._q or self.closed:
+                    return
+                data = self._take()
+                more = bool(self._q)
+            try:
+                if TCP_CORK and more != corked:
+                    # 後面還有就先塞住，只送滿的 segment；最後一筆之前拔掉，剩下的立刻送出
+                    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(more))
+                    corked = more
+                self.sock.sendall(data)
+            except OSError:
+                self._abort()
+                return
+            _BYTES_OUT.inc(len(data))
+            with self._cond:
+                self.pending -= len(data)
+                self.sent += len(data)
+                self._cond.notify_all()
+
+    def _abort(self):
+        # shutdown 會讓卡在 recv()/sendall() 的 thread 立刻返回，真正 close 由 close() 做
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        with self._cond:
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if threading.current_thread() is not self._writer:
+            self._writer.join(CLOSE_TIMEOUT)
+        self._abort()
+        self._forget()
+        self.sock.close()
+
+    def detach(self) -> socket.socket:
+        """把佇列送完後交出原本的 socket（不 shutdown、不 close），給跨 process 轉交用"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._writer.join(CLOSE_TIMEOUT)
+        self.closed = True
+        self._forget()
+        return self.sock
+
+
+# ====== asyncio 引擎：每個連線一個 writer task ======
+class AsyncConnection(_Outbound):
+    def __init__(self, writer: asyncio.StreamWriter, addr=None):
+        super().__init__(addr)
+        self.writer = writer
+        self._wake = asyncio.Event()
+        self._space = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    def enqueue(self, data: bytes, essential=True):
+        if self._admit(data, essential):
+            self._wake.set()
+
+    def enqueue_many(self, items):
+        data = self._merge(items)
+        if data and self._admit(data, True):
+            self._wake.set()
+
+    async def throttle(self):
+        while self.pending > SOFT_LIMIT and not self.closed:
+            self._space.clear()
+            await self._space.wait()
+
+    async def _drain(self):
+        try:
+            while True:
+                while not self._q:
+                    if self._closing or self.closed:
+                        return
+                    self._wake.clear()
+                    await self._wake.wait()
+                if self.writer.is_closing():
+                    raise ConnectionResetError
+                n = 0
+                while self._q:
+                    data = self._take()
+                    self.writer.write(data)
+                    n += len(data)
+                await self.writer.drain()
+                self.pending -= n
+                self.sent += n
+                _BYTES_OUT.inc(n)
+                self._space.set()
+        except (ConnectionError, OSError):
+            self._abort()
+
+    def _abort(self):
+        self.closed = True
+        self.writer.transport.abort()
+        self._wake.set()
+        self._space.set()
+
+    def close(self):
+        # 不能在 event loop 上等：writer task 送完後自己關，逾時就硬斷
+        self._closing = True
+        self._wake.set()
+        self._forget()
+        loop = asyncio.get_running_loop()
+        timer = loop.call_later(CLOSE_TIMEOUT, self._abort)
+
+        def _done(_):
+            timer.cancel()
+            self.writer.close()
+
+        self._task.add_done_callback(_done)
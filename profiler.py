@@ -0,0 +1,200 @@
+"""線上取樣 profiler：ADMIN PROFILE <秒數> [NAME]，不用重開 server
+
+背景 thread 每 INTERVAL 秒用 sys._current_frames() 看一次所有 thread 停在哪裡，只留處理連線的那些
+（stack 裡有 server 的 client_thread / client_task；asyncio 引擎只有正在跑的 task 會被看到），
+同樣的 stack 累計次數。結束時寫成 collapsed stack（一行一個 stack：呼叫者;…;被呼叫者 次數），
+檔案一律寫在 DIR（--profile-dir）底下，NAME 只能是單純的檔名（ADMIN 給的字串不能指到別的地方），
+可以直接丟給 flamegraph.pl / speedscope，並算出各模組的 CPU 佔比：
+- 自己：最裡面那一層屬於哪個模組（標準函式庫的時間算給呼叫它的模組，例如 big2 裡的 shuffle 算 big2）
+- 含呼叫的：stack 裡有出現這個模組的樣本
+
+取樣不拿任何 lock：_current_frames 複製的是當下的 frame 指標，之後只讀 f_back / f_code。
+停在 recv 與 Condition.wait 的 thread（等玩家輸入、等送出佇列）不是在用 CPU，直接略過、不走整條 stack。
+最裡面一層停在 with 進入點（C 實作的 __enter__，在這裡就是 RLock）的是在排隊等 lock：
+stack 照記、最後加一層 [等 lock]，火焰圖看得到卡在哪，但不算進模組的 CPU。
+有 GIL，同一時間只有一條 thread 真的在跑：其他「在跑」的樣本其實是在等 GIL。
+
+只看得到本 process：--workers 是收到 ADMIN 的那個 worker，--gateway 時遊戲 worker 的不在裡面。
+"""
+import collections
+import dis
+import os
+import sys
+import threading
+import time
+
+import cluster
+
+INTERVAL = 0.01               # 每幾秒取樣一次
+MAX_SECONDS = 600
+DIR = "."                     # 輸出檔寫在這裡（--profile-dir）
+ROOTS = {"client_thread", "client_task"}      # server.py 裡處理一條連線的函式（stack 從這裡開始）
+# 最裡面停在這些地方的 thread 是在等，不是在用 CPU
+IDLE = {("outbound.py", "recv"), ("outbound.py", "recv_into"), ("framing.py", "recv_from"),
+        ("threading.py", "wait"), ("selectors.py", "select")}
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_start_lock = threading.Lock()    # 同時只跑一個；不是遊戲的 lock，取樣時也不會拿
+_running = None               # 正在跑的 (開始時間, 秒數, path)
+_last = None                  # 上一次的結果（report 的 lines）
+_kinds = {}                   # code -> _ROOT / _IDLE / 0（每個 code 只看一次檔名）
+_ROOT, _IDLE = 1, 2
+_bytecode = {}                # code -> co_code（3.11 每次讀 co_code 都會複製一份）
+_WITH_OPS = {dis.opmap[name] for name in ("BEFORE_WITH", "SETUP_WITH") if name in dis.opmap}
+_LOCK_WAIT = "[等 lock]"
+
+
+def _module(code):
+    """(模組名, 是不是這個專案的檔案)"""
+    path = code.co_filename
+    name = os.path.basename(path)
+    if name.endswith(".py"):
+        name = name[:-3]
+    return name, os.path.dirname(os.path.abspath(path)) == _HERE
+
+
+def _label(code) -> str:
+    if code is _LOCK_WAIT:
+        return code
+    return f"{_module(code)[0]}:{code.co_name}"
+
+
+def _classify(code) -> int:
+    name = os.path.basename(code.co_filename)
+    if (name, code.co_name) in IDLE:
+        kind = _IDLE
+    elif name == "server.py" and code.co_name in ROOTS:
+        kind = _ROOT
+    else:
+        kind = 0
+    _kinds[code] = kind
+    return kind
+
+
+def _sample(stacks, me) -> int:
+    """取樣一次：stacks[(code, …) 由內到外] += 1；回傳略過的等待中 thread 數"""
+    kinds = _kinds
+    idle = 0
+    for tid, frame in sys._current_frames().items():
+        if tid == me:
+            continue
+        code = frame.f_code
+        kind = kinds.get(code)
+        if kind is None:
+            kind = _classify(code)
+        if kind == _IDLE:
+            idle += 1
+            continue
+        co = _bytecode.get(code)
+        if co is None:
+            co = _bytecode[code] = code.co_code
+        stack = [_LOCK_WAIT, code] if co[frame.f_lasti] in _WITH_OPS else [code]
+        f = frame
+        while kind != _ROOT:
+            f = f.f_back
+            if f is None:
+                break
+            code = f.f_code
+            stack.append(code)
+            kind = kinds.get(code)
+            if kind is None:
+                kind = _classify(code)
+        else:
+            key = tuple(stack)
+            stacks[key] = stacks.get(key, 0) + 1
+    return idle
+
+
+def _run(seconds: float, path: str):
+    global _running, _last
+    me = threading.get_ident()
+    stacks = {}
+    ticks = idle = 0
+    cost_ns = 0
+    t_end = time.perf_counter() + seconds
+    try:
+        os.makedirs(DIR, exist_ok=True)
+        while time.perf_counter() < t_end:
+            t0 = time.perf_counter_ns()
+            idle += _sample(stacks, me)
+            spent = time.perf_counter_ns() - t0
+            cost_ns += spent
+            ticks += 1
+            time.sleep(max(0.0, INTERVAL - spent / 1e9))
+        _last = _write(stacks, path, seconds, ticks, idle, cost_ns)
+    except Exception as e:
+        _last = [f"取樣失敗：{e}"]
+        print("[ERROR] profiler:", e)
+    finally:
+        _running = None
+    print(f"[PROFILE] {_last[0]}")
+
+
+def _write(stacks, path, seconds, ticks, idle, cost_ns):
+    waits = sum(n for key, n in stacks.items() if key[0] is _LOCK_WAIT)
+    total = sum(stacks.values()) - waits
+    own = collections.Counter()
+    incl = collections.Counter()
+    lines = {}
+    for key, n in stacks.items():
+        label = ";".join(_label(code) for code in reversed(key))
+        lines[label] = lines.get(label, 0) + n
+        if key[0] is _LOCK_WAIT:
+            continue
+        mods = [_module(code) for code in key]
+        own[next((m for m, ours in mods if ours), mods[0][0])] += n
+        for m in {m for m, ours in mods if ours}:
+            incl[m] += n
+    with open(path, "w", encoding="utf-8") as f:
+        for label, n in sorted(lines.items(), key=lambda kv: -kv[1]):
+            f.write(f"{label} {n}\n")
+
+    out = [f"取樣 {seconds:g}s 完成，寫到 {path}（{len(lines)} 種 stack）",
+           f"每 {INTERVAL * 1e3:g}ms 一次共 {ticks} 次：連線 thread 在跑的樣本={total} 等 lock={waits} 等輸入略過={idle}；"
+           f"取樣本身平均 {cost_ns / max(1, ticks) / 1e3:.0f}us/次（佔 {cost_ns / 1e9 / seconds:.2%} 的時間）",
+           f"== 各模組 CPU（自己 / 含呼叫的）=="]
+    for m, n in own.most_common():
+        out.append(f"{m:12} {n / max(1, total):7.1%} {incl[m] / max(1, total):7.1%}")
+    if not total:
+        out.append("（這段時間沒有連線 thread 在跑）")
+    out.append(f"火焰圖：flamegraph.pl {path} > profile.svg")
+    return out
+
+
+def _default_name() -> str:
+    suffix = f".w{cluster.index}" if cluster.active() else ""
+    return f"profile-{time.strftime('%Y%m%d-%H%M%S')}{suffix}.collapsed"
+
+
+def valid_name(name: str) -> bool:
+    """只接受 DIR 底下的單純檔名：不能有路徑分隔、..、NUL"""
+    return bool(name) and name != "." and ".." not in name and not any(c in name for c in ("/", "\\", "\0"))
+
+
+def start(seconds: float, name=None):
+    """在背景開始取樣 seconds 秒，寫到 DIR/name；已經在跑就回傳 False，name 不合法丟 ValueError"""
+    global _running
+    if name is not None and not valid_name(name):
+        raise ValueError(f"不合法的檔名：{name!r}")
+    seconds = min(float(seconds), MAX_SECONDS)
+    path = os.path.join(DIR, name or _default_name())
+    with _start_lock:
+        if _running is not None:
+            return False
+        _running = (time.time(), seconds, path)
+    threading.Thread(target=_run, args=(seconds, path), name="profiler", daemon=True).start()
+    return True
+
+
+def report():
+    if _running is not None:
+        started, seconds, path = _running
+        left = max(0.0, started + seconds - time.time())
+        return [f"取樣中：還有 {left:.0f}s，完成後寫到 {path}（ADMIN PROFILE 看結果）"]
+    return _last or ["還沒有取樣過：ADMIN PROFILE <秒數> [NAME]"]
+
+
+def configure(dir=None):
+    global DIR
+    if dir:
+        DIR = dir
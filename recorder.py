@@ -0,0 +1,299 @@
+"""錄下真實流量，之後不經過 socket 原樣重播：重現 bug，也拿真實流量當壓力測試
+
+server 以 --record PATH 啟動才會錄（只支援單一 process：thread / asyncio 引擎）。錄下的是 JSON lines：
+- 第一行是設定（起始籌碼、各遊戲房號上限），重播時照著設
+- ["open", t, cid, addr]、["line", t, cid, 指令]、["close", t, cid]：每條連線收到的每一行（t 是錄製開始後的 ns）
+- ["seed", t, key, seed]：每間房亂數串流的種子（key 是 "BIG2#3" 這種房間，見 rng.py）
+每間房第一次洗牌 / 開獎時 rng 跟 seed(key) 拿種子：錄的時候記下來，重播時依房間照順序取回同樣的種子，
+之後洗出來的牌、開出來的號碼就一樣（只有 --rng room 能錄；secure 的結果本來就無法重現）。
+寫檔和 eventlog 一樣：server thread 只丟進 deque，背景 thread 每 FLUSH_INTERVAL 秒寫一批。
+ADMIN LOGIN 的密碼不會寫進檔案。
+
+重播：python recorder.py PATH [--speed 1] [--show NAME] [--verify] [--event-log OUT]
+沒有 socket，直接把每一行交給 server.handle_command；預設用最快速度跑並印出吞吐量與延遲，
+--speed 1 照原本的時間間隔。指令依進入 server 的順序重播；同一間房兩個人幾乎同時送出的指令，
+實際處理的先後可能和紀錄相反（很少見；這時後面的洗牌會對不上，重播會回報缺少種子）。
+"""
+import argparse
+import collections
+import hashlib
+import itertools
+import json
+import sys
+import threading
+import time
+
+PATH = None
+FLUSH_INTERVAL = 0.05
+
+_queue = collections.deque()
+_file = None
+_write_lock = threading.Lock()
+_t0 = 0
+_cids = {}                      # conn -> 連線編號
+_next_cid = itertools.count(1)
+_seeds = None                   # 重播時：key -> 還沒用到的種子
+stats = {"conns": 0, "lines": 0, "seeds": 0, "bytes": 0, "missing_seeds": 0}
+
+
+def _now() -> int:
+    return time.perf_counter_ns() - _t0
+
+
+# ====== 錄製 ======
+def opened(conn, addr):
+    if PATH is None:
+        return
+    cid = _cids[conn] = next(_next_cid)
+    _queue.append(["open", _now(), cid, str(addr)])
+
+
+def line(conn, text: str):
+    if PATH is None:
+        return
+    parts = text.split()
+    if len(parts) >= 2 and parts[0].upper() == "ADMIN" and parts[1].upper() == "LOGIN":
+        text = "ADMIN LOGIN ***"
+    _queue.append(["line", _now(), _cids.get(conn), text])
+
+
+def closed(conn):
+    if PATH is None:
+        return
+    cid = _cids.pop(conn, None)
+    if cid is not None:
+        _queue.append(["close", _now(), cid])
+
+
+def seed(key: str, make):
+    """key 這條亂數串流（rng.Stream）的種子：重播時依 key 照順序取回紀錄裡的，不然用 make() 產生；在錄就記下來"""
+    if _seeds is not None:
+        pending = _seeds.get(key)
+        if pending:
+            return pending.popleft()
+        stats["missing_seeds"] += 1       # 重播走到錄的時候沒有的路
+        return 0
+    value = make()
+    if PATH is not None:
+        _queue.append(["seed", _now(), key, value])
+    return value
+
+
+def _drain():
+    n = len(_queue)
+    if not n:
+        return
+    out = []
+    for _ in range(n):
+        rec = _queue.popleft()
+        if rec[0] == "line":
+            stats["lines"] += 1
+        elif rec[0] == "seed":
+            stats["seeds"] += 1
+        elif rec[0] == "open":
+            stats["conns"] += 1
+        out.append(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+    data = ("\n".join(out) + "\n").encode()
+    try:
+        _file.write(data)
+        _file.flush()
+    except OSError as e:
+        print("[ERROR] recorder:", e)
+    stats["bytes"] += len(data)
+
+
+def _writer_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        with _write_lock:
+            _drain()
+
+
+def flush():
+    if _file is None:
+        return
+    with _write_lock:
+        _drain()
+
+
+def start(path: str):
+    """開始錄：寫設定那一行、起 writer thread（server 開始收連線之前呼叫）"""
+    global PATH, _file, _t0
+    import games
+    import wallet
+    _file = open(path, "ab")
+    header = {"version": 2, "started": time.time(), "start_balance": wallet.START_BALANCE,
+              "max_rooms": {code: games.get(code).MAX_ROOMS for code in games.codes()}}
+    _file.write((json.dumps(header) + "\n").encode())
+    _file.flush()
+    _t0 = time.perf_counter_ns()
+    PATH = path
+    threading.Thread(target=_writer_loop, name="recorder", daemon=True).start()
+
+
+def report():
+    if PATH is None:
+        return ["沒有在錄（server 需以 --record PATH 啟動）"]
+    return [f"錄製：{PATH} 連線={stats['conns']} 指令={stats['lines']} 種子={stats['seeds']} "
+            f"寫入={stats['bytes']} bytes 等待寫入={len(_queue)}"]
+
+
+# ====== 重播 ======
+def load(path: str):
+    """回傳 (設定, 紀錄)；最後一行寫到一半（錄的時候當機）就略過"""
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        records = []
+        for raw in f:
+            try:
+                records.append(json.loads(raw))
+            except ValueError:
+                break
+    return header, records
+
+
+class ReplayConn:
+    """代替 socket 連線：只算送出了多少、內容的 hash；show 時把內容印出來"""
+
+    __slots__ = ("cid", "addr", "label", "msgs", "bytes", "digest", "show")
+
+    def __init__(self, cid: int, show=None):
+        self.cid = cid
+        self.addr = None
+        self.label = None
+        self.msgs = 0
+        self.bytes = 0
+        self.digest = hashlib.blake2b(digest_size=8)
+        self.show = show
+
+    def enqueue(self, data: bytes, essential=True):
+        self.msgs += 1
+        self.bytes += len(data)
+        self.digest.update(data)
+        if self.show is not None and self.label == self.show:
+            sys.stdout.write(data.decode(errors="replace"))
+
+    def enqueue_many(self, items):
+        for data, essential in items:
+            self.enqueue(data, essential)
+
+    def close(self):
+        pass
+
+
+def replay(header, records, speed=None, show=None):
+    """依序把紀錄交給 server.handle_command；speed=None 最快，1.0 照原本的時間。回傳統計"""
+    global _seeds
+    import games
+    import outbound
+    import rng
+    import server
+    import wallet
+
+    wallet.configure(start_balance=header.get("start_balance"))
+    rng.configure(mode="room")
+    rng.reset()               # 每間房的串流從紀錄裡的種子重新開始
+    for code, n in header.get("max_rooms", {}).items():
+        games.set_max_rooms(code, n)
+    _seeds = collections.defaultdict(collections.deque)
+    stats["missing_seeds"] = 0
+    for rec in records:
+        if rec[0] == "seed":
+            _seeds[rec[2]].append(rec[3])
+
+    players = {}
+    conns = []
+    lat = collections.defaultdict(list)      # 指令 -> [ns]
+    errors = 0
+
+    def close(cid):
+        player = players.pop(cid, None)
+        if player is not None:
+            server._release(player)
+
+    t_start = time.perf_counter_ns()
+    for rec in records:
+        kind, t = rec[0], rec[1]
+        if speed:
+            wait = t_start + t / speed - time.perf_counter_ns()
+            if wait > 0:
+                time.sleep(wait / 1e9)
+        if kind == "open":
+            conn = ReplayConn(rec[2], show)
+            conns.append(conn)
+            players[rec[2]] = server._register(conn)
+        elif kind == "line":
+            player = players.get(rec[2])
+            if player is None:
+                continue
+            t0 = time.perf_counter_ns()
+            try:
+                with outbound.batch():
+                    server.handle_command(player, rec[3])
+            except Exception:
+                # 真的 server 這時會斷線（QUIT 也是走這裡）
+                errors += 1
+                close(rec[2])
+            parts = rec[3].split()
+            lat[parts[0].upper() if parts else ""].append(time.perf_counter_ns() - t0)
+        elif kind == "close":
+            close(rec[2])
+    for cid in list(players):
+        close(cid)
+    took = (time.perf_counter_ns() - t_start) / 1e9
+
+    _seeds = None
+    return {"seconds": took, "recorded_seconds": records[-1][1] / 1e9 if records else 0.0,
+            "lines": sum(len(v) for v in lat.values()), "conns": len(conns), "errors": errors,
+            "latency": lat, "missing_seeds": stats["missing_seeds"],
+            "digests": {c.cid: c.digest.hexdigest() for c in conns}}
+
+
+def _pct(samples, p):
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(p / 100.0 * len(s)))] if s else 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="重播 server --record 錄下的流量（不經過 socket）")
+    ap.add_argument("path")
+    ap.add_argument("--speed", type=float, default=None, help="1 = 照原本的時間間隔，2 = 兩倍速；不給就是最快")
+    ap.add_argument("--show", default=None, help="印出這個玩家收到的所有訊息")
+    ap.add_argument("--verify", action="store_true", help="重播兩次，比對每條連線收到的內容是否完全相同")
+    ap.add_argument("--event-log", default=None, help="重播時也寫事件紀錄（可以和線上的紀錄比對狀態 hash）")
+    ap.add_argument("--top", type=int, default=10, help="列出幾種指令的延遲")
+    args = ap.parse_args(argv)
+
+    import eventlog
+    eventlog.configure(path=args.event_log)
+    header, records = load(args.path)
+    if header.get("version") != 2:
+        print(f"★ 紀錄格式版本 {header.get('version')}：舊版每次洗牌記一個種子，重播出來的牌會對不上")
+    result = replay(header, records, args.speed, args.show)
+    lines = result["lines"]
+    print(f"重播 {result['conns']} 條連線 {lines} 行指令：{result['seconds']:.2f}s"
+          f"（錄的時候 {result['recorded_seconds']:.2f}s）  {lines / max(result['seconds'], 1e-9):.0f} 指令/s"
+          f"  斷線={result['errors']}")
+    if result["missing_seeds"]:
+        print(f"★ {result['missing_seeds']} 次要亂數時紀錄裡沒有對應的種子：重播和錄的時候走了不同的路")
+    every = [ns for v in result["latency"].values() for ns in v]
+    print(f"每個指令 p50={_pct(every, 50) / 1e3:.0f}us p99={_pct(every, 99) / 1e3:.0f}us max={max(every, default=0) / 1e3:.0f}us")
+    top = sorted(result["latency"].items(), key=lambda kv: sum(kv[1]), reverse=True)[:args.top]
+    for cmd, samples in top:
+        print(f"  {cmd:8} n={len(samples):<7} 合計={sum(samples) / 1e6:8.1f}ms "
+              f"p50={_pct(samples, 50) / 1e3:6.0f}us p99={_pct(samples, 99) / 1e3:6.0f}us")
+    eventlog.flush()
+
+    if args.verify:
+        again = replay(header, records)
+        diff = [cid for cid, d in result["digests"].items() if again["digests"].get(cid) != d]
+        print("第二次重播：每條連線收到的內容都相同" if not diff
+              else f"★ 第二次重播有 {len(diff)} 條連線的內容不同：{diff[:20]}")
+        if diff:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    # 遊戲模組 import 的是 recorder，不是 __main__：重播的種子要放在同一個 module 裡
+    import recorder
+    recorder.main()
@@ -0,0 +1,185 @@
+"""每間房各自的亂數串流；背景 thread 預先洗好牌 / 開好獎
+
+以前洗牌、開獎都直接用 random 模組：所有房間共用一個狀態，結果沒辦法重現，
+而且每次發牌都在房間 lock 裡當場洗一整副牌。現在遊戲呼叫 draw(key, make)：
+- 每個 key（"BIG2#3" 這種，遊戲 + 房號）有自己的 Stream，第一次用到才建立，之後一直留著
+  （房間回收再開也接著用同一條，和回收的時機無關；最多 各遊戲房號上限 條）
+- MODE = "room"：每條 Stream 一個 random.Random，種子由 SEED 與 key 算出來。
+  SEED 用 --rng-seed 指定就每次啟動都發一樣的牌，沒給就每次啟動隨機。
+  --record 時每條 Stream 的種子記進錄製檔，重播時照用
+- MODE = "secure"：密碼學安全的亂數（os.urandom），給真錢的部署用。所有 Stream 共用一個 SecureRandom：
+  每次要幾個 bit 就呼叫一次 urandom 是一個 syscall，太慢，所以一次讀 ENTROPY_CHUNK bytes 放著慢慢用；
+  fork 之後丟掉重讀，子 process 不會和父 process 用到同一段。結果無法重現，所以不能和 --record 一起用
+- 背景的 shuffler thread 幫每條 Stream 先準備好 AHEAD 份（一副洗好的牌、一個開獎號碼），
+  draw 時直接拿一份，房間 lock 裡不用再洗牌；來不及準備時才當場產生（stats 的 inline）。AHEAD = 0 不預先準備
+- 同一條 Stream 的產生與取用都在它自己的 lock 裡依序進行，拿到的順序就是產生的順序：
+  不管背景 thread 快或慢，同一個種子發出來的牌都一樣（重播才對得上）
+"""
+import array
+import collections
+import hashlib
+import os
+import random
+import secrets
+import threading
+
+import recorder
+
+MODES = ("room", "secure")
+MODE = "room"
+SEED = secrets.randbits(64)
+AHEAD = 2                       # 每條 Stream 預先準備幾份
+ENTROPY_CHUNK = 64 << 10        # secure：一次跟 os.urandom 拿多少 bytes
+
+_streams = {}                   # key -> Stream
+_wanted = collections.deque()   # 要補貨的 Stream（draw 丟進來，shuffler 拿出去）
+_wake = threading.Event()
+_pid = None
+_start_lock = threading.Lock()
+stats = {"draws": 0, "inline": 0, "prefilled": 0}
+
+
+class SecureRandom(random.SystemRandom):
+    """os.urandom 的亂數，一次讀一大塊放著用（random.SystemRandom 每次呼叫都讀一次）
+
+    讀進來的 bytes 切成 32-bit 整數，用 iterator 一個一個拿：next() 在 GIL 底下是原子的，
+    多條 thread 一起用也不會拿到同一個，不用 lock。
+    """
+
+    def __init__(self, chunk: int = ENTROPY_CHUNK):
+        super().__init__()
+        self._chunk = chunk
+        self._words = iter(())
+        os.register_at_fork(after_in_child=self._discard)
+
+    def _discard(self):
+        self._words = iter(())
+
+    def _word(self) -> int:
+        try:
+            return next(self._words)
+        except StopIteration:
+            self._words = iter(array.array("I", os.urandom(self._chunk)))
+            return next(self._words)
+
+    def getrandbits(self, k: int) -> int:
+        if k <= 32:
+            if k < 0:
+                raise ValueError("number of bits must be non-negative")
+            return self._word() >> (32 - k)
+        n = (k + 31) // 32
+        x = 0
+        for _ in range(n):
+            x = (x << 32) | self._word()
+        return x >> (n * 32 - k)
+
+    def random(self) -> float:
+        # 和 random.Random 一樣用 53 bits
+        return ((self._word() >> 5) * 67108864.0 + (self._word() >> 6)) * (1.0 / 9007199254740992.0)
+
+
+_secure = None
+
+
+def derive(key: str) -> int:
+    """room 模式下 key 這條 Stream 的種子"""
+    return int.from_bytes(hashlib.blake2b(f"{SEED}:{key}".encode(), digest_size=8).digest(), "big")
+
+
+class Stream:
+    __slots__ = ("key", "make", "rng", "ready", "lock", "queued")
+
+    def __init__(self, key: str, make):
+        global _secure
+        self.key = key
+        self.make = make          # make(rng) -> 一份（洗好的牌 / 開獎號碼）
+        if MODE == "secure":
+            if _secure is None:
+                _secure = SecureRandom()
+            self.rng = _secure
+        else:
+            self.rng = random.Random(recorder.seed(key, lambda: derive(key)))
+        self.ready = collections.deque()
+        self.lock = threading.Lock()      # 產生與取用依序進行；不用 locks.Lock：每條 Stream 一把，不進統計
+        self.queued = False
+
+    def draw(self):
+        with self.lock:
+            if self.ready:
+                item = self.ready.popleft()
+            else:
+                item = self.make(self.rng)
+                stats["inline"] += 1
+        stats["draws"] += 1
+        if AHEAD and not self.queued:
+            self.queued = True
+            _wanted.append(self)
+            if _pid != os.getpid():
+                _start()
+            _wake.set()
+        return item
+
+    def fill(self):
+        # shuffler thread：一次產生一份就放開 lock，draw 不用等整批
+        self.queued = False
+        while len(self.ready) < AHEAD:
+            with self.lock:
+                if len(self.ready) >= AHEAD:
+                    return
+                self.ready.append(self.make(self.rng))
+            stats["prefilled"] += 1
+
+
+def draw(key: str, make):
+    """在房間 lock 裡呼叫：key 這間房的下一份（make(rng) 產生，可能是背景 thread 先做好的）"""
+    stream = _streams.get(key)
+    if stream is None:
+        stream = _streams.setdefault(key, Stream(key, make))
+    return stream.draw()
+
+
+def _shuffler_loop():
+    while True:
+        _wake.wait()
+        _wake.clear()
+        while _wanted:
+            _wanted.popleft().fill()
+
+
+def _start():
+    # 第一次 draw 時才開：--workers 的子 process 與遊戲 worker 各自開自己的
+    global _pid
+    with _start_lock:
+        if _pid != os.getpid():
+            _pid = os.getpid()
+            _wanted.clear()
+            threading.Thread(target=_shuffler_loop, name="shuffler", daemon=True).start()
+
+
+def reset():
+    """丟掉所有 Stream（重播、bench 從頭開始時用）"""
+    _streams.clear()
+    _wanted.clear()
+    stats.update(draws=0, inline=0, prefilled=0)
+
+
+def report():
+    ready = sum(len(s.ready) for s in list(_streams.values()))
+    draws = stats["draws"] or 1
+    seed = "" if MODE == "secure" else f" seed={SEED}"
+    return [f"亂數：mode={MODE}{seed} 預先準備={AHEAD} 份/房",
+            f"串流={len(_streams)} 取用={stats['draws']} 當場產生={stats['inline']}（{stats['inline'] / draws:.1%}）"
+            f" 背景產生={stats['prefilled']} 備好待用={ready}"]
+
+
+def configure(mode=None, seed=None, ahead=None):
+    global MODE, SEED, AHEAD, _secure
+    if mode is not None:
+        if mode not in MODES:
+            raise ValueError(f"unknown rng mode: {mode}")
+        MODE = mode
+        _secure = None
+    if seed is not None:
+        SEED = int(seed)
+    if ahead is not None:
+        AHEAD = max(0, int(ahead))
@@ -0,0 +1,244 @@
+"""房間表：房間第一次有人進來才建立，空著超過 IDLE_SECONDS 就回收
+
+各遊戲模組用 rooms = roomtable.RoomTable("BIG2", Room, MAX_PLAYERS)，
+Room 要有 lock（locks.RoomLock）、is_empty()、occupancy()（佔了幾個位子，滿了就是 MAX_PLAYERS）
+與 status()（給大廳看的 (人數, 是否進行中)）。
+房號在房間存在的期間不會變；回收之後同一個房號再有人進來，就是一間新的房間。
+房號上限（各模組的 MAX_ROOMS）由 server 檢查，這裡不管。
+
+房間 lock 一律透過 opened() / locked() 拿：放開時順便更新人數索引（Occupancy），
+pick_room 才能直接查「最小的有空位房號」/「人最少的房號」，不用掃過每一間房；
+status() 有變時通知 watch() 登記的 callback（大廳的 ROOMS 列表）。
+
+lock 順序：房間 lock -> 房間表的 lock（房間表的 lock 裡不會再拿房間 lock）。
+"""
+import contextlib
+import heapq
+import threading
+import time
+
+import locks
+
+IDLE_SECONDS = 300.0      # 空房保留多久才回收（0 = 不回收）
+
+tables = {}               # game code -> RoomTable
+_watchers = []            # fn(code, room_id, 人數 或 None（已回收）, 上限, 進行中)
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+class Occupancy:
+    """房號 -> 人數 的索引
+
+    buckets[n] 是人數剛好 n 的房號 min-heap（lazy：房間人數變了，舊的那筆先留著，浮到堆頂才丟掉；
+    每個房號在每個 bucket 最多一筆）。從沒出現過的房號都算 0 人：比 _fresh 小的房號都已經在 count 裡。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = {}                 # room_id -> 人數
+        self.buckets = [[] for _ in range(capacity + 1)]
+        self._queued = [set() for _ in range(capacity + 1)]
+        self._fresh = 1
+
+    def set(self, room_id: int, n: int):
+        n = min(n, self.capacity)
+        if self.count.get(room_id) == n:
+            return
+        self.count[room_id] = n
+        if room_id not in self._queued[n]:
+            self._queued[n].add(room_id)
+            heapq.heappush(self.buckets[n], room_id)
+        while self._fresh in self.count:
+            self._fresh += 1
+
+    def _first(self, n: int, limit: int, accept):
+        """人數剛好 n、房號 <= limit、accept 通過的最小房號；沒有就 None"""
+        heap, queued, count = self.buckets[n], self._queued[n], self.count
+        while heap and count[heap[0]] != n:
+            queued.discard(heapq.heappop(heap))
+        best = heap[0] if heap else None
+        if best is not None and accept is not None and not accept(best):
+            # 被 accept 擋掉的先拿出來，找到之後再放回去（--workers / gateway 各管一部分房號）
+            best, skipped = None, []
+            while heap and heap[0] <= limit:
+                rid = heapq.heappop(heap)
+                if count[rid] != n:
+                    queued.discard(rid)
+                    continue
+                skipped.append(rid)
+                if accept(rid):
+                    best = rid
+                    break
+            for rid in skipped:
+                heapq.heappush(heap, rid)
+        if n == 0:
+            rid = self._fresh
+            while rid <= limit and (rid in count or (accept is not None and not accept(rid))):
+                rid += 1
+            if rid <= limit and (best is None or rid < best):
+                best = rid
+        return best if best is not None and best <= limit else None
+
+    def first_free(self, limit: int, accept=None):
+        """還有空位的最小房號"""
+        best = None
+        for n in range(self.capacity):
+            rid = self._first(n, limit, accept)
+            if rid is not None and (best is None or rid < best):
+                best = rid
+        return best
+
+    def least_full(self, limit: int, accept=None):
+        """人最少的房號（一樣少取房號小的）"""
+        for n in range(self.capacity + 1):
+            rid = self._first(n, limit, accept)
+            if rid is not None:
+                return rid
+        return None
+
+
+class RoomTable:
+    def __init__(self, code: str, factory, capacity: int):
+        self.code = code
+        self._factory = factory         # room_id -> Room
+        self._rooms = {}
+        self._lock = locks.Lock(f"{code}.rooms")    # 保護 _rooms 與 occupancy
+        self.capacity = capacity
+        self.occupancy = Occupancy(capacity)
+        self._status = {}               # room_id -> 上次通知的 status()
+        self._empty_since = {}          # room_id -> 第一次看到它空著的時間（只有 reaper 動）
+        self.created = 0
+        self.reclaimed = 0
+        tables[code] = self
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def get(self, room_id: int):
+        """已存在的房間，沒有就是 None（不會建立）"""
+        return self._rooms.get(room_id)
+
+    def items(self):
+        with self._lock:
+            return sorted(self._rooms.items())
+
+    def _open(self, room_id: int):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = self._factory(room_id)
+                self.created += 1
+        _start_reaper()
+        return room
+
+    def _touch(self, room):
+        room_id = room.room_id
+        status = room.status()
+        with self._lock:
+            if self._rooms.get(room_id) is not room:       # 已經被回收的舊房間不要蓋掉新房間的人數
+                return
+            self.occupancy.set(room_id, room.occupancy())
+            if self._status.get(room_id) == status:
+                return
+            self._status[room_id] = status
+        # 還拿著房間 lock：同一間房的通知不會亂序
+        for fn in _watchers:
+            fn(self.code, room_id, status[0], self.capacity, status[1])
+
+    @contextlib.contextmanager
+    @locks.passthrough
+    def opened(self, room_id: int):
+        """鎖住 room_id 這間房，不存在就建立；拿到 lock 時房間一定還在表裡（沒有剛好被回收）"""
+        while True:
+            room = self._open(room_id)
+            with room.lock:
+                if self._rooms.get(room_id) is room:
+                    try:
+                        yield room
+                    finally:
+                        self._touch(room)
+                    return
+
+    @contextlib.contextmanager
+    @locks.passthrough
+    def locked(self, room_id: int):
+        """鎖住已經存在的房間；不存在時給 None（不建立）"""
+        room = self._rooms.get(room_id)
+        if room is None:
+            yield None
+            return
+        with room.lock:
+            try:
+                yield room
+            finally:
+                self._touch(room)
+
+    def first_free(self, limit: int, accept=None):
+        with self._lock:
+            return self.occupancy.first_free(limit, accept)
+
+    def least_full(self, limit: int, accept=None):
+        with self._lock:
+            return self.occupancy.least_full(limit, accept)
+
+    def reap(self, idle: float, now: float) -> int:
+        """回收空了至少 idle 秒的房間；正在被用（lock 拿不到）的房間這次跳過"""
+        n = 0
+        for room_id, room in self.items():
+            if not room.lock.acquire(False):
+                self._empty_since.pop(room_id, None)
+                continue
+            try:
+                if not room.is_empty():
+                    self._empty_since.pop(room_id, None)
+                    continue
+                since = self._empty_since.setdefault(room_id, now)
+                if now - since >= idle:
+                    with self._lock:
+                        del self._rooms[room_id]
+                        self._status.pop(room_id, None)
+                    del self._empty_since[room_id]
+                    for fn in _watchers:
+                        fn(self.code, room_id, None, self.capacity, False)
+                    n += 1
+            finally:
+                room.lock.release()
+        self.reclaimed += n
+        return n
+
+
+# ====== 回收 ======
+def sweep(now=None) -> int:
+    if IDLE_SECONDS <= 0:
+        return 0
+    now = time.monotonic() if now is None else now
+    return sum(table.reap(IDLE_SECONDS, now) for table in list(tables.values()))
+
+
+def _reaper_loop():
+    while True:
+        # 至少每 IDLE_SECONDS / 2 看一次，房間最晚在空了 1.5 倍 IDLE_SECONDS 後回收
+        time.sleep(min(10.0, max(1.0, IDLE_SECONDS / 2)))
+        sweep()
+
+
+def _start_reaper():
+    # 第一次建房間時才開：--workers 的子 process 與 game worker 各自有自己的 reaper
+    global _reaper
+    if _reaper is not None or IDLE_SECONDS <= 0:
+        return
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = threading.Thread(target=_reaper_loop, name="room-reaper", daemon=True)
+            _reaper.start()
+
+
+def watch(fn):
+    _watchers.append(fn)
+
+
+def configure(idle=None):
+    global IDLE_SECONDS
+    if idle is not None:
+        IDLE_SECONDS = float(idle)
@@ -1,7 +1,14 @@
-import random
-import threading
-
-lock = threading.RLock()
+import sys
+
+import eventlog
+import games
+import latency
+import locks
+import metrics
+import rng
+import roomtable
+import wallet
+from outbound import broadcast, send_line
 
 RED_NUMS = {1,3,5,7,9,12,14,16,18,19,21,23,25,27,30,32,34,36}
 BLACK_NUMS = {2,4,6,8,10,11,13,15,17,20,22,24,26,28,29,31,33,35}
@@ -9,18 +16,8 @@ BLACK_NUMS = {2,4,6,8,10,11,13,15,17,20,22,24,26,28,29,31,33,35}
 MAX_ROOMS = 50
 MAX_PLAYERS = 20
 
-
-def send_line(conn, msg: str):
-    if conn is None:
-        return
-    if msg is None:
-        msg = ""
-    if not msg.endswith("\n"):
-        msg += "\n"
-    try:
-        conn.sendall(msg.encode())
-    except:
-        pass
+_ROUNDS_STARTED = metrics.counter("casino_rounds_started_total", "開始的牌局", game="ROULETTE")
+_ROUNDS_FINISHED = metrics.counter("casino_rounds_finished_total", "打完的牌局（中止的不算）", game="ROULETTE")
 
 
 def send_to_player(player, msg: str):
@@ -30,55 +27,93 @@ def send_to_player(player, msg: str):
         pass
 
 
-def broadcast_players(players, msg: str):
-    for p in list(players):
-        try:
-            send_line(p.conn, msg)
-        except:
-            pass
+def broadcast_players(players, msg: str, essential=True):
+    broadcast([p.conn for p in players], msg, essential)
+
+
+def _spin(rng):
+    return rng.randint(0, 36)
+
+
+class Bet:
+    __slots__ = ("type", "value", "amount", "hold")
+
+    def __init__(self, bet_type, value, hold):
+        self.type = bet_type
+        self.value = value        # 只有 NUM 有值
+        self.amount = hold.amount
+        self.hold = hold          # wallet.Hold：開獎時 settle，離開房間時 refund
+
+
+class Seat:
+    __slots__ = ("player", "bets")
+
+    def __init__(self, player):
+        self.player = player
+        self.bets = []            # [Bet]，這一輪下的注
+
+
+class Room:
+    __slots__ = ("room_id", "lock", "seats")
+
+    def __init__(self, room_id: int):
+        self.room_id = room_id
+        self.lock = locks.RoomLock("ROULETTE", room_id)
+        self.seats = {}           # conn -> Seat（依進房順序）
+
+    def seat_of(self, player):
+        return self.seats.get(player.conn)
+
+    def players(self):
+        return [seat.player for seat in self.seats.values()]
 
+    def is_empty(self):
+        return not self.seats
 
-def _new_room_state(room_id: int):
-    return {
-        "room_id": room_id,
-        "players": [],
-        "bets": {},   # player -> list[bet]
-    }
+    def occupancy(self):
+        return len(self.seats)
 
+    def status(self):
+        return len(self.seats), False     # 輪盤隨時可以下注，沒有「一局」
 
-rooms = {i: _new_room_state(i) for i in range(1, MAX_ROOMS + 1)}
+    def snapshot(self):
+        """給 snapshot.py：在房間 lock 裡呼叫，只複製狀態"""
+        seats = [[s.player.name, [[b.type, b.value, b.amount] for b in s.bets]] for s in self.seats.values()]
+        return {"seats": seats,
+                "stakes": [[name, sum(b[2] for b in bets)] for name, bets in seats if bets]}
 
 
-def pick_room():
-    """挑一個比較空的房間（人數最少的）"""
-    with lock:
-        best_rid = 1
-        best_n = None
-        for rid, room in rooms.items():
-            n = len(room["players"])
-            if best_n is None or n < best_n:
-                best_n = n
-                best_rid = rid
-        return best_rid
+rooms = roomtable.RoomTable("ROULETTE", Room, MAX_PLAYERS)    # 第一次有人進來才建立，空房會被回收
+
+
+def room_lock(room_id: int):
+    """給 server 用：在這把 lock 內送出一個指令的所有輸出"""
+    room = rooms.get(room_id)
+    return room.lock if room else None
+
+
+def pick_room(accept=None):
+    """挑一個比較空的房間（人數最少的）
+
+    查人數索引，不拿任何房間的 lock：人數只是參考，enter() 會在房間 lock 內再檢查是否已滿。
+    """
+    return rooms.least_full(MAX_ROOMS, accept) or 1
 
 
 # server 需要 enter() 回傳 True/False
 def enter(player, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
-            send_to_player(player, "【ROULETTE】房間不存在")
-            return False
-
-        if player in room["players"]:
+    if room_id < 1:
+        send_to_player(player, "【ROULETTE】房間不存在")
+        return False
+    with rooms.opened(room_id) as room:
+        if room.seat_of(player) is not None:
             return True
 
-        if len(room["players"]) >= MAX_PLAYERS:
+        if len(room.seats) >= MAX_PLAYERS:
             send_to_player(player, f"【ROULETTE】房間 {room_id} 已滿（最多 {MAX_PLAYERS} 人）")
             return False
 
-        room["players"].append(player)
-        room["bets"].setdefault(player, [])
+        room.seats[player.conn] = Seat(player)
 
     send_to_player(player,
                    f"你已進入【輪盤#{room_id}】\n"
@@ -87,14 +122,13 @@ def enter(player, room_id: int):
 
 
 def remove_conn(conn, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             return
-        remove = [p for p in room["players"] if p.conn is conn]
-        for p in remove:
-            room["players"].remove(p)
-            room["bets"].pop(p, None)
+        seat = room.seats.pop(conn, None)
+        # 還沒開獎就離開：下的注退回
+        for b in seat.bets if seat else ():
+            wallet.refund(b.hold, f"ROULETTE#{room_id} 離開")
 
 
 def handle_command(player, raw, room_id: int):
@@ -103,12 +137,11 @@ def handle_command(player, raw, room_id: int):
         return
     cmd = parts[0].upper()
 
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             send_to_player(player, "【ROULETTE】房間不存在")
             return
-        if player not in room["players"]:
+        if room.seat_of(player) is None:
             send_to_player(player, "請先 PLAY ROULETTE 進入房間")
             return
 
@@ -157,12 +190,14 @@ def handle_command(player, raw, room_id: int):
 
 
 def roulette_bet(player, room_id: int, bet_type, value_str, amount_str):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             send_to_player(player, "【ROULETTE】房間不存在")
             return
-
+        seat = room.seat_of(player)
+        if seat is None:
+            send_to_player(player, "請先 PLAY ROULETTE 進入房間")
+            return
         try:
             amount = int(amount_str)
         except:
@@ -171,10 +206,6 @@ def roulette_bet(player, room_id: int, bet_type, value_str, amount_str):
         if amount <= 0:
             send_to_player(player, "下注金額必須 > 0")
             return
-        if player.balance < amount:
-            send_to_player(player, "餘額不足")
-            return
-
         bet_type = bet_type.upper()
         value = None
 
@@ -196,94 +227,107 @@ def roulette_bet(player, room_id: int, bet_type, value_str, amount_str):
             send_to_player(player, "下注類型錯誤：NUM/RED/BLACK/ODD/EVEN")
             return
 
-        player.balance -= amount
-        room["bets"].setdefault(player, [])
-        room["bets"][player].append({"type": bet_type, "value": value, "amount": amount})
+        hold = wallet.reserve(player.account, amount, f"ROULETTE#{room_id} {bet_type}", "ROULETTE")
+        if hold is None:
+            send_to_player(player, "餘額不足")
+            return
+        if not any(s.bets for s in room.seats.values()):
+            _ROUNDS_STARTED.inc()         # 這一輪的第一筆注（一輪 = 到下一次 SPIN）
+        seat.bets.append(Bet(bet_type, value, hold))
+        eventlog.emit("ROULETTE", room_id, "BETR", player.name,
+                      f"{bet_type} {amount}" if value is None else f"{bet_type} {value} {amount}", room)
 
-    send_to_player(player, f"下注成功：{bet_type} {'' if value is None else value} {amount}")
-    with lock:
-        broadcast_players(room["players"], f"【輪盤#{room_id}】{player.name} 下了一筆注。")
+        send_to_player(player, f"下注成功：{bet_type} {'' if value is None else value} {amount}")
+        broadcast_players(room.players(), f"【輪盤#{room_id}】{player.name} 下了一筆注。", essential=False)
 
 
 def roulette_spin(player, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             send_to_player(player, "【ROULETTE】房間不存在")
             return
-        if not any(room["bets"].values()):
+        if not any(seat.bets for seat in room.seats.values()):
             send_to_player(player, "目前沒有任何下注，無法轉輪")
             return
 
-        result = random.randint(0, 36)
+        result = rng.draw(f"ROULETTE#{room_id}", _spin)
 
-    color = "綠"
-    if result in RED_NUMS:
-        color = "紅"
-    elif result in BLACK_NUMS:
-        color = "黑"
+        color = "綠"
+        if result in RED_NUMS:
+            color = "紅"
+        elif result in BLACK_NUMS:
+            color = "黑"
 
-    with lock:
-        broadcast_players(room["players"], f"【輪盤#{room_id}】開獎：{result} ({color})")
+        broadcast_players(room.players(), f"【輪盤#{room_id}】開獎：{result} ({color})")
 
-        for p, blist in list(room["bets"].items()):
+        for seat in list(room.seats.values()):
+            p = seat.player
             win = 0
-            for b in blist:
-                t = b["type"]
-                v = b["value"]
-                amt = b["amount"]
+            for b in seat.bets:
+                t = b.type
+                v = b.value
+                amt = b.amount
+                payout = 0
 
                 if t == "NUM":
                     if v == result:
-                        win += amt * 36
+                        payout = amt * 36
                 elif t == "RED":
                     if result in RED_NUMS:
-                        win += amt * 2
+                        payout = amt * 2
                 elif t == "BLACK":
                     if result in BLACK_NUMS:
-                        win += amt * 2
+                        payout = amt * 2
                 elif t == "ODD":
                     if result != 0 and result % 2 == 1:
-                        win += amt * 2
+                        payout = amt * 2
                 elif t == "EVEN":
                     if result != 0 and result % 2 == 0:
-                        win += amt * 2
+                        payout = amt * 2
+
+                wallet.settle(b.hold, payout, f"ROULETTE#{room_id} 開獎 {result}")
+                win += payout
 
             if win > 0:
-                p.balance += win
                 send_to_player(p, f"你這輪贏得：{win}，目前餘額：{p.balance}")
             else:
                 send_to_player(p, f"你這輪沒中，目前餘額：{p.balance}")
 
-            room["bets"][p] = []
+            seat.bets = []
+
+        _ROUNDS_FINISHED.inc()
+        eventlog.emit("ROULETTE", room_id, "SPIN", player.name, str(result), room)
 
 
 def roulette_bets(player, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             send_to_player(player, "【ROULETTE】房間不存在")
             return
-        blist = room["bets"].get(player, [])
+        seat = room.seat_of(player)
+        blist = seat.bets if seat else []
         if not blist:
             send_to_player(player, "你目前沒有下注")
             return
         lines = ["你目前下注："]
         for b in blist:
-            lines.append(f" - {b['type']} {'' if b['value'] is None else b['value']} {b['amount']}")
+            lines.append(f" - {b.type} {'' if b.value is None else b.value} {b.amount}")
         send_to_player(player, "\n".join(lines))
 
 
 def roulette_status(player, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             send_to_player(player, "【ROULETTE】房間不存在")
             return
         total = 0
         bettors = 0
-        for p, blist in room["bets"].items():
-            if blist:
+        for seat in room.seats.values():
+            if seat.bets:
                 bettors += 1
-                total += sum(b["amount"] for b in blist)
+                total += sum(b.amount for b in seat.bets)
         send_to_player(player, f"【ROULETTE#{room_id}】下注人數：{bettors}，總下注：{total}")
+
+
+games.register("ROULETTE", sys.modules[__name__])
+latency.register("ROULETTE", ("HELP", "?", "BETR", "SPIN", "BETS", "RSTATUS", "RSTAT"))
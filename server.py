@@ -1,68 +1,109 @@
+import argparse
+import asyncio
+import contextlib
+import signal
 import socket
+import sys
 import threading
+import time
 
 import big2
 import blackjack
 import tictactoe
 import roulette
+import admin
+import cluster
+import eventlog
+import framing
+import games
+import gateway
+import latency
+import lobby
+import locks
+import metrics
+import outbound
+import profiler
+import recorder
+import rng
+import roomtable
+import snapshot
+import store
+import wallet
+from framing import LineFramer
+from outbound import send_line
 
 HOST = "0.0.0.0"
 PORT = 50001
 
 clients = {}
-clients_lock = threading.Lock()
+clients_lock = locks.Lock("server.clients")
 
 used_names = set()
-names_lock = threading.Lock()
+names_lock = locks.Lock("server.names")
 
+_BYTES_IN = metrics.counter("casino_bytes_received_total", "從玩家收到的 bytes")
+metrics.collect("casino_clients", "gauge", "目前的連線數", lambda: [({}, len(clients))])
 
-def send_line(conn, msg: str):
-    if conn is None:
-        return
-    if msg is None:
-        msg = ""
-    if not msg.endswith("\n"):
-        msg += "\n"
-    try:
-        conn.sendall(msg.encode())
-    except:
-        pass
+
+def _players_gauge(code: str):
+    return metrics.gauge("casino_players", "在各遊戲房間裡的玩家", game=code)
 
 
 # Player
 class Player:
+    __slots__ = ("conn", "name", "account", "current_game", "current_room", "framer", "admin", "admin_failures")
+
     def __init__(self, conn):
         self.conn = conn
         self.name = None
-        self.balance = 1000
+        self.account = wallet.open_account(self)
         self.current_game = None
         self.current_room = None
-        self.buffer = ""
+        self.framer = LineFramer()
+        self.admin = False
+        self.admin_failures = 0
+
+    @property
+    def balance(self):
+        # 唯讀：要動籌碼一律透過 wallet（reserve / settle / refund）
+        return self.account.balance
 
 
 # 離開目前遊戲
 def leave_current_game(player: Player):
-    game = player.current_game
+    code = player.current_game
     room_id = player.current_room
-    if not game:
+    if not code:
         return
 
     try:
-        if game == "BIG2":
-            big2.remove_conn(player.conn, room_id)
-        elif game == "BLACKJACK":
-            blackjack.remove_conn(player.conn, room_id)
-        elif game == "TTT":
-            tictactoe.remove_conn(player.conn, room_id)
-        elif game == "ROULETTE":
-            roulette.remove_conn(player.conn, room_id)
+        game = games.get(code)
+        with _game_scope(game, room_id):
+            game.remove_conn(player.conn, room_id)
     except Exception as e:
         print("[ERROR] leave_current_game:", e)
 
+    _players_gauge(code).dec()
     player.current_game = None
     player.current_room = None
 
 
+# 房間的 lock 內就把 batch 送出：兩個 thread 的廣播不會因為各自延後送出而在別人那邊順序顛倒
+@contextlib.contextmanager
+@locks.passthrough
+def _game_scope(game, room_id):
+    room_lock = getattr(game, "room_lock", None)    # gateway 的 GameProxy 沒有（worker 自己是單執行緒）
+    lock = room_lock(room_id) if room_lock else None
+    if lock is None:
+        yield
+        return
+    with lock:
+        try:
+            yield
+        finally:
+            outbound.flush()
+
+
 # 房號工具
 def _parse_room_id(parts, default_room_id: int):
     if len(parts) >= 3:
@@ -73,40 +114,75 @@ def _parse_room_id(parts, default_room_id: int):
     return default_room_id
 
 
-def _default_room_for(game: str):
+def _default_room_for(code: str, game):
     try:
-        if game == "BIG2":
-            return big2.pick_room() or 1
-        if game == "BLACKJACK":
-            return blackjack.pick_room() or 1
-        if game == "TTT":
-            return tictactoe.pick_room() or 1
-        if game == "ROULETTE":
-            return roulette.pick_room() or 1
+        return game.pick_room(cluster.owned_filter(code)) or 1
     except:
         pass
     return 1
 
 
-def _max_room_for(game: str):
-    if game == "BIG2":
-        return big2.MAX_ROOMS
-    if game == "BLACKJACK":
-        return blackjack.MAX_ROOMS
-    if game == "TTT":
-        return tictactoe.MAX_ROOMS
-    if game == "ROULETTE":
-        return roulette.MAX_ROOMS
-    return None
+# 名字唯一性：單一 process 用 used_names；多 worker 模式交給 coordinator
+def _claim_name(new_name: str, old_name=None) -> bool:
+    if cluster.active():
+        return cluster.claim_name(new_name, old_name)
+    with names_lock:
+        if new_name in used_names:
+            return False
+        if old_name:
+            used_names.discard(old_name)
+        used_names.add(new_name)
+    return True
+
+
+def _release_name(name: str):
+    if cluster.active():
+        cluster.release_name(name)
+        return
+    with names_lock:
+        used_names.discard(name)
+
+
+def _enter_game(player: Player, code: str, game, room_id: int):
+    # ★重點：enter() 回傳 True/False，失敗時不能顯示「已進入」
+    with _game_scope(game, room_id):
+        if not game.enter(player, room_id):
+            return
+    _players_gauge(code).inc()
+    player.current_game = code
+    player.current_room = room_id
+    send_line(player.conn, f"已進入 {code} 房間 #{room_id}")
+    send_line(player.conn, "提示：在房間內輸入 HELP 可查看遊戲指令")
 
 
 # 指令
+LOBBY_COMMANDS = ("HELLO", "ADMIN", "HELP", "?", "WHERE", "ROOM", "STATUS", "ROOMS", "PLAY", "LEAVE", "QUIT")
+_LOBBY_LATENCY = latency.register("LOBBY", LOBBY_COMMANDS)
+# 每個指令都會用到：import 時先拿好，省掉每次的模組屬性查找（latency.rows 這個 dict 不會被換掉）
+_clock = time.perf_counter_ns
+_latency_rows = latency.rows
+_record = latency.record
+
+
 def handle_command(player: Player, raw: str):
-    conn = player.conn
     parts = raw.strip().split()
     if not parts:
         return
     cmd = parts[0].upper()
+    if not latency.ENABLED:
+        _route(player, raw, parts, cmd)
+        return
+    t0 = _clock()
+    scope = None
+    try:
+        scope = _route(player, raw, parts, cmd)
+    finally:
+        _record(_latency_rows.get(scope, _LOBBY_LATENCY), cmd, _clock() - t0)
+
+
+def _route(player: Player, raw: str, parts, cmd: str):
+    """處理一個指令；交給遊戲模組時回傳該遊戲的 code（延遲統計記在它底下）"""
+    conn = player.conn
 
     # ===== HELLO =====
     if cmd == "HELLO":
@@ -118,15 +194,17 @@ def handle_command(player: Player, raw: str):
         if not new_name:
             send_line(conn, "名字不能空白")
             return
+        if store.PATH and player.name and player.current_game:
+            send_line(conn, "遊戲中不能換名字（籌碼跟著名字存），請先 LEAVE")
+            return
 
-        with names_lock:
-            if new_name in used_names:
-                send_line(conn, f"名字已被使用：{new_name}")
-                return
-            if player.name:
-                used_names.discard(player.name)
-            used_names.add(new_name)
-            player.name = new_name
+        if not _claim_name(new_name, player.name):
+            send_line(conn, f"名字已被使用：{new_name}")
+            return
+        player.name = new_name
+        conn.label = new_name
+        if store.PATH:
+            store.login(new_name, player.account)
 
         send_line(conn, f"歡迎 {player.name}！")
         send_line(conn, "輸入 HELP 查看指令")
@@ -136,6 +214,11 @@ def handle_command(player: Player, raw: str):
         send_line(conn, "請先 HELLO <name>")
         return
 
+    # ===== ADMIN =====
+    if cmd == "ADMIN":
+        admin.handle(player, parts)
+        return
+
     # ===== HELP =====
     if cmd in ("HELP", "?"):
         if not player.current_game:
@@ -147,6 +230,7 @@ def handle_command(player: Player, raw: str):
                 "LEAVE                            回到大廳\n"
                 "WHERE                            顯示目前位置\n"
                 "STATUS                           顯示個人狀態\n"
+                "ROOMS [GAME] [OPEN] [IDLE] [頁數] 查看各遊戲房間（OPEN 有空位、IDLE 未開局）\n"
                 "QUIT                             離線\n"
                 "\n"
                 "GAME代號:BIG2 / BLACKJACK / TTT / ROULETTE(分別是大老二、21點、井字棋、輪盤)\n"
@@ -167,45 +251,39 @@ def handle_command(player: Player, raw: str):
                         f"{'' if not player.current_room else ' #' + str(player.current_room)}")
         return
 
+    # ===== ROOMS =====
+    if cmd == "ROOMS":
+        lobby.handle(player, parts)
+        return
+
     # ===== PLAY =====
     if cmd == "PLAY":
         if len(parts) < 2:
             send_line(conn, "用法：PLAY <BIG2|BLACKJACK|TTT|ROULETTE> [ROOM_ID]")
             return
 
-        game = parts[1].upper()
+        code = parts[1].upper()
         leave_current_game(player)
 
-        default_room = _default_room_for(game)
-        room_id = _parse_room_id(parts, default_room)
-
-        max_room = _max_room_for(game)
-        if max_room is None:
+        game = games.get(code)
+        if game is None:
             send_line(conn, "未知遊戲")
             return
 
+        room_id = _parse_room_id(parts, None)
+        if room_id is None:
+            room_id = _default_room_for(code, game)
+
+        max_room = game.MAX_ROOMS
         if room_id < 1 or room_id > max_room:
-            send_line(conn, f"【{game}】房號範圍只能 1~{max_room}")
+            send_line(conn, f"【{code}】房號範圍只能 1~{max_room}")
             return
 
-        # ★重點：enter() 回傳 True/False，失敗時不能顯示「已進入」
-        ok = False
-        if game == "BIG2":
-            ok = big2.enter(player, room_id)
-        elif game == "BLACKJACK":
-            ok = blackjack.enter(player, room_id)
-        elif game == "TTT":
-            ok = tictactoe.enter(player, room_id)
-        elif game == "ROULETTE":
-            ok = roulette.enter(player, room_id)
-
-        if not ok:
-            return
+        # 多 worker 模式：房間在別的 worker，整條連線轉過去由對方 enter
+        if not cluster.owns(code, room_id):
+            raise cluster.HandOff(code, room_id)
 
-        player.current_game = game
-        player.current_room = room_id
-        send_line(conn, f"已進入 {game} 房間 #{room_id}")
-        send_line(conn, "提示：在房間內輸入 HELP 可查看遊戲指令")
+        _enter_game(player, code, game, room_id)
         return
 
     # ===== LEAVE / QUIT =====
@@ -219,74 +297,342 @@ def handle_command(player: Player, raw: str):
         raise ConnectionResetError
 
     # ===== IN GAME =====
-    game = player.current_game
-    room_id = player.current_room
-    if not game:
+    if not player.current_game:
         send_line(conn, "請先 PLAY 進入遊戲")
         return
 
-    if game == "BIG2":
-        big2.handle_command(player, raw, room_id)
-    elif game == "BLACKJACK":
-        blackjack.handle_command(player, raw, room_id)
-    elif game == "TTT":
-        tictactoe.handle_command(player, raw, room_id)
-    elif game == "ROULETTE":
-        roulette.handle_command(player, raw, room_id)
-    else:
+    game = games.get(player.current_game)
+    if game is None:
         send_line(conn, "內部錯誤：未知的 current_game")
+        return
+    code = player.current_game
+    with _game_scope(game, player.current_room):
+        game.handle_command(player, raw, player.current_room)
+    return code
 
 
-# Client Thread
-def client_thread(conn, addr):
+# 連線建立 / 結束（thread 與 asyncio 兩種引擎共用）
+def _register(conn):
     player = Player(conn)
     with clients_lock:
         clients[conn] = player
+    recorder.opened(conn, conn.addr)
 
     send_line(conn, "歡迎連線到 TCP Casino Server")
     send_line(conn, "請先輸入：HELLO <name>")
+    return player
+
+
+def _release(player: Player):
+    # 離開遊戲、存檔、銷戶、放掉名字（recorder 重播時也用這個收尾）
+    leave_current_game(player)
+    if player.name and store.PATH:
+        # 多 worker：名字放掉之後可能馬上在別的 process 登入，要先確定寫進去了
+        store.logout(player.name, player.account, wait=cluster.active())
+    wallet.close_account(player.account, "disconnect")
+    if player.name:
+        _release_name(player.name)
+    with clients_lock:
+        clients.pop(player.conn, None)
+
+
+def _unregister(player: Player, addr):
+    conn = player.conn
+    recorder.closed(conn)
+    _release(player)
+    try:
+        conn.close()
+    except:
+        pass
+    print("[DISCONNECT]", addr)
+
+
+def _dispatch(player: Player):
+    framer = player.framer
+    seen = framer.violations
+    lines = framer.lines()
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            recorder.line(player.conn, line)
+            # 一個指令的所有輸出合併：每個收件人只寫一次
+            with outbound.batch():
+                handle_command(player, line)
+        except cluster.HandOff as h:
+            # 同一批後面還沒處理的指令一起帶走
+            h.pending = "".join(rest + "\n" for rest in lines[i + 1:]).encode() + framer.pending()
+            raise
+
+    if framer.violations != seen:
+        send_line(player.conn, f"指令過長（上限 {framer.max_line} bytes），已忽略")
+        if framer.over_limit:
+            framing.totals["dropped_conns"] += 1
+            send_line(player.conn, "過長指令次數過多，斷線")
+            raise ConnectionAbortedError("too many oversized lines")
+
+
+# 多 worker 模式：把連線轉交給擁有目標房間的 worker
+def _hand_off(player: Player, addr, h: cluster.HandOff) -> bool:
+    state = {
+        "name": player.name,
+        "balance": player.balance,
+        "game": h.code,
+        "room": h.room_id,
+        "pending": h.pending.decode("latin-1"),
+        "admin": player.admin,
+        "addr": list(addr) if addr else None,
+    }
+    with clients_lock:
+        clients.pop(player.conn, None)
+    store.flush()       # 接手的 worker 會寫同一個名字，這邊還沒寫的要先寫完
+    sock = player.conn.detach()
+    try:
+        target = cluster.send_handoff(sock, state)
+    except OSError as e:
+        print("[ERROR] handoff:", e)
+        return False
+    sock.close()
+    wallet.close_account(player.account, f"handoff -> worker {target}")
+    print(f"[HANDOFF] {addr} {h.code}#{h.room_id} -> worker {target}")
+    return True
+
+
+def _adopt(conn, state: dict):
+    player = Player(conn)
+    player.name = state["name"]
+    wallet.sync(player.account, state["balance"], "handoff")
+    player.admin = state.get("admin", False)
+    conn.label = player.name
+    with clients_lock:
+        clients[conn] = player
+    cluster.adopt_name(player.name)
+
+    code = state["game"]
+    _enter_game(player, code, games.get(code), state["room"])
+    player.framer.feed(state["pending"].encode("latin-1"))
+    return player
+
+
+# Client Thread
+def client_thread(sock, addr, handoff=None):
+    conn = outbound.Connection(sock, addr)
+    handed_off = False
 
     try:
+        if handoff is None:
+            player = _register(conn)
+        else:
+            player = _adopt(conn, handoff)
+            _dispatch(player)
+
         while True:
-            data = conn.recv(1024)
-            if not data:
+            n = player.framer.recv_from(conn)
+            if not n:
                 break
+            _BYTES_IN.inc(n)
+            _dispatch(player)
+            conn.throttle()
 
-            player.buffer += data.decode(errors="ignore")
-            while "\n" in player.buffer:
-                line, player.buffer = player.buffer.split("\n", 1)
-                if line.strip():
-                    handle_command(player, line)
+    except cluster.HandOff as h:
+        handed_off = _hand_off(player, addr, h)
 
     except Exception as e:
         print("[ERROR] client_thread:", e)
 
     finally:
-        leave_current_game(player)
-        if player.name:
-            with names_lock:
-                used_names.discard(player.name)
-        with clients_lock:
-            clients.pop(conn, None)
-        try:
-            conn.close()
-        except:
-            pass
-        print("[DISCONNECT]", addr)
+        if not handed_off:
+            _unregister(player, addr)
 
 
-# Main
-def main():
-    print("[SERVER] Casino Server 啟動")
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    s.bind((HOST, PORT))
-    s.listen()
+def adopted_thread(sock, state: dict):
+    addr = tuple(state["addr"]) if state.get("addr") else None
+    client_thread(sock, addr, handoff=state)
+
+
+# asyncio 引擎：每個連線是一個 task，而不是一條 OS thread
+async def client_task(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    addr = writer.get_extra_info("peername")
+    conn = outbound.AsyncConnection(writer, addr)
+    player = _register(conn)
+
+    try:
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            _BYTES_IN.inc(len(data))
+            player.framer.feed(data)
+            # 遊戲模組的 handle_command 是同步的，直接在 event loop 上呼叫
+            _dispatch(player)
+            await conn.throttle()
+
+    except Exception as e:
+        print("[ERROR] client_task:", e)
+
+    finally:
+        _unregister(player, addr)
+
+
+async def _serve_asyncio(host, port):
+    server = await asyncio.start_server(client_task, host, port, reuse_address=True)
+    async with server:
+        await server.serve_forever()
 
+
+def _accept_loop(s: socket.socket):
     while True:
         conn, addr = s.accept()
         threading.Thread(target=client_thread, args=(conn, addr), daemon=True).start()
 
 
+def _worker_serve(s: socket.socket):
+    # --workers：房間分在各 worker，每個 worker 各自開 /metrics
+    metrics.start(cluster.index)
+    _accept_loop(s)
+
+
+def serve_threaded(host, port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((host, port))
+    s.listen()
+    _accept_loop(s)
+
+
+def serve_asyncio(host, port):
+    asyncio.run(_serve_asyncio(host, port))
+
+
+ENGINES = {
+    "thread": serve_threaded,
+    "asyncio": serve_asyncio,
+}
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="TCP Casino Server")
+    ap.add_argument("--host", default=HOST)
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--engine", choices=sorted(ENGINES), default="thread",
+                    help="thread：每個連線一條 thread（預設）；asyncio：單一 event loop")
+    ap.add_argument("--send-soft-limit", type=int, default=outbound.SOFT_LIMIT,
+                    help="送出佇列超過此 bytes 數就丟掉非必要廣播")
+    ap.add_argument("--send-hard-limit", type=int, default=outbound.HARD_LIMIT,
+                    help="送出佇列超過此 bytes 數就斷線")
+    ap.add_argument("--max-line", type=int, default=framing.MAX_LINE,
+                    help="單行指令最多幾 bytes，超過整行丟棄")
+    ap.add_argument("--max-violations", type=int, default=framing.MAX_VIOLATIONS,
+                    help="過長指令超過幾次就斷線")
+    ap.add_argument("--no-coalesce", action="store_true",
+                    help="關閉輸出合併（每則訊息各自寫出，量測對照用）")
+    ap.add_argument("--tcp-nodelay", action="store_true",
+                    help="關掉 Nagle（thread 引擎；asyncio 預設已開）")
+    ap.add_argument("--tcp-cork", action="store_true",
+                    help="writer 有後續資料時先 TCP_CORK，佇列清空才送出（Linux）")
+    ap.add_argument("--lock-stats", action="store_true",
+                    help="記錄每把 lock 的等待 / 持有時間（ADMIN LOCKS 查看）")
+    ap.add_argument("--no-latency-stats", action="store_true",
+                    help="不記每個指令的延遲直方圖（ADMIN STATS；量測對照用）")
+    ap.add_argument("--metrics-port", type=int, default=None,
+                    help="在這個 port 開 Prometheus 格式的 /metrics（--workers 第 i 個聽 PORT+i，--gateway 的遊戲 worker 聽 PORT+1…）")
+    ap.add_argument("--metrics-host", default=metrics.HOST,
+                    help="/metrics 聽哪個位址（預設只給本機）")
+    ap.add_argument("--admin-token", default=None,
+                    help="開啟 ADMIN 指令，ADMIN LOGIN <token> 登入")
+    ap.add_argument("--profile-dir", default=profiler.DIR,
+                    help="ADMIN PROFILE 的輸出檔寫在這個目錄（ADMIN 只能給檔名）")
+    ap.add_argument("--max-rooms", default="",
+                    help="各遊戲的房號上限，例如 TTT=5000,BIG2=200（執行中可用 ADMIN ROOMS 調整）")
+    ap.add_argument("--room-idle", type=float, default=roomtable.IDLE_SECONDS,
+                    help="房間空著幾秒後回收（0 = 不回收）")
+    ap.add_argument("--db", default=None,
+                    help="玩家餘額存到這個 SQLite 檔（WAL）；HELLO 時讀回上次的餘額")
+    ap.add_argument("--db-commit-interval", type=float, default=store.COMMIT_INTERVAL,
+                    help="背景寫入湊一批的等待秒數（group commit）")
+    ap.add_argument("--snapshot", default=None,
+                    help="定期把各房間狀態存成快照檔（PATH）；啟動時依上次的快照退回中斷牌局的下注（需 --db）")
+    ap.add_argument("--snapshot-interval", type=float, default=snapshot.INTERVAL,
+                    help="幾秒拍一次快照")
+    ap.add_argument("--event-log", default=None,
+                    help="每個改變牌局的指令記一筆到二進位事件紀錄（PATH.000001…），用 python eventlog.py PATH 讀")
+    ap.add_argument("--event-log-rotate", type=float, default=eventlog.ROTATE_BYTES >> 20,
+                    help="事件紀錄每個檔寫到幾 MB 就換下一個")
+    ap.add_argument("--record", default=None,
+                    help="把每條連線收到的指令與洗牌 / 開獎的亂數種子錄到 PATH，之後用 python recorder.py PATH 重播")
+    ap.add_argument("--rng", choices=rng.MODES, default=rng.MODE,
+                    help="洗牌 / 開獎的亂數：room = 每間房一條可重現的串流，secure = os.urandom（CSPRNG）")
+    ap.add_argument("--rng-seed", type=int, default=None,
+                    help="room 模式的主種子：給了就每次啟動都發一樣的牌（預設每次啟動隨機）")
+    ap.add_argument("--rng-ahead", type=int, default=rng.AHEAD,
+                    help="背景 thread 幫每間房預先洗好幾副牌 / 開好幾個號碼（0 = 每次當場洗）")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="開 N 個 worker process 共用 PORT（SO_REUSEPORT），房間分給各 worker")
+    ap.add_argument("--gateway", action="store_true",
+                    help="大廳留在本 process，各遊戲跑在獨立的 worker process（Unix socket）")
+    ap.add_argument("--game-workers", default="",
+                    help="gateway 模式下每個遊戲開幾個 worker，例如 BIG2=2,TTT=1（預設各 1）")
+    args = ap.parse_args(argv)
+    for option, spec in (("--max-rooms", args.max_rooms), ("--game-workers", args.game_workers)):
+        try:
+            gateway.parse_spec(spec)
+        except ValueError as e:
+            ap.error(f"{option}：{e}")
+    for code, n in gateway.parse_spec(args.max_rooms).items():
+        if games.get(code) is None or n < 1:
+            ap.error(f"--max-rooms：未知遊戲或上限不合法：{code}={n}")
+    if args.workers > 1 and args.engine != "thread":
+        ap.error("--workers 目前只支援 --engine thread")
+    if args.gateway and (args.engine != "thread" or args.workers > 1):
+        ap.error("--gateway 目前只支援 --engine thread，且不能和 --workers 一起用")
+    if args.record and (args.workers > 1 or args.gateway):
+        ap.error("--record 目前只支援單一 process（不能和 --workers / --gateway 一起用）")
+    if args.record and args.rng == "secure":
+        ap.error("--rng secure 的結果無法重現，不能和 --record 一起用")
+    return args
+
+
+# Main
+def main(argv=None):
+    args = parse_args(argv)
+    outbound.configure(soft_limit=args.send_soft_limit, hard_limit=args.send_hard_limit,
+                       coalesce=not args.no_coalesce, nodelay=args.tcp_nodelay, cork=args.tcp_cork)
+    framing.configure(max_line=args.max_line, max_violations=args.max_violations)
+    locks.configure(enabled=args.lock_stats)
+    latency.configure(enabled=not args.no_latency_stats)
+    metrics.configure(port=args.metrics_port, host=args.metrics_host)
+    admin.configure(token=args.admin_token)
+    profiler.configure(dir=args.profile_dir)
+    roomtable.configure(idle=args.room_idle)
+    store.configure(path=args.db, interval=args.db_commit_interval)
+    snapshot.configure(path=args.snapshot, interval=args.snapshot_interval)
+    eventlog.configure(path=args.event_log, rotate_mb=args.event_log_rotate)
+    rng.configure(mode=args.rng, seed=args.rng_seed, ahead=args.rng_ahead)
+    for code, n in gateway.parse_spec(args.max_rooms).items():
+        games.set_max_rooms(code, n)
+    print(f"[SERVER] Casino Server 啟動（engine={args.engine}）")
+    for line in snapshot.recover():
+        print("[RECOVERY]", line)
+    if args.record:
+        recorder.start(args.record)
+    if args.workers > 1:
+        cluster.run(args.workers, args.host, args.port, serve=_worker_serve, adopt=adopted_thread)
+        return
+    metrics.start()
+    if args.gateway:
+        gateway.install(gateway.parse_spec(args.game_workers))
+        # SIGTERM 也要走到 finally，把 worker 收掉
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        ENGINES[args.engine](args.host, args.port)
+    finally:
+        if snapshot.PATH and not args.gateway:
+            snapshot.take()     # 關機前再拍一次，下次啟動照這份退回
+        gateway.shutdown()
+        eventlog.flush()
+        recorder.flush()
+        store.flush()
+
+
 if __name__ == "__main__":
     main()
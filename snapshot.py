@@ -0,0 +1,180 @@
+"""定期把每間房的狀態存成快照；啟動時依上次的快照報告中斷的牌局並退回下注
+
+server 以 --snapshot PATH 啟動才會開。背景 thread 每 INTERVAL 秒：
+- 逐間房拿一下房間 lock，呼叫 Room.snapshot() 複製狀態（手牌、底池、下注、輪到誰、棋盤…），馬上放開；
+  一次只鎖一間，所以不會卡住遊戲
+- 放開 lock 之後才在這個 thread 裡序列化（JSON + zlib），寫到暫存檔、fsync、再 rename 蓋掉舊的
+
+房間在哪個 process，快照就在哪個 process 寫：
+- --workers：每個 worker 各寫 PATH.w<編號>
+- --gateway：每個遊戲 worker 各寫 PATH.<GAME>-<編號>（gateway 啟動 worker 時傳進去）
+
+recover()：server 啟動、開始收連線之前呼叫。讀所有 PATH* 快照，列出當時還沒結束的牌局與押在上面的籌碼；
+有 --db 時把存檔裡每個人還沒結算的籌碼（held）退回可用餘額，依名字排序處理，重跑也不會多退。
+退多少以存檔為準（最多晚幾毫秒），快照（最多晚 INTERVAL 秒）拿來對帳，兩邊不同時會印出來。
+處理完的快照改名成 .recovered，下次啟動不會再處理一次。
+"""
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+import cluster
+import roomtable
+import store
+
+PATH = None
+INTERVAL = 5.0
+MAGIC = b"CASINO-SNAP 1\n"
+
+_pid = None
+_start_lock = threading.Lock()
+_lock = threading.Lock()      # 一次只寫一份（背景 thread 與 ADMIN SNAPSHOT NOW）；拿著它會去拿房間 lock
+last = {}                     # 上一次的統計
+totals = {"snapshots": 0, "errors": 0}
+
+
+def _path():
+    if cluster.active():
+        return f"{PATH}.w{cluster.index}"
+    return PATH
+
+
+def capture():
+    """逐間房複製狀態；回傳 (rooms, 最久的一次房間 lock 持有 ns)"""
+    rooms = []
+    worst = 0
+    for code, table in sorted(roomtable.tables.items()):
+        for room_id, room in table.items():
+            t0 = time.perf_counter_ns()
+            with room.lock:
+                state = None if room.is_empty() else room.snapshot()
+            held = time.perf_counter_ns() - t0
+            if held > worst:
+                worst = held
+            if state is not None:
+                rooms.append([code, room_id, state])
+    return rooms, worst
+
+
+def encode(rooms) -> bytes:
+    data = {"time": time.time(), "pid": os.getpid(), "rooms": rooms}
+    return MAGIC + zlib.compress(json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode(), 6)
+
+
+def decode(blob: bytes) -> dict:
+    if not blob.startswith(MAGIC):
+        raise ValueError("not a snapshot file")
+    return json.loads(zlib.decompress(blob[len(MAGIC):]))
+
+
+def take() -> dict:
+    """拍一次快照並寫檔；回傳統計"""
+    with _lock:
+        t0 = time.perf_counter_ns()
+        rooms, worst = capture()
+        t1 = time.perf_counter_ns()
+        blob = encode(rooms)
+        path = _path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        t2 = time.perf_counter_ns()
+        last.update(rooms=len(rooms), stakes=sum(amount for _, _, st in rooms for _, amount in st["stakes"]),
+                    capture_ns=t1 - t0, lock_max_ns=worst, write_ns=t2 - t1, bytes=len(blob), at=time.time())
+        totals["snapshots"] += 1
+        return dict(last)
+
+
+def _loop():
+    while True:
+        time.sleep(INTERVAL)
+        try:
+            take()
+        except (OSError, ValueError) as e:
+            totals["errors"] += 1
+            print("[ERROR] snapshot:", e)
+
+
+def _start(*_):
+    # 第一次有房間狀態變化時才開：--workers 的子 process 與遊戲 worker 各自開自己的
+    # （roomtable 的 watcher 是在房間 lock 裡呼叫的，這裡不能拿 _lock）
+    global _pid
+    if _pid == os.getpid() or PATH is None:
+        return
+    with _start_lock:
+        if _pid != os.getpid():
+            _pid = os.getpid()
+            threading.Thread(target=_loop, name="snapshot", daemon=True).start()
+
+
+def report():
+    if not last:
+        return [f"快照：{PATH}（每 {INTERVAL:g}s，這個 process 還沒拍過）"]
+    return [f"快照：{_path()}（每 {INTERVAL:g}s）已拍 {totals['snapshots']} 次 錯誤 {totals['errors']}",
+            f"上一次：{time.strftime('%H:%M:%S', time.localtime(last['at']))} 房間 {last['rooms']} 間 "
+            f"押著的籌碼 {last['stakes']} 檔案 {last['bytes']} bytes",
+            f"複製 {last['capture_ns'] / 1e6:.2f}ms（單間房 lock 最久 {last['lock_max_ns'] / 1e3:.0f}us） "
+            f"序列化+寫檔 {last['write_ns'] / 1e6:.2f}ms"]
+
+
+# ====== 啟動時的回復 ======
+def _files(path: str):
+    """path 這份快照的所有檔：PATH、--workers 的 PATH.w<N>、--gateway 遊戲 worker 的 PATH.<GAME>-<N>；
+    檔名只是開頭一樣的其他檔（別的 server 的快照、.tmp、.recovered）不算"""
+    folder, name = os.path.split(path)
+    own = re.compile(re.escape(name) + r"(?:\.w\d+|\.[A-Z0-9]+-\d+)?")
+    try:
+        names = os.listdir(folder or ".")
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(folder, n) for n in names if own.fullmatch(n))
+
+
+def recover():
+    """回傳要印出的報告行"""
+    if PATH is None:
+        return []
+    lines = []
+    staked = {}               # name -> 快照裡押著的籌碼
+    files = _files(PATH)
+    for path in files:
+        try:
+            with open(path, "rb") as f:
+                data = decode(f.read())
+        except (OSError, ValueError) as e:
+            lines.append(f"{path}：無法讀取（{e}），略過")
+            continue
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(data["time"]))
+        for code, room_id, state in data["rooms"]:
+            if state["stakes"]:
+                desc = " ".join(f"{name}={amount}" for name, amount in state["stakes"])
+                lines.append(f"{code}#{room_id} 中斷（快照 {when}）：{desc}")
+            for name, amount in state["stakes"]:
+                staked[name] = staked.get(name, 0) + amount
+        os.replace(path, f"{path}.recovered")
+
+    if store.PATH:
+        released = store.release_held()
+        for name, held in released:
+            note = "" if staked.get(name) == held else f"（快照記錄 {staked.get(name, 0)}，以存檔為準）"
+            lines.append(f"退回 {name} {held}{note}")
+        for name in sorted(set(staked) - {name for name, _ in released}):
+            lines.append(f"{name}：快照記錄 {staked[name]}，存檔裡已經結算，不用退")
+    elif staked:
+        lines.append("沒有 --db：餘額沒有存檔，無法退回上面的籌碼")
+    return lines
+
+
+def configure(path=None, interval=None):
+    global PATH, INTERVAL
+    if interval is not None:
+        INTERVAL = float(interval)
+    if path:
+        PATH = path
+        roomtable.watch(_start)
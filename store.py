@@ -0,0 +1,224 @@
+"""玩家資料（餘額與基本資料）存在本機的 SQLite（WAL 模式）
+
+server 以 --db PATH 啟動才會開；沒開時和以前一樣，餘額只在記憶體裡，重新連線就回到 wallet.START_BALANCE。
+
+- HELLO 時 login() 讀出這個名字上次的餘額；當時還沒結算的下注（held）一起退回
+- wallet 每次變動只把「名字 -> 最新餘額」放進 _pending，由背景的 writer 一次寫一批：
+  一個 transaction、一次 fsync（group commit），遊戲的 thread 不會等磁碟。
+  同一個名字在一批裡只寫最後的值；一批要嘛整批寫進去、要嘛整批沒有
+- flush() 等到目前為止的變動都寫進磁碟：--workers 轉交連線或斷線時用，別的 process 接著讀才會讀到新的
+
+當機時最多掉最後 COMMIT_INTERVAL（加上一次寫入）的變動。
+writer thread 與 SQLite 連線都在第一次用到時才開：--workers 的子 process 各自開自己的。
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import locks
+import wallet
+
+PATH = None                 # None = 不存
+COMMIT_INTERVAL = 0.005     # 第一筆變動進來之後最多等多久，湊成同一批
+SYNCHRONOUS = "FULL"        # WAL 下每次 commit 都 fsync；一批只有一次
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    name      TEXT PRIMARY KEY,
+    balance   INTEGER NOT NULL,
+    held      INTEGER NOT NULL DEFAULT 0,
+    created   REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    logins    INTEGER NOT NULL DEFAULT 0
+)
+"""
+_UPSERT = """
+INSERT INTO players (name, balance, held, created, last_seen, logins) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(name) DO UPDATE SET balance = excluded.balance, held = excluded.held,
+    last_seen = excluded.last_seen, logins = players.logins + excluded.logins
+"""
+
+_cond = threading.Condition()
+_pending = {}               # name -> [balance, held, last_seen, logins 增量]
+_inflight = {}              # writer 正在寫的那一批（login 要看得到）
+_queued = 0                 # put 的累計次數
+_committed = 0              # 已經寫進磁碟的 put 次數
+_pid = None                 # writer 與連線屬於哪個 process（fork 之後要重開）
+_reader = None
+_reader_lock = locks.Lock("store.reader")
+
+stats = {"puts": 0, "commits": 0, "rows": 0, "max_batch": 0, "commit_ns": 0, "last_commit_ns": 0, "errors": 0}
+
+
+def _connect():
+    db = sqlite3.connect(PATH, timeout=10, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    db.execute(_SCHEMA)
+    db.commit()
+    return db
+
+
+def _start():
+    global _pid, _reader
+    if _pid == os.getpid():
+        return
+    with _reader_lock:
+        if _pid == os.getpid():
+            return
+        _reader = _connect()
+        threading.Thread(target=_writer_loop, args=(_connect(),), name="store-writer", daemon=True).start()
+        _pid = os.getpid()
+
+
+def _writer_loop(db):
+    global _pending, _inflight, _committed
+    while True:
+        with _cond:
+            while not _pending:
+                _cond.wait()
+        time.sleep(COMMIT_INTERVAL)
+        with _cond:
+            batch, _pending = _pending, {}
+            _inflight = batch
+            upto = _queued
+
+        now = time.time()
+        rows = [(name, bal, held, now, seen, logins) for name, (bal, held, seen, logins) in batch.items()]
+        t0 = time.perf_counter_ns()
+        try:
+            with db:
+                db.executemany(_UPSERT, rows)
+        except sqlite3.Error as e:
+            print("[ERROR] store:", e)
+            with _cond:
+                stats["errors"] += 1
+                # 放回去下次再寫；這段時間又有新值的名字以新值為準
+                for name, rec in batch.items():
+                    newer = _pending.get(name)
+                    if newer is None:
+                        _pending[name] = rec
+                    else:
+                        newer[3] += rec[3]
+                _inflight = {}
+            time.sleep(1.0)
+            continue
+        took = time.perf_counter_ns() - t0
+
+        with _cond:
+            _inflight = {}
+            _committed = upto
+            stats["commits"] += 1
+            stats["rows"] += len(rows)
+            stats["max_batch"] = max(stats["max_batch"], len(rows))
+            stats["commit_ns"] += took
+            stats["last_commit_ns"] = took
+            _cond.notify_all()
+
+
+# ====== 寫入 ======
+def put(name: str, balance: int, held: int = 0, login: int = 0):
+    """記下 name 的最新餘額；不等寫入"""
+    global _queued
+    _start()
+    with _cond:
+        rec = _pending.get(name)
+        if rec is None:
+            _pending[name] = [balance, held, time.time(), login]
+            if len(_pending) == 1:
+                _cond.notify_all()        # writer 在等第一筆
+        else:
+            rec[0], rec[1], rec[2] = balance, held, time.time()
+            rec[3] += login
+        _queued += 1
+        stats["puts"] += 1
+
+
+def save(name: str, account, login: int = 0):
+    # 在帳戶 lock 裡放進 _pending：同一個帳戶兩條 thread 同時 save，後讀到的餘額一定後放，不會被舊值蓋掉
+    # （lock 順序：帳戶 lock -> _cond；writer 拿著 _cond 時不碰帳戶）
+    _start()
+    with account.lock:
+        put(name, account.balance, account.held, login)
+
+
+def flush(timeout: float = 10.0) -> bool:
+    """等到呼叫前的 put 都寫進磁碟；逾時回傳 False"""
+    if PATH is None:
+        return True
+    with _cond:
+        target = _queued
+        return _cond.wait_for(lambda: _committed >= target, timeout)
+
+
+def _on_change(account):
+    name = getattr(account.owner, "name", None)
+    if name:
+        save(name, account)
+
+
+# ====== 讀取 ======
+def load(name: str):
+    """(balance, held)；沒有這個名字就是 None。還沒寫進去的變動也看得到"""
+    _start()
+    with _cond:
+        rec = _pending.get(name) or _inflight.get(name)
+        if rec is not None:
+            return rec[0], rec[1]
+    with _reader_lock:
+        row = _reader.execute("SELECT balance, held FROM players WHERE name = ?", (name,)).fetchone()
+    return tuple(row) if row else None
+
+
+def login(name: str, account):
+    """HELLO：把 account 換成這個名字存著的餘額（新名字就是 START_BALANCE）"""
+    saved = load(name)
+    balance = wallet.START_BALANCE if saved is None else saved[0] + saved[1]
+    wallet.sync(account, balance, f"login {name}")
+    save(name, account, login=1)
+
+
+def release_held():
+    """啟動時（還沒有玩家連進來）：把所有人還沒結算的籌碼退回可用餘額；回傳 [(name, 退回的金額)]
+
+    直接開一條連線做完就關，不啟動 writer（--workers 之後才 fork）。同一個 transaction 裡先讀再改，重跑不會多退。
+    """
+    db = sqlite3.connect(PATH, timeout=10, isolation_level=None)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(_SCHEMA)
+        db.execute("BEGIN IMMEDIATE")
+        rows = db.execute("SELECT name, held FROM players WHERE held > 0 ORDER BY name").fetchall()
+        db.execute("UPDATE players SET balance = balance + held, held = 0 WHERE held > 0")
+        db.execute("COMMIT")
+    finally:
+        db.close()
+    return rows
+
+
+def logout(name: str, account, wait=False):
+    save(name, account)
+    if wait:
+        flush()
+
+
+def report():
+    with _cond:
+        pending = len(_pending)
+        st = dict(stats)
+    commits = st["commits"] or 1
+    return [f"db={PATH} synchronous={SYNCHRONOUS} 批次間隔={COMMIT_INTERVAL * 1e3:g}ms",
+            f"put={st['puts']} commit={st['commits']} 寫入筆數={st['rows']} 平均每批={st['rows'] / commits:.1f} "
+            f"最大一批={st['max_batch']} 等待寫入={pending}",
+            f"commit 平均={st['commit_ns'] / commits / 1e6:.2f}ms 上一次={st['last_commit_ns'] / 1e6:.2f}ms "
+            f"錯誤={st['errors']}"]
+
+
+def configure(path=None, interval=None):
+    global PATH, COMMIT_INTERVAL
+    if interval is not None:
+        COMMIT_INTERVAL = float(interval)
+    if path:
+        PATH = path
+        wallet.watch(_on_change)
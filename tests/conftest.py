@@ -0,0 +1,5 @@
+# server 的模組都放在最上層（沒有 package）：讓測試可以直接 import outbound、store…
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
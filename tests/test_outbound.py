@@ -0,0 +1,90 @@
+"""送出佇列的慢速 client 處理：超過 SOFT_LIMIT 丟非必要的行、必要的照收，超過 HARD_LIMIT 斷線"""
+import threading
+
+import pytest
+
+import outbound
+
+
+class StuckSocket:
+    """對方完全不收：writer 的 sendall 卡住，佇列只進不出，直到 shutdown"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.shut = False
+        self.sent = []
+
+    def sendall(self, data):
+        self.release.wait()
+        if self.shut:
+            raise OSError("shut down")
+        self.sent.append(data)
+
+    def shutdown(self, how):
+        self.shut = True
+        self.release.set()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def limits():
+    saved = outbound.SOFT_LIMIT, outbound.HARD_LIMIT, outbound.COALESCE
+    outbound.configure(soft_limit=100, hard_limit=300, coalesce=True)
+    yield
+    outbound.configure(soft_limit=saved[0], hard_limit=saved[1], coalesce=saved[2])
+
+
+@pytest.fixture
+def stuck():
+    sock = StuckSocket()
+    conn = outbound.Connection(sock, ("test", 0))
+    yield sock, conn
+    conn.close()
+
+
+def test_fill_to_hard_limit(limits, stuck):
+    sock, conn = stuck
+    dropped = outbound._totals["dropped"]
+    disconnects = outbound._totals["slow_disconnects"]
+
+    outbound.send_line(conn, "a" * 59)                    # writer 拿走後卡在 sendall，仍算在 pending
+    outbound.send_line(conn, "b" * 49)
+    assert conn.pending == 110 and not conn.closed
+
+    # 超過 SOFT_LIMIT：非必要的廣播丟掉，必要的照收
+    outbound.send_line(conn, "看熱鬧", essential=False)
+    outbound.broadcast([conn], "有人進房", essential=False)
+    assert conn.dropped == 2
+    assert outbound._totals["dropped"] == dropped + 2
+    outbound.send_line(conn, "c" * 99)
+    assert conn.pending == 210 and not conn.closed
+
+    # 再收一筆就超過 HARD_LIMIT：判定卡死，斷線
+    outbound.send_line(conn, "d" * 99)
+    assert conn.closed and sock.shut
+    assert conn.pending == 210
+    assert outbound._totals["slow_disconnects"] == disconnects + 1
+
+    # 斷線之後什麼都不收
+    outbound.send_line(conn, "e")
+    assert conn.pending == 210
+
+
+def test_batch_drops_optional_lines_over_soft_limit(limits, stuck):
+    sock, conn = stuck
+    outbound.send_line(conn, "a" * 119)
+    assert conn.pending == 120
+
+    with outbound.batch():
+        outbound.send_line(conn, "輪到你", essential=True)
+        outbound.send_line(conn, "旁觀訊息", essential=False)
+        outbound.send_line(conn, "手牌", essential=True)
+    assert conn.dropped == 1
+    assert conn.pending == 120 + len("輪到你\n手牌\n".encode())
+    assert not conn.closed
+
+    sock.release.set()                                     # 對方開始收：全部送完
+    conn.close()
+    assert b"".join(sock.sent) == b"a" * 119 + "\n輪到你\n手牌\n".encode()
@@ -0,0 +1,59 @@
+"""--db 的當機復原：group commit 還沒寫進去的結算會掉，但已經寫進去的保留中籌碼（held）啟動時要退回"""
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+import store
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = textwrap.dedent("""
+    import os, signal, sys, types
+    sys.path.insert(0, {root!r})
+    import store, wallet
+
+    store.configure(path={db!r}, interval=0.001)
+
+    def player(name):
+        account = wallet.open_account(types.SimpleNamespace(name=name))
+        store.login(name, account)
+        return account
+
+    alice, bob = player("alice"), player("bob")
+    a = wallet.reserve(alice, 100, "test")
+    b = wallet.reserve(bob, 100, "test")
+    wallet.settle(b, 300)                     # bob 贏了，已經寫進去
+    wallet.reserve(bob, 50, "test")           # 又下了一注，還沒開
+    assert store.flush()
+
+    store.COMMIT_INTERVAL = 60                # 之後的變動都等不到 commit
+    wallet.settle(a, 300)                     # alice 贏了，但還在 _pending
+    os.kill(os.getpid(), signal.SIGKILL)
+""")
+
+
+def _rows(db):
+    conn = sqlite3.connect(db)
+    try:
+        return {name: (balance, held) for name, balance, held in
+                conn.execute("SELECT name, balance, held FROM players")}
+    finally:
+        conn.close()
+
+
+def test_settle_then_crash_before_group_commit(tmp_path, monkeypatch):
+    db = str(tmp_path / "casino.db")
+    child = subprocess.run([sys.executable, "-c", CHILD.format(root=ROOT, db=db)], cwd=ROOT)
+    assert child.returncode == -signal.SIGKILL
+
+    # 磁碟上是最後一次 commit 的樣子：alice 的結算掉了，下注還算保留中
+    assert _rows(db) == {"alice": (900, 100), "bob": (1150, 50)}
+
+    # 啟動時退回保留中的籌碼；重跑不會多退
+    monkeypatch.setattr(store, "PATH", db)
+    assert store.release_held() == [("alice", 100), ("bob", 50)]
+    assert store.release_held() == []
+    assert _rows(db) == {"alice": (1000, 0), "bob": (1200, 0)}
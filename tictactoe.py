@@ -1,6 +1,12 @@
-import threading
+import sys
 
-lock = threading.RLock()
+import eventlog
+import games
+import latency
+import locks
+import metrics
+import roomtable
+from outbound import broadcast, send_line
 
 WINS = [
     (0,1,2),(3,4,5),(6,7,8),
@@ -11,64 +17,75 @@ WINS = [
 MAX_PLAYERS = 2
 MAX_ROOMS = 50
 
+_ROUNDS_STARTED = metrics.counter("casino_rounds_started_total", "開始的牌局", game="TTT")
+_ROUNDS_FINISHED = metrics.counter("casino_rounds_finished_total", "打完的牌局（中止的不算）", game="TTT")
 
-def send_line(conn, msg: str):
-    if conn is None:
-        return
-    if msg is None:
-        msg = ""
-    if not msg.endswith("\n"):
-        msg += "\n"
-    try:
-        conn.sendall(msg.encode())
-    except:
-        pass
 
+class Room:
+    # 只有兩個座位：不另外建 Seat 物件，座位 i 的資料放在平行的 list 裡，
+    # 找自己的位置就是 conns 的 in / index（C 實作），比逐一比對 Seat 快、也比較省記憶體
+    __slots__ = ("room_id", "lock", "board", "conns", "names", "rematch", "turn", "active")
+
+    def __init__(self, room_id: int):
+        self.room_id = room_id
+        self.lock = locks.RoomLock("TTT", room_id)
+        self.board = [" "] * 9
+        self.conns = []           # 第 0 位是 X、第 1 位是 O
+        self.names = []           # 和 conns 同位置
+        self.rematch = 0          # 已同意重賽的座位：bit i = 第 i 位
+        self.turn = 0
+        self.active = False
+
+    def is_empty(self):
+        return not self.conns
+
+    def occupancy(self):
+        return len(self.conns)
 
-def _broadcast(room, msg):
-    for c in list(room["players"]):
-        send_line(c, msg)
+    def status(self):
+        return len(self.conns), self.active
 
+    def snapshot(self):
+        """給 snapshot.py：在房間 lock 裡呼叫，只複製狀態"""
+        return {"seats": list(self.names), "board": "".join(self.board),
+                "turn": self.turn, "active": self.active, "stakes": []}
 
-def _new_room_state(room_id: int):
-    return {
-        "room_id": room_id,
-        "board": [" "] * 9,
-        "players": [],   # conn
-        "names": {},
-        "turn": 0,
-        "active": False,
-        "waiting_rematch": set()
-    }
 
+def _broadcast(room, msg, essential=True):
+    broadcast(room.conns, msg, essential)
 
-rooms = {i: _new_room_state(i) for i in range(1, MAX_ROOMS + 1)}
+
+rooms = roomtable.RoomTable("TTT", Room, MAX_PLAYERS)    # 第一次有人進來才建立，空房會被回收
+
+
+def room_lock(room_id: int):
+    """給 server 用：在這把 lock 內送出一個指令的所有輸出"""
+    room = rooms.get(room_id)
+    return room.lock if room else None
 
 
-def pick_room():
-    with lock:
-        for rid, room in rooms.items():
-            if len(room["players"]) < MAX_PLAYERS:
-                return rid
-    return 1
+def pick_room(accept=None):
+    # 查人數索引，不拿任何房間的 lock：只是挑一間建議的，真的進房時 add_player() 會在房間 lock 內再檢查一次
+    # 還沒建立（或已回收）的房間當作空房
+    return rooms.first_free(MAX_ROOMS, accept) or 1
 
 
 def _hard_reset(room_id: int):
     room = rooms.get(room_id)
     if not room:
         return
-    keep_players = list(room["players"])
-    keep_names = dict(room["names"])
-    rooms[room_id] = _new_room_state(room_id)
-    rooms[room_id]["players"] = keep_players
-    rooms[room_id]["names"] = keep_names
+    # 座位保留，棋局重來
+    room.board = [" "] * 9
+    room.turn = 0
+    room.active = False
+    room.rematch = 0
 
 
 def _show_board(room_id: int):
     room = rooms.get(room_id)
     if not room:
         return
-    b = room["board"]
+    b = room.board
     view = (
         f"{b[0]}|{b[1]}|{b[2]}\n"
         f"-+-+-\n"
@@ -81,16 +98,14 @@ def _show_board(room_id: int):
 
 def _broadcast_turn(room_id: int):
     room = rooms.get(room_id)
-    if not room or not room["players"]:
+    if not room or not room.conns:
         return
-    cur = room["players"][room["turn"]]
-    name = room["names"].get(cur, "?")
-    mark = "X" if room["turn"] == 0 else "O"
-    _broadcast(room, f"【TTT#{room_id}】輪到 {name} ({mark})：MOVE <0-8>（輸入 HELP 看指令）")
+    mark = "X" if room.turn == 0 else "O"
+    _broadcast(room, f"【TTT#{room_id}】輪到 {room.names[room.turn]} ({mark})：MOVE <0-8>（輸入 HELP 看指令）")
 
 
 def _check_win(room):
-    b = room["board"]
+    b = room.board
     for a, b1, c in WINS:
         if b[a] != " " and b[a] == b[b1] == b[c]:
             return True
@@ -98,17 +113,18 @@ def _check_win(room):
 
 
 def _check_draw(room):
-    return all(x != " " for x in room["board"])
+    return all(x != " " for x in room.board)
 
 
 def _start_match(room_id: int):
     room = rooms.get(room_id)
     if not room:
         return
-    room["board"] = [" "] * 9
-    room["turn"] = 0
-    room["active"] = True
-    room["waiting_rematch"] = set()
+    room.board = [" "] * 9
+    room.turn = 0
+    room.active = True
+    _ROUNDS_STARTED.inc()
+    room.rematch = 0
     _broadcast(room, f"【TTT#{room_id}】遊戲開始！")
     _show_board(room_id)
     _broadcast_turn(room_id)
@@ -124,25 +140,23 @@ def remove_conn(conn, room_id: int):
 
 
 def add_player(conn, name, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
-            send_line(conn, "【TTT】房間不存在")
-            return False
-
-        if conn in room["players"]:
+    if room_id < 1:
+        send_line(conn, "【TTT】房間不存在")
+        return False
+    with rooms.opened(room_id) as room:
+        if conn in room.conns:
             send_line(conn, f"你已在井字棋房間 {room_id}")
             return True
 
-        if len(room["players"]) >= MAX_PLAYERS:
+        if len(room.conns) >= MAX_PLAYERS:
             send_line(conn, f"井字棋房間 {room_id} 已滿（最多 {MAX_PLAYERS} 人）")
             return False
 
-        room["players"].append(conn)
-        room["names"][conn] = name
-        _broadcast(room, f"【TTT#{room_id}】{name} 進入房間 ({len(room['players'])}/{MAX_PLAYERS})")
+        room.conns.append(conn)
+        room.names.append(name)
+        _broadcast(room, f"【TTT#{room_id}】{name} 進入房間 ({len(room.conns)}/{MAX_PLAYERS})", essential=False)
 
-        if len(room["players"]) == MAX_PLAYERS:
+        if len(room.conns) == MAX_PLAYERS:
             _start_match(room_id)
         else:
             send_line(conn, "等待另一位玩家加入...（可先輸入 HELP 看指令）")
@@ -151,16 +165,14 @@ def add_player(conn, name, room_id: int):
 
 
 def remove_player(conn, room_id: int):
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             return
-        if conn in room["players"]:
-            name = room["names"].get(conn, "?")
-            room["players"].remove(conn)
-            room["names"].pop(conn, None)
-            room["waiting_rematch"].discard(conn)
-            _broadcast(room, f"【TTT#{room_id}】{name} 離開房間")
+        if conn in room.conns:
+            idx = room.conns.index(conn)
+            del room.conns[idx]
+            left = room.names.pop(idx)
+            _broadcast(room, f"【TTT#{room_id}】{left} 離開房間")
 
         _hard_reset(room_id)
 
@@ -173,14 +185,15 @@ def handle_command(player, raw, room_id: int):
     if not parts:
         return
 
-    with lock:
-        room = rooms.get(room_id)
-        if not room:
+    with rooms.locked(room_id) as room:
+        if room is None:
             send_line(conn, "【TTT】房間不存在")
             return
-        if conn not in room["players"]:
+        conns = room.conns
+        if conn not in conns:
             send_line(conn, f"你不在井字棋房間 {room_id}")
             return
+        idx = conns.index(conn)
 
         op = parts[0].upper()
 
@@ -193,12 +206,12 @@ def handle_command(player, raw, room_id: int):
             return
 
         if op == "REMATCH":
-            if len(room["players"]) != 2:
+            if len(conns) != 2:
                 send_line(conn, "目前人數不足，無法重賽")
                 return
-            room["waiting_rematch"].add(conn)
+            room.rematch |= 1 << idx
             send_line(conn, "你已同意重賽，等待對手...")
-            if len(room["waiting_rematch"]) == 2:
+            if room.rematch == 0b11:
                 _broadcast(room, f"【TTT#{room_id}】雙方同意重賽！")
                 _start_match(room_id)
             return
@@ -207,12 +220,11 @@ def handle_command(player, raw, room_id: int):
             send_line(conn, "未知指令：輸入 HELP 查看")
             return
 
-        if not room["active"]:
+        if not room.active:
             send_line(conn, "遊戲尚未開始或已結束（可輸入 REMATCH 重賽）")
             return
 
-        cur = room["players"][room["turn"]]
-        if conn != cur:
+        if idx != room.turn:
             send_line(conn, "不是你的回合")
             return
 
@@ -230,26 +242,30 @@ def handle_command(player, raw, room_id: int):
             send_line(conn, "MOVE 位置必須在 0~8")
             return
 
-        if room["board"][pos] != " ":
+        if room.board[pos] != " ":
             send_line(conn, "該位置已被下過")
             return
 
-        mark = "X" if room["turn"] == 0 else "O"
-        room["board"][pos] = mark
+        mark = "X" if room.turn == 0 else "O"
+        room.board[pos] = mark
 
         _show_board(room_id)
 
         if _check_win(room):
             _broadcast(room, f"【TTT#{room_id}】{name} ({mark}) 獲勝！")
-            room["active"] = False
+            room.active = False
+            _ROUNDS_FINISHED.inc()
             _broadcast(room, "輸入 REMATCH 可重賽")
-            return
-
-        if _check_draw(room):
+        elif _check_draw(room):
             _broadcast(room, f"【TTT#{room_id}】平手！")
-            room["active"] = False
+            room.active = False
+            _ROUNDS_FINISHED.inc()
             _broadcast(room, "輸入 REMATCH 可重賽")
-            return
+        else:
+            room.turn = 1 - room.turn
+            _broadcast_turn(room_id)
+        eventlog.emit("TTT", room_id, "MOVE", name, str(pos), room)
+
 
-        room["turn"] = 1 - room["turn"]
-        _broadcast_turn(room_id)
+games.register("TTT", sys.modules[__name__])
+latency.register("TTT", ("HELP", "?", "REMATCH", "MOVE"))
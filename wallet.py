@@ -0,0 +1,261 @@
+"""籌碼錢包：玩家餘額的所有變動都走這裡
+
+每個玩家一個 Account，各有自己的一把 lock：不同玩家的下注 / 結算不會互相等，也不用拿整個遊戲的 lock。
+下注分兩步：
+- reserve()：把籌碼從可用餘額移到「保留中」，拿到一張 Hold（餘額不足就是 None，檢查和扣款是同一步）；
+  帶 game 時下注與之後還給玩家的籌碼記進該遊戲的 metrics
+- 結算時 settle(hold, payout)（下注輸掉；贏了連同派彩一起入帳）或 refund(hold)（原數退回）
+同一張 Hold 只能結一次。每一筆變動記在 ledger（記憶體裡最近 LEDGER_SIZE 筆），ADMIN WALLET 可以查帳。
+
+lock 順序：房間 lock -> 帳戶 lock（帳戶 lock 裡不會再拿房間 lock；開戶 / 銷戶才碰帳戶表的 lock）。
+"""
+import collections
+import itertools
+import time
+
+import locks
+import metrics
+
+START_BALANCE = 1000
+LEDGER_SIZE = 100000
+
+# ledger 一筆：(序號, 時間, 帳戶, 種類, 金額, 之後的可用餘額, 之後的保留中, 原因)
+# 存的是普通 tuple（每注都要記兩筆，namedtuple 建起來貴很多），讀的時候才包成 Entry
+Entry = collections.namedtuple("Entry", "seq ts account kind amount balance held reason")
+ledger = collections.deque(maxlen=LEDGER_SIZE)
+
+_seq = itertools.count(1)       # next() 在 CPython 是原子的，記帳不用另外的 lock
+_ids = itertools.count(1)
+_accounts = {}                  # account id -> Account（開著的帳戶）
+_accounts_lock = locks.Lock("wallet.accounts")
+_closed = {"accounts": 0, "base": 0, "won": 0, "lost": 0}    # 已銷戶的帳戶累計（查帳用）
+_watchers = []                  # fn(account)：餘額變了（game worker 用來通知 gateway）
+_chips = {}                     # game -> (下注, 還給玩家) 的 metrics.Counter
+
+
+class Account:
+    __slots__ = ("id", "owner", "lock", "balance", "held", "holds", "base", "won", "lost")
+
+    def __init__(self, owner, balance: int):
+        self.id = next(_ids)
+        self.owner = owner          # Player / ProxyPlayer（顯示名字用）
+        self.lock = locks.Lock(f"wallet#{self.id}")
+        self.balance = balance      # 可用餘額
+        self.held = 0               # reserve 了還沒結算的
+        self.holds = 0              # 還沒結算的 Hold 張數
+        # 查帳：balance + held == base + won - lost
+        self.base = balance         # 開戶 / SYNC 帶進來的
+        self.won = 0                # 派彩與 credit
+        self.lost = 0               # settle 掉的下注
+
+    @property
+    def name(self):
+        return getattr(self.owner, "name", None) or f"#{self.id}"
+
+    def consistent(self) -> bool:
+        return (self.balance >= 0 and self.held >= 0
+                and self.balance + self.held == self.base + self.won - self.lost)
+
+
+class Hold:
+    """reserve() 拿到的一筆保留中的籌碼"""
+
+    __slots__ = ("account", "amount", "reason", "game", "done")
+
+    def __init__(self, account, amount: int, reason: str, game=None):
+        self.account = account
+        self.amount = amount
+        self.reason = reason
+        self.game = game            # 哪個遊戲的下注（metrics 分遊戲統計）
+        self.done = False
+
+
+def _chip_counters(game: str):
+    pair = _chips.get(game)
+    if pair is None:
+        pair = _chips.setdefault(game, (
+            metrics.counter("casino_chips_wagered_total", "下注的籌碼（reserve）", game=game),
+            metrics.counter("casino_chips_paid_total", "還給玩家的籌碼（派彩含本金、退回）", game=game)))
+    return pair
+
+
+def _record(account, kind, amount, reason):
+    # 在帳戶 lock 裡呼叫：同一個帳戶的紀錄順序和餘額一致
+    ledger.append((next(_seq), time.time(), account.id, kind, amount, account.balance, account.held, reason))
+
+
+def _changed(account):
+    for fn in _watchers:
+        fn(account)
+
+
+# ====== 開戶 / 銷戶 ======
+def open_account(owner, balance=None, reason: str = "") -> Account:
+    balance = START_BALANCE if balance is None else balance
+    account = Account(owner, balance)
+    with _accounts_lock:
+        _accounts[account.id] = account
+    with account.lock:
+        _record(account, "OPEN", balance, reason)
+    return account
+
+
+def close_account(account, reason: str = ""):
+    """連線結束 / 轉交給別的 process；還沒結算的 Hold 應該已經由遊戲退掉"""
+    with account.lock:
+        _record(account, "CLOSE", account.balance, reason)
+    with _accounts_lock:
+        if _accounts.pop(account.id, None) is not None:
+            _closed["accounts"] += 1
+            _closed["base"] += account.base
+            _closed["won"] += account.won
+            _closed["lost"] += account.lost
+    locks.forget(account.lock.name)
+
+
+# ====== 下注與結算 ======
+def reserve(account, amount: int, reason: str, game=None):
+    """從可用餘額保留 amount；不夠就回傳 None（game 給了就記進該遊戲的下注統計）"""
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    with account.lock:
+        if account.balance < amount:
+            return None
+        account.balance -= amount
+        account.held += amount
+        account.holds += 1
+        _record(account, "RESERVE", amount, reason)
+    _changed(account)
+    if game is not None:
+        _chip_counters(game)[0].inc(amount)
+    return Hold(account, amount, reason, game)
+
+
+def settle(hold, payout: int = 0, reason=None) -> int:
+    """結算一張 Hold：下注的籌碼不再退回，payout（含本金）入帳；回傳之後的可用餘額"""
+    account = hold.account
+    with account.lock:
+        if hold.done:
+            raise ValueError(f"hold already closed: {hold.reason}")
+        hold.done = True
+        account.held -= hold.amount
+        account.holds -= 1
+        account.lost += hold.amount
+        account.balance += payout
+        account.won += payout
+        _record(account, "SETTLE", payout - hold.amount, reason or hold.reason)
+        balance = account.balance
+    _changed(account)
+    if hold.game is not None and payout:
+        _chip_counters(hold.game)[1].inc(payout)
+    return balance
+
+
+def refund(hold, reason=None) -> int:
+    """原數退回一張 Hold；回傳之後的可用餘額"""
+    account = hold.account
+    with account.lock:
+        if hold.done:
+            raise ValueError(f"hold already closed: {hold.reason}")
+        hold.done = True
+        account.held -= hold.amount
+        account.holds -= 1
+        account.balance += hold.amount
+        _record(account, "REFUND", hold.amount, reason or hold.reason)
+        balance = account.balance
+    _changed(account)
+    if hold.game is not None:
+        _chip_counters(hold.game)[1].inc(hold.amount)
+    return balance
+
+
+def credit(account, amount: int, reason: str) -> int:
+    with account.lock:
+        account.balance += amount
+        account.won += amount
+        _record(account, "CREDIT", amount, reason)
+        balance = account.balance
+    _changed(account)
+    return balance
+
+
+def sync(account, balance: int, reason: str, held=None):
+    """餘額由別的 process 決定（gateway 收到遊戲 worker 的結果、--workers 轉交連線）
+
+    held 不是 None 時連保留中的金額一起照抄（gateway 鏡像 worker 裡還沒結算的下注）。
+    """
+    with account.lock:
+        held = account.held if held is None else held
+        delta = balance + held - account.balance - account.held
+        if balance == account.balance and held == account.held:
+            return
+        account.balance = balance
+        account.held = held
+        account.base += delta
+        _record(account, "SYNC", delta, reason)
+    _changed(account)
+
+
+def refund_held(account, reason: str) -> int:
+    """保留中的全部退回可用餘額（保管那些下注的遊戲 worker 不見了）；回傳退回的金額"""
+    with account.lock:
+        amount = account.held
+        if not amount:
+            return 0
+        account.held = 0
+        account.holds = 0
+        account.balance += amount
+        _record(account, "REFUND", amount, reason)
+    _changed(account)
+    return amount
+
+
+def watch(fn):
+    _watchers.append(fn)
+
+
+# ====== 查帳 ======
+def accounts():
+    with _accounts_lock:
+        return list(_accounts.values())
+
+
+def find(name: str):
+    for account in accounts():
+        if account.name == name:
+            return account
+    return None
+
+
+def audit():
+    """回傳 (總計 dict, 對不上的帳戶)；每個帳戶在自己的 lock 裡看，不會停住整個 server"""
+    totals = {"accounts": 0, "balance": 0, "held": 0, "holds": 0, "won": 0, "lost": 0}
+    bad = []
+    for account in accounts():
+        with account.lock:
+            totals["accounts"] += 1
+            totals["balance"] += account.balance
+            totals["held"] += account.held
+            totals["holds"] += account.holds
+            totals["won"] += account.won
+            totals["lost"] += account.lost
+            if not account.consistent():
+                bad.append(account)
+    with _accounts_lock:
+        totals["won"] += _closed["won"]
+        totals["lost"] += _closed["lost"]
+        totals["closed"] = _closed["accounts"]
+    return totals, bad
+
+
+def history(account_id: int, limit: int = 20):
+    rows = [e for e in list(ledger) if e[2] == account_id]
+    return [Entry._make(e) for e in rows[-limit:]]
+
+
+def configure(start_balance=None, ledger_size=None):
+    global START_BALANCE, ledger
+    if start_balance is not None:
+        START_BALANCE = int(start_balance)
+    if ledger_size is not None:
+        ledger = collections.deque(ledger, maxlen=max(1, int(ledger_size)))